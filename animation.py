@@ -0,0 +1,220 @@
+import math
+import queue
+from concurrent.futures import as_completed
+
+import numpy as np
+from PySide6.QtGui import QImage, QPixmap
+from PySide6.QtCore import QThread, Signal
+
+from canvas import TiledCanvas
+from layers import LayerStack
+from export import png_frame, gif_frame, write_apng, write_gif, write_png
+from workers import process_pool
+
+FRAME_DURATION = 100  # ms
+ONION_OPACITY = 0.35
+ONION_TINTS = {"before": (255, 64, 64), "after": (64, 160, 255)}
+ANIMATION_FILTERS = {"gif": "Animated GIF (*.gif)", "apng": "Animated PNG (*.png *.apng)",
+                     "sheet": "Sprite Sheet (*.png)"}
+
+
+class Frame:
+    def __init__(self, layers, duration=FRAME_DURATION):
+        self.layers = layers
+        self.duration = duration
+
+
+# ARGB32 pixels as a pixmap
+def pixmap(pixels):
+    height, width = pixels.shape
+    return QPixmap.fromImage(QImage(pixels.data, width, height, width * 4, QImage.Format_ARGB32))
+
+
+# pixels mixed halfway towards a tint and faded, for onion skinning
+def tinted(pixels, tint, opacity=ONION_OPACITY):
+    channels = pixels.view(np.uint8).reshape(pixels.shape + (4,)).copy()
+    channels[..., [2, 1, 0]] = (channels[..., [2, 1, 0]].astype(np.uint16) + tint) // 2
+    channels[..., 3] = channels[..., 3] * opacity
+    return channels.view(np.uint32).reshape(pixels.shape)
+
+
+# the frames of an animation, each with its own layer stack. whole-frame
+# pixmaps for playback and tinted ones for the onion skin are made once per
+# version of a frame and kept until it changes, so flipping through frames
+# or playing them back only swaps pixmaps
+class Timeline:
+    def __init__(self, layers):
+        self.width = layers.width
+        self.height = layers.height
+        self.frames = [Frame(layers)]
+        self.current = 0
+        self.structure_version = 0
+        self.onion_skin = False
+        # id(frame) -> (frame, version, pixmap)
+        self.pixmaps = {}
+        self.onion_pixmaps = {side: {} for side in ONION_TINTS}
+
+    @property
+    def frame(self):
+        return self.frames[self.current]
+
+    # changes whenever any frame, its duration or the frame order does
+    def version(self):
+        return self.structure_version, tuple((frame.duration, frame.layers.version()) for frame in self.frames)
+
+    @property
+    def nbytes(self):
+        return sum(frame.layers.nbytes for frame in self.frames)
+
+    # index of the frame a layer canvas belongs to, None if it's gone
+    def frame_of(self, canvas):
+        for index, frame in enumerate(self.frames):
+            if any(layer.canvas is canvas for layer in frame.layers.layers):
+                return index
+        return None
+
+    # insert a frame after the current one and make it current. it's empty,
+    # or a copy of the current frame
+    def add_frame(self, duplicate=False):
+        current = self.frame
+        layers = current.layers.copy() if duplicate else LayerStack(self.width, self.height, palette=current.layers.palette)
+        self.current += 1
+        self.frames.insert(self.current, Frame(layers, current.duration))
+        self.structure_version += 1
+        return self.frame
+
+    def remove_frame(self, index):
+        frame = self.frames.pop(index)
+        self.current = min(self.current, len(self.frames) - 1)
+        self.pixmaps.pop(id(frame), None)
+        for cache in self.onion_pixmaps.values():
+            cache.pop(id(frame), None)
+        self.structure_version += 1
+        return frame
+
+    def move_frame(self, index, delta):
+        target = index + delta
+        if not 0 <= target < len(self.frames):
+            return
+        self.frames.insert(target, self.frames.pop(index))
+        self.structure_version += 1
+        if self.current == index:
+            self.current = target
+        elif self.current == target:
+            self.current = index
+
+    def cached(self, cache, frame, make):
+        version = frame.layers.version()
+        entry = cache.get(id(frame))
+        if entry is None or entry[0] is not frame or entry[1] != version:
+            entry = (frame, version, make())
+            cache[id(frame)] = entry
+        return entry[2]
+
+    def frame_pixmap(self, frame):
+        return self.cached(self.pixmaps, frame, lambda: pixmap(frame.layers.pixels()))
+
+    # the frame before or after the current one, tinted, or None at the ends
+    def onion_pixmap(self, side):
+        index = self.current + (-1 if side == "before" else 1)
+        if not 0 <= index < len(self.frames):
+            return None
+        frame = self.frames[index]
+        return self.cached(self.onion_pixmaps[side], frame,
+                           lambda: pixmap(tinted(frame.layers.pixels(), ONION_TINTS[side])))
+
+
+# one frame per image, e.g. from a gif. a duration of None keeps the default.
+# only builds tiles, so it's safe on a worker thread
+def timeline_from_images(images, durations):
+    width, height = images[0].width(), images[0].height()
+    timeline = Timeline(LayerStack(width, height, TiledCanvas.from_qimage(images[0])))
+    for image in images[1:]:
+        timeline.frames.append(Frame(LayerStack(width, height, TiledCanvas.from_qimage(image))))
+    for frame, duration in zip(timeline.frames, durations):
+        if duration:
+            frame.duration = duration
+    return timeline
+
+
+# columns of a roughly square sprite sheet
+def sheet_columns(count):
+    return max(1, math.ceil(math.sqrt(count)))
+
+
+def write_sheet(file_path, frames, width, height, scale_factor, columns):
+    rows = math.ceil(len(frames) / columns)
+    sheet = np.zeros((rows * height, columns * width), np.uint32)
+    for index, pixels in enumerate(frames):
+        row, column = divmod(index, columns)
+        sheet[row * height:(row + 1) * height, column * width:(column + 1) * width] = pixels
+    with open(file_path, "wb") as f:
+        write_png(f, lambda y, count: sheet[y:y + count], sheet.shape[1], sheet.shape[0], scale_factor)
+
+
+# background animation export. the frames are flattened on the GUI thread
+# when the job is submitted; a worker thread then has each frame encoded on
+# the process pool and writes the file, reporting back through signals
+class AnimationExporter(QThread):
+    progress = Signal(int, int)  # frames encoded, total frames
+    exported = Signal(str)
+    failed = Signal(str)
+
+    def __init__(self):
+        super().__init__()
+        self.jobs = queue.Queue()
+
+    # kind is "gif", "apng" or "sheet"
+    def submit(self, timeline, kind, file_path, scale_factor=1, columns=None):
+        frames = [frame.layers.pixels() for frame in timeline.frames]
+        durations = [frame.duration for frame in timeline.frames]
+        self.jobs.put((kind, file_path, frames, durations, scale_factor, columns or sheet_columns(len(frames))))
+        if not self.isRunning():
+            self.start()
+
+    def stop(self):
+        if self.isRunning():
+            self.jobs.put(None)
+            self.wait()
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            kind, file_path = job[:2]
+            try:
+                self.export(*job)
+            except Exception as e:
+                self.failed.emit(f"Export of {file_path} failed: {e}")
+            else:
+                self.exported.emit(file_path)
+
+    def export(self, kind, file_path, frames, durations, scale_factor, columns):
+        height, width = frames[0].shape
+        if kind == "sheet":
+            write_sheet(file_path, frames, width, height, scale_factor, columns)
+            return
+        encode = gif_frame if kind == "gif" else png_frame
+        futures = {process_pool().submit(encode, pixels, scale_factor): index for index, pixels in enumerate(frames)}
+        encoded = [None] * len(frames)
+        for done, future in enumerate(as_completed(futures), 1):
+            encoded[futures[future]] = future.result()
+            self.progress.emit(done, len(frames))
+        width, height = width * scale_factor, height * scale_factor
+        if kind == "gif":
+            write_gif(file_path, encoded, width, height, durations)
+        else:
+            with open(file_path, "wb") as f:
+                write_apng(f, encoded, width, height, durations)
+
+
+exporter = None
+
+
+# the animation exporter shared by every editor window
+def animation_exporter():
+    global exporter
+    if exporter is None:
+        exporter = AnimationExporter()
+    return exporter
@@ -0,0 +1,185 @@
+import glob
+import os
+import queue
+import time
+from PySide6.QtCore import QThread, QTimer, QLockFile, QSettings, QStandardPaths, Signal
+
+from project import ProjectError, ProjectFile, load_project
+
+AUTOSAVE_INTERVAL = 60  # seconds, 0 turns autosave off
+RETRY_DELAY = 1000  # ms to wait when a stroke is in progress
+
+
+def autosave_dir():
+    data = QStandardPaths.writableLocation(QStandardPaths.GenericDataLocation)
+    return os.path.join(data, "pixel-art-editor", "autosave")
+
+
+def autosave_interval():
+    return int(QSettings("pixel-art-editor", "pixel-art-editor").value("autosave/interval", AUTOSAVE_INTERVAL))
+
+
+def set_autosave_interval(seconds):
+    QSettings("pixel-art-editor", "pixel-art-editor").setValue("autosave/interval", seconds)
+
+
+# files a crash in the middle of a full rewrite leaves next to an autosave
+def remove_temp_files(pattern):
+    for path in glob.glob(pattern + ".tmp"):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+# autosaves left behind by sessions that didn't exit cleanly, newest first.
+# a running session holds a lock file, so its autosaves are never offered.
+# a dead session's half-written rewrites are swept on the way
+def recoverable_files(directory=None):
+    directory = directory or autosave_dir()
+    files = []
+    for lock_path in glob.glob(os.path.join(directory, "*.lock")):
+        session = lock_path[:-len(".lock")]
+        lock = QLockFile(lock_path)
+        # only a dead owner makes a lock stale, not its age
+        lock.setStaleLockTime(0)
+        if not lock.tryLock(0):
+            continue
+        lock.unlock()
+        remove_temp_files(session + "-*.pxproj")
+        files += glob.glob(session + "-*.pxproj")
+    return sorted(files, key=os.path.getmtime, reverse=True)
+
+
+def discard_files(paths):
+    sessions = set()
+    for path in paths:
+        sessions.add(path.rsplit("-", 1)[0])
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    # drop the lock file of a session once nothing of it is left
+    for session in sessions:
+        remove_temp_files(session + "-*.pxproj")
+        if not glob.glob(session + "-*.pxproj"):
+            try:
+                os.remove(session + ".lock")
+            except OSError:
+                pass
+
+
+# periodic autosave of every open editor. each tick captures what changed
+# since the last autosave on the GUI thread (only dirty tiles are copied), and
+# a worker thread compresses and appends it to the editor's own autosave
+# project file. the files are removed again on a clean exit
+class AutosaveService(QThread):
+    saved = Signal(str)
+    failed = Signal(str)
+
+    def __init__(self, interval=None, directory=None):
+        super().__init__()
+        self.directory = directory or autosave_dir()
+        self.session = os.path.join(self.directory, f"session-{os.getpid()}-{int(time.time())}")
+        self.lock = None
+        # editor -> [autosave project file, version last saved]
+        self.editors = {}
+        self.next_file = 1
+        self.jobs = queue.Queue()
+        self.timer = QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.tick)
+        self.set_interval(autosave_interval() if interval is None else interval)
+
+    def set_interval(self, seconds):
+        self.interval = seconds
+        if seconds > 0:
+            self.timer.start(seconds * 1000)
+        else:
+            self.timer.stop()
+
+    # autosave this editor from now on
+    def watch(self, editor):
+        if editor in self.editors:
+            return
+        self.editors[editor] = [ProjectFile(f"{self.session}-{self.next_file}.pxproj"), None]
+        self.next_file += 1
+
+    # the editor was closed, its autosave goes away with it
+    def forget(self, editor):
+        watched = self.editors.pop(editor, None)
+        if watched is not None:
+            self.jobs.put(("remove", watched[0], None))
+            self.ensure_running()
+
+    def tick(self):
+        if any(editor.is_drawing for editor in self.editors):
+            self.timer.start(RETRY_DELAY)
+            return
+        # skip when the last autosave is still queued
+        if self.jobs.empty():
+            for editor in self.editors:
+                self.save(editor)
+        if self.interval > 0:
+            self.timer.start(self.interval * 1000)
+
+    # queue an autosave of the editor if it changed since the last one. an
+    # offloaded editor can't change until it's restored
+    def save(self, editor):
+        project, saved_version = self.editors[editor]
+        if editor.is_offloaded():
+            return
+        version = (editor.timeline, editor.timeline.version())
+        if version != saved_version:
+            self.take_lock()
+            self.editors[editor][1] = version
+            self.jobs.put(("write", project, project.capture(editor)))
+            self.ensure_running()
+
+    def take_lock(self):
+        if self.lock is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self.lock = QLockFile(self.session + ".lock")
+            self.lock.setStaleLockTime(0)
+            self.lock.tryLock(0)
+
+    def ensure_running(self):
+        if not self.isRunning():
+            self.start()
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            kind, project, snapshot = job
+            try:
+                if kind == "write":
+                    project.write(snapshot)
+                    self.saved.emit(project.path)
+                else:
+                    if os.path.exists(project.path):
+                        os.remove(project.path)
+                    remove_temp_files(glob.escape(project.path))
+            except (ProjectError, OSError) as e:
+                self.failed.emit(str(e))
+
+    # clean exit: finish pending work and remove this session's files
+    def stop(self):
+        self.timer.stop()
+        for editor in list(self.editors):
+            self.forget(editor)
+        if self.isRunning():
+            self.jobs.put(None)
+            self.wait()
+        if self.lock is not None:
+            self.lock.unlock()
+            self.lock = None
+
+
+# project recovered from an autosave file, ready to hand to set_project
+def recover(path):
+    project = load_project(path)
+    # saving should ask for a real file, not write back into the autosave
+    project.path = None
+    return project
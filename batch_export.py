@@ -0,0 +1,121 @@
+import argparse
+import glob
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# run without a display; must be set before Qt is loaded
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PySide6.QtGui import QGuiApplication, QImage
+
+from export import export_image
+
+# usage: python batch_export.py "export-tests/*.png" --scale 1 4 20 --format png jpg -o out/
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Rescale and export sprites without opening the editor.")
+    parser.add_argument("inputs", nargs="+", help="input files or glob patterns")
+    parser.add_argument("-s", "--scale", nargs="+", type=int, default=[1], help="scale factors (default 1)")
+    parser.add_argument("-f", "--format", nargs="+", choices=["png", "jpg"], default=["png"], help="output formats (default png)")
+    parser.add_argument("-o", "--output", default="export", help="output directory (default ./export)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="worker processes (default: cpu count)")
+    return parser.parse_args(argv)
+
+
+def expand_inputs(patterns):
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) or ([pattern] if os.path.isfile(pattern) else [])
+        for path in matches:
+            if os.path.isfile(path) and path not in paths:
+                paths.append(path)
+    return paths
+
+
+# output name for each input: its stem, or stem-ext when two inputs share a stem
+def output_names(paths):
+    stems = [os.path.splitext(os.path.basename(path))[0] for path in paths]
+    names = []
+    for path, stem in zip(paths, stems):
+        if stems.count(stem) > 1:
+            stem += "-" + os.path.splitext(path)[1].lstrip(".")
+        names.append(stem)
+    return names
+
+
+def init_worker():
+    # image format plugins need an application object in each process
+    global app
+    app = QGuiApplication([])
+
+
+# decode one file once and write every scale/format combination of it. an
+# output that fails is reported and the rest are still written.
+# returns (path, outputs, output pixels, bytes written, error)
+def export_file(path, name, scales, formats, output_dir):
+    image = QImage(path)
+    if image.isNull():
+        return path, [], 0, 0, "cannot load image"
+    outputs = []
+    errors = []
+    pixels = 0
+    written = 0
+    for scale in scales:
+        for fmt in formats:
+            out_path = os.path.join(output_dir, f"{name}@{scale}x.{fmt}")
+            try:
+                if not export_image(image, out_path, scale):
+                    errors.append(f"failed to write {out_path}")
+                    continue
+            except (ValueError, OSError) as e:
+                errors.append(f"failed to write {out_path}: {e}")
+                continue
+            outputs.append(out_path)
+            pixels += image.width() * scale * image.height() * scale
+            written += os.path.getsize(out_path)
+    return path, outputs, pixels, written, "; ".join(errors) or None
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    paths = expand_inputs(args.inputs)
+    if not paths:
+        print("no input files matched", file=sys.stderr)
+        return 1
+    os.makedirs(args.output, exist_ok=True)
+
+    start = time.perf_counter()
+    failures = 0
+    total_outputs = 0
+    total_pixels = 0
+    total_bytes = 0
+    # spawn rather than fork so workers never inherit Qt state
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=max(1, args.jobs), mp_context=context, initializer=init_worker) as pool:
+        futures = [pool.submit(export_file, path, name, args.scale, args.format, args.output)
+                   for path, name in zip(paths, output_names(paths))]
+        for done, future in enumerate(as_completed(futures), 1):
+            path, outputs, pixels, written, error = future.result()
+            if error:
+                failures += 1
+                print(f"[{done}/{len(paths)}] {path}: {error}", file=sys.stderr)
+            else:
+                print(f"[{done}/{len(paths)}] {path} -> {len(outputs)} files")
+            total_outputs += len(outputs)
+            total_pixels += pixels
+            total_bytes += written
+
+    elapsed = time.perf_counter() - start
+    print(f"exported {total_outputs} files from {len(paths) - failures}/{len(paths)} inputs in {elapsed:.2f} s")
+    if elapsed > 0:
+        print(f"throughput: {len(paths) / elapsed:.1f} inputs/s, {total_outputs / elapsed:.1f} files/s, "
+              f"{total_pixels / elapsed / 1e6:.1f} Mpx/s, {total_bytes / elapsed / 1e6:.1f} MB/s written")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,211 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# run without a display; must be set before Qt is loaded
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import numpy as np
+from PySide6.QtWidgets import QApplication
+from PySide6.QtGui import QColor, QMouseEvent
+from PySide6.QtCore import Qt, QEvent, QPointF, QRectF
+
+from editor import PixelArtEditor
+from printing import printer_pixels, render_escpos, escpos_cache
+from raster import DITHER_MODES
+
+# usage: python benchmark.py --sizes 64 512 4096 --brush-sizes 1 8 20
+#        python benchmark.py --save-baseline baseline.json
+#        python benchmark.py --compare baseline.json --threshold 0.25
+
+VIEW_SIZE = 600
+STROKE_EVENTS = 50  # mouse moves per stroke
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Time the editor's hot paths headlessly.")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[64, 512, 4096], help="canvas sizes (default 64 512 4096)")
+    parser.add_argument("--brush-sizes", nargs="+", type=int, default=[1, 8, 20], help="brush sizes (default 1 8 20)")
+    parser.add_argument("-n", "--repeat", type=int, default=20, help="samples per benchmark (default 20)")
+    parser.add_argument("--indexed", action="store_true", help="use indexed-color canvases")
+    parser.add_argument("--only", nargs="+", help="run only benchmarks whose name starts with one of these")
+    parser.add_argument("--save-baseline", metavar="FILE", help="write the results to FILE")
+    parser.add_argument("--compare", metavar="FILE", help="compare against a saved baseline and fail on regressions")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown / memory growth over the baseline (default 0.25)")
+    return parser.parse_args(argv)
+
+
+# deliver a synthetic mouse event at canvas pixel (x, y) the way Qt would
+def send_mouse(editor, kind, x, y):
+    pos = QPointF(editor.mapFromScene(QPointF(x + 0.5, y + 0.5)))
+    buttons = Qt.NoButton if kind == QEvent.MouseButtonRelease else Qt.LeftButton
+    event = QMouseEvent(kind, pos, QPointF(editor.viewport().mapToGlobal(pos)), Qt.LeftButton, buttons, Qt.NoModifier)
+    QApplication.sendEvent(editor.viewport(), event)
+
+
+def make_editor(size, brush_size=1, indexed=False):
+    editor = PixelArtEditor(size, size, indexed)
+    editor.resize(VIEW_SIZE, VIEW_SIZE)
+    editor.show()
+    editor.fitInView(QRectF(0, 0, size, size), Qt.KeepAspectRatio)
+    editor.set_brush_size(brush_size)
+    QApplication.processEvents()
+    return editor
+
+
+# a wobbly stroke across the whole canvas, as the canvas points of each mouse move
+def stroke_points(size, seed):
+    rng = np.random.default_rng(seed)
+    t = np.linspace(0.05, 0.95, STROKE_EVENTS + 1)
+    xs = t * size
+    ys = (0.5 + 0.4 * np.sin(t * 6 + seed)) * size + rng.normal(0, size * 0.01, len(t))
+    return np.clip(xs, 0, size - 1).astype(int), np.clip(ys, 0, size - 1).astype(int)
+
+
+def draw_stroke(editor, xs, ys):
+    send_mouse(editor, QEvent.MouseButtonPress, xs[0], ys[0])
+    for x, y in zip(xs[1:], ys[1:]):
+        send_mouse(editor, QEvent.MouseMove, x, y)
+    send_mouse(editor, QEvent.MouseButtonRelease, xs[-1], ys[-1])
+
+
+# every benchmark yields (name, setup, run): setup() builds fresh state and
+# returns what run(state) needs, only run is timed
+def benchmarks(size, brush_sizes, tmp_dir, indexed=False):
+    # indexed runs are reported under their own names
+    mode = "/indexed" if indexed else ""
+    for brush_size in brush_sizes:
+        def setup(brush_size=brush_size):
+            return make_editor(size, brush_size, indexed)
+
+        def click(editor):
+            send_mouse(editor, QEvent.MouseButtonPress, size // 2, size // 2)
+            send_mouse(editor, QEvent.MouseButtonRelease, size // 2, size // 2)
+
+        def move(editor):
+            draw_stroke(editor, *stroke_points(size, 0))
+
+        yield f"setPixel/{size}px/brush{brush_size}{mode}", setup, click
+        yield f"draw_line/{size}px/brush{brush_size}{mode}", setup, move
+
+    def scribbled():
+        editor = make_editor(size, 3, indexed)
+        for seed in range(4):
+            draw_stroke(editor, *stroke_points(size, seed))
+        return editor
+
+    def fill(editor):
+        editor.fill_switch()
+        editor.current_color = QColor(255, 0, 0) if editor.current_color != QColor(255, 0, 0) else QColor(0, 0, 255)
+        send_mouse(editor, QEvent.MouseButtonPress, 0, 0)
+        send_mouse(editor, QEvent.MouseButtonRelease, 0, 0)
+
+    def undo_redo(editor):
+        # undo() logs every call, keep that out of the report
+        with contextlib.redirect_stdout(io.StringIO()):
+            editor.undo()
+            editor.redo()
+
+    def export(editor):
+        editor.export_canvas(os.path.join(tmp_dir, "benchmark.png"), 1)
+
+    def encode(editor):
+        escpos_cache.clear()
+        render_escpos(printer_pixels(editor.canvas, lut=editor.layers.lut), DITHER_MODES[0])
+
+    yield f"flood_fill/{size}px{mode}", scribbled, fill
+    yield f"undo_redo/{size}px{mode}", scribbled, undo_redo
+    yield f"export_png/{size}px{mode}", scribbled, export
+    yield f"print_encode/{size}px{mode}", scribbled, encode
+
+
+def percentile(samples, q):
+    return float(np.percentile(samples, q)) * 1000
+
+
+def run_benchmark(setup, run, repeat):
+    state = setup()
+    run(state)  # warm up caches and lazy imports
+    QApplication.processEvents()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run(state)
+        samples.append(time.perf_counter() - start)
+        # let queued repaints happen outside the timed part
+        QApplication.processEvents()
+    # peak python/numpy allocation of one more run, measured separately since
+    # tracing slows everything down
+    tracemalloc.start()
+    run(state)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    state.close()
+    return {
+        "mean_ms": float(np.mean(samples)) * 1000,
+        "p50_ms": percentile(samples, 50),
+        "p90_ms": percentile(samples, 90),
+        "p99_ms": percentile(samples, 99),
+        "max_ms": float(np.max(samples)) * 1000,
+        "peak_kb": peak / 1024,
+    }
+
+
+# names whose median time or peak memory grew by more than threshold
+def regressions(results, baseline, threshold):
+    found = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for key in ("p50_ms", "peak_kb"):
+            if base[key] > 0 and result[key] > base[key] * (1 + threshold):
+                found.append(f"{name}: {key} {base[key]:.2f} -> {result[key]:.2f} (+{(result[key] / base[key] - 1) * 100:.0f}%)")
+    return found
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    app = QApplication.instance() or QApplication([])
+
+    results = {}
+    print(f"{'benchmark':<32} {'mean':>9} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9} {'peak mem':>10}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size in args.sizes:
+            for name, setup, run in benchmarks(size, args.brush_sizes, tmp_dir, args.indexed):
+                if args.only and not any(name.startswith(prefix) for prefix in args.only):
+                    continue
+                result = results[name] = run_benchmark(setup, run, args.repeat)
+                print(f"{name:<32} {result['mean_ms']:7.2f}ms {result['p50_ms']:7.2f}ms {result['p90_ms']:7.2f}ms "
+                      f"{result['p99_ms']:7.2f}ms {result['max_ms']:7.2f}ms {result['peak_kb'] / 1024:8.1f}MB")
+    print(f"process peak rss: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"baseline saved to {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        found = regressions(results, baseline, args.threshold)
+        if found:
+            print(f"{len(found)} regression(s) over {args.threshold * 100:.0f}%:")
+            for line in found:
+                print("  " + line)
+            return 1
+        print(f"no regressions against {args.compare}")
+    return 0
+
+
+if __name__ == "__main__":
+    # exit without tearing Qt down, PySide can crash at interpreter shutdown
+    sys.stdout.flush()
+    os._exit(main())
@@ -0,0 +1,314 @@
+from PySide6.QtWidgets import QGraphicsItem
+from PySide6.QtGui import QImage
+from PySide6.QtCore import QRect, QRectF
+import numpy as np
+
+TILE_SIZE = 128
+
+
+# sparse tiled pixel store. tiles are allocated on first write; positions that
+# were never written read as one shared, read-only empty tile, and uniform tiles
+# can share one read-only solid tile per value (copied on write)
+class TiledCanvas:
+    def __init__(self, width, height, tile_size=TILE_SIZE, dtype=np.uint32):
+        self.width = width
+        self.height = height
+        self.tile_size = tile_size
+        self.dtype = dtype
+        self.tiles = {}
+        self.solids = {}
+        self.empty = self.solid_tile(0)
+        # bumped on every change; tile_versions has the version each tile
+        # position last changed at, so savers can find what changed since
+        self.version = 0
+        self.tile_versions = {}
+
+    def rect(self):
+        return QRect(0, 0, self.width, self.height)
+
+    # shared read-only tile filled with value
+    def solid_tile(self, value):
+        tile = self.solids.get(value)
+        if tile is None:
+            tile = np.full((self.tile_size, self.tile_size), value, self.dtype)
+            tile.flags.writeable = False
+            self.solids[value] = tile
+        return tile
+
+    def tile(self, key):
+        return self.tiles.get(key, self.empty)
+
+    def is_shared(self, key):
+        tile = self.tiles.get(key)
+        return tile is None or not tile.flags.writeable
+
+    def mark_changed(self, key):
+        self.version += 1
+        self.tile_versions[key] = self.version
+
+    # tile positions changed after the given version
+    def changed_since(self, version):
+        return [key for key, changed in self.tile_versions.items() if changed > version]
+
+    # tile that can be modified in place, copying a shared one first
+    def tile_for_write(self, key):
+        self.mark_changed(key)
+        tile = self.tiles.get(key)
+        if tile is None or not tile.flags.writeable:
+            tile = self.tile(key).copy()
+            self.tiles[key] = tile
+        return tile
+
+    def set_tile(self, key, tile):
+        self.mark_changed(key)
+        if tile is None:
+            self.tiles.pop(key, None)
+        else:
+            self.tiles[key] = tile
+
+    # part of the canvas covered by a tile
+    def tile_rect(self, key):
+        x, y = key[0] * self.tile_size, key[1] * self.tile_size
+        return QRect(x, y, min(self.tile_size, self.width - x), min(self.tile_size, self.height - y))
+
+    # every tile position overlapping rect
+    def keys_in(self, rect):
+        rect = rect & self.rect()
+        if rect.isEmpty():
+            return []
+        size = self.tile_size
+        return [(tx, ty)
+                for ty in range(rect.top() // size, rect.bottom() // size + 1)
+                for tx in range(rect.left() // size, rect.right() // size + 1)]
+
+    def all_keys(self):
+        return self.keys_in(self.rect())
+
+    def read(self, rect):
+        rect = rect & self.rect()
+        out = np.zeros((rect.height(), rect.width()), self.dtype)
+        for key in self.keys_in(rect):
+            tile = self.tiles.get(key)
+            if tile is None:
+                continue
+            part = self.tile_rect(key) & rect
+            tx, ty = part.x() % self.tile_size, part.y() % self.tile_size
+            out[part.y() - rect.y():part.bottom() + 1 - rect.y(), part.x() - rect.x():part.right() + 1 - rect.x()] = \
+                tile[ty:ty + part.height(), tx:tx + part.width()]
+        return out
+
+    # pixels at the crossings of columns xs and rows ys (both sorted), i.e. a
+    # nearest-neighbor resample, gathered straight from the allocated tiles
+    def sample(self, xs, ys):
+        size = self.tile_size
+        out = np.zeros((len(ys), len(xs)), self.dtype)
+        row_bounds = np.searchsorted(ys, np.arange(0, self.height + size, size))
+        col_bounds = np.searchsorted(xs, np.arange(0, self.width + size, size))
+        for (tx, ty), tile in self.tiles.items():
+            r0, r1 = row_bounds[ty], row_bounds[ty + 1]
+            c0, c1 = col_bounds[tx], col_bounds[tx + 1]
+            if r0 == r1 or c0 == c1:
+                continue
+            out[r0:r1, c0:c1] = tile[np.ix_(ys[r0:r1] - ty * size, xs[c0:c1] - tx * size)]
+        return out
+
+    # copy pixels in with their top left corner at (x, y). all-zero parts that
+    # land on unallocated tiles are skipped so the canvas stays sparse
+    def write(self, x, y, pixels):
+        h, w = pixels.shape
+        rect = QRect(x, y, w, h) & self.rect()
+        for key in self.keys_in(rect):
+            part = self.tile_rect(key) & rect
+            src = pixels[part.y() - y:part.bottom() + 1 - y, part.x() - x:part.right() + 1 - x]
+            if key not in self.tiles and not src.any():
+                continue
+            tx, ty = part.x() % self.tile_size, part.y() % self.tile_size
+            self.tile_for_write(key)[ty:ty + part.height(), tx:tx + part.width()] = src
+
+    # set the pixels selected by a bool mask covering rect to value in one bulk
+    # write per tile. tiles that aren't allocated yet are skipped unless allocate
+    def write_mask(self, rect, mask, value, allocate=True):
+        clipped = rect & self.rect()
+        for key in self.keys_in(clipped):
+            if not allocate and key not in self.tiles:
+                continue
+            part = self.tile_rect(key) & clipped
+            sub = mask[part.y() - rect.y():part.bottom() + 1 - rect.y(), part.x() - rect.x():part.right() + 1 - rect.x()]
+            if not sub.any():
+                continue
+            tx, ty = part.x() % self.tile_size, part.y() % self.tile_size
+            self.tile_for_write(key)[ty:ty + part.height(), tx:tx + part.width()][sub] = value
+
+    # swap uniform tiles for shared ones, dropping empty tiles entirely
+    def compact(self, keys):
+        for key in keys:
+            tile = self.tiles.get(key)
+            if tile is None or not tile.flags.writeable:
+                continue
+            part = self.tile_rect(key)
+            valid = tile[:part.height(), :part.width()]
+            value = valid.flat[0]
+            if (valid == value).all():
+                if value:
+                    self.tiles[key] = self.solid_tile(value.item())
+                else:
+                    del self.tiles[key]
+
+    def clear(self):
+        for key in self.tiles:
+            self.mark_changed(key)
+        self.tiles.clear()
+
+    # independent canvas with the same pixels. shared read-only tiles stay shared
+    def copy(self):
+        canvas = TiledCanvas(self.width, self.height, self.tile_size, self.dtype)
+        canvas.tiles = {key: tile.copy() if tile.flags.writeable else tile for key, tile in self.tiles.items()}
+        return canvas
+
+    @property
+    def nbytes(self):
+        return sum(tile.nbytes for tile in self.tiles.values() if tile.flags.writeable)
+
+    # lut maps the pixels of an indexed canvas to ARGB
+    def to_qimage(self, rect=None, lut=None):
+        pixels = self.read(self.rect() if rect is None else rect)
+        if lut is not None:
+            pixels = lut[pixels]
+        h, w = pixels.shape
+        return QImage(pixels.data, w, h, w * 4, QImage.Format_ARGB32).copy()
+
+    @classmethod
+    def from_qimage(cls, image, tile_size=TILE_SIZE):
+        image = image.convertToFormat(QImage.Format_ARGB32)
+        return cls.from_pixels(image_array(image), tile_size)
+
+    # ARGB32 pixels, or palette indices as uint8
+    @classmethod
+    def from_pixels(cls, pixels, tile_size=TILE_SIZE):
+        h, w = pixels.shape
+        canvas = cls(w, h, tile_size, pixels.dtype.type)
+        canvas.write(0, 0, pixels)
+        canvas.compact(list(canvas.tiles))
+        return canvas
+
+
+# QImage sharing a tile's pixel buffer, so QPainter can draw straight into it.
+# the tile array has to outlive the image. indexed (uint8) tiles need the
+# palette as a color table
+def tile_image(tile, color_table=None):
+    h, w = tile.shape
+    if tile.dtype == np.uint8:
+        image = QImage(tile.data, w, h, w, QImage.Format_Indexed8)
+        image.setColorTable(color_table)
+        return image
+    return QImage(tile.data, w, h, w * 4, QImage.Format_ARGB32)
+
+
+# pixels that aren't transparent: non-zero indices, or ARGB with some alpha
+def opaque_mask(tile):
+    if tile.dtype == np.uint8:
+        return tile != 0
+    return (tile >> 24) != 0
+
+
+# scene item showing one allocated tile. it paints only the exposed part of
+# its tile, so an edit only repaints the rect it damaged
+class TileItem(QGraphicsItem):
+    def __init__(self, rect, tile, color_table=None):
+        super().__init__()
+        self.rect = rect
+        self.setPos(rect.x(), rect.y())
+        self.setZValue(1)
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption)
+        self.set_tile(tile, color_table)
+
+    def set_tile(self, tile, color_table=None):
+        self.tile = tile
+        self.image = tile_image(tile, color_table)
+        self.update()
+
+    def set_color_table(self, color_table):
+        self.image.setColorTable(color_table)
+        self.update()
+
+    def boundingRect(self):
+        return QRectF(0, 0, self.rect.width(), self.rect.height())
+
+    def paint(self, painter, option, widget=None):
+        exposed = option.exposedRect.toAlignedRect() & QRect(0, 0, self.rect.width(), self.rect.height())
+        if not exposed.isEmpty():
+            painter.drawImage(exposed, self.image, exposed)
+
+
+# keeps one TileItem per allocated tile of a canvas in a scene. an indexed
+# canvas is shown through color_table
+class TileItems:
+    def __init__(self, scene, canvas, color_table=None):
+        self.scene = scene
+        self.canvas = canvas
+        self.color_table = color_table
+        self.items = {}
+        self.reset(canvas, color_table)
+
+    def reset(self, canvas, color_table=None):
+        for item in self.items.values():
+            self.scene.removeItem(item)
+        self.items.clear()
+        self.canvas = canvas
+        self.color_table = color_table
+        for key in canvas.tiles:
+            self.sync(key)
+
+    # recolor every tile of an indexed canvas without touching its pixels
+    def set_color_table(self, color_table):
+        self.color_table = color_table
+        for item in self.items.values():
+            item.set_color_table(color_table)
+
+    # make the item for key match the canvas, returning it if it already existed
+    def sync(self, key):
+        tile = self.canvas.tiles.get(key)
+        item = self.items.get(key)
+        if tile is None:
+            if item is not None:
+                self.scene.removeItem(self.items.pop(key))
+            return None
+        if item is None:
+            item = TileItem(self.canvas.tile_rect(key), tile, self.color_table)
+            self.items[key] = item
+            self.scene.addItem(item)
+            return None
+        if item.tile is not tile:
+            item.set_tile(tile, self.color_table)
+            return None
+        return item
+
+    def set_visible(self, visible):
+        for item in self.items.values():
+            item.setVisible(visible)
+
+    # schedule a repaint of a damaged rect given in canvas coordinates
+    def refresh(self, rect):
+        for key in self.canvas.keys_in(rect):
+            item = self.sync(key)
+            if item is not None:
+                item.update(QRectF((rect & item.rect).translated(-item.rect.topLeft())))
+
+    def refresh_keys(self, keys):
+        for key in keys:
+            item = self.sync(key)
+            if item is not None:
+                item.update()
+
+
+# rect covered by a brush of the given size centered on (x, y)
+def brush_rect(x, y, size):
+    half_size = size // 2 + 1
+    return QRect(x - half_size, y - half_size, size + 2, size + 2)
+
+
+# numpy view of an ARGB32 QImage's pixels, one uint32 per pixel. the view
+# aliases the image buffer, so don't hold on to it after the image is replaced
+def image_array(image):
+    rows = np.frombuffer(image.bits(), np.uint32).reshape(image.height(), image.bytesPerLine() // 4)
+    return rows[:, :image.width()]
@@ -0,0 +1,55 @@
+from PySide6.QtCore import QRect
+import numpy as np
+
+from canvas import TILE_SIZE, TiledCanvas, opaque_mask
+
+
+# which pixels hold drawn content, kept as a sparse tiled bool canvas laid out
+# like the pixel canvas. strokes write their brush mask into it in bulk
+class CoverageMask:
+    def __init__(self, width, height, tile_size=TILE_SIZE):
+        self.mask = TiledCanvas(width, height, tile_size, dtype=bool)
+
+    # mark (or unmark) the pixels of a stroke mask covering rect
+    def set_mask(self, rect, mask, add=True):
+        self.mask.write_mask(rect, mask, add, allocate=add)
+
+    # recompute tiles from the canvas, counting any non-transparent pixel as drawn
+    def sync(self, canvas, keys):
+        for key in keys:
+            tile = canvas.tiles.get(key)
+            self.mask.set_tile(key, None if tile is None else opaque_mask(tile))
+
+    def clear(self):
+        self.mask.clear()
+
+    def __contains__(self, point):
+        x, y = point
+        if not (0 <= x < self.mask.width and 0 <= y < self.mask.height):
+            return False
+        size = self.mask.tile_size
+        return bool(self.mask.tile((x // size, y // size))[y % size, x % size])
+
+    # covered part of each allocated tile, clipped to the canvas
+    def parts(self):
+        for key, tile in self.mask.tiles.items():
+            rect = self.mask.tile_rect(key)
+            yield rect, tile[:rect.height(), :rect.width()]
+
+    def count(self):
+        return sum(int(np.count_nonzero(tile)) for _, tile in self.parts())
+
+    def is_empty(self):
+        return not any(tile.any() for _, tile in self.parts())
+
+    # bounding box of drawn content, empty QRect if nothing is drawn
+    def bounds(self):
+        bounds = QRect()
+        for rect, tile in self.parts():
+            rows = np.flatnonzero(tile.any(axis=1))
+            if len(rows) == 0:
+                continue
+            cols = np.flatnonzero(tile.any(axis=0))
+            bounds |= QRect(rect.x() + int(cols[0]), rect.y() + int(rows[0]),
+                            int(cols[-1] - cols[0]) + 1, int(rows[-1] - rows[0]) + 1)
+        return bounds
@@ -1,30 +1,150 @@
-import sys
-from PySide6.QtWidgets import *
-from PySide6.QtGui import *
-from PySide6.QtCore import Qt
-
-class InputDialog(QDialog):
-    def __init__(self):
-        super().__init__()
-        self.setWindowTitle("Create New Canvas")
-
-        layout = QFormLayout()
-
-        self.input1 = QLineEdit("64")
-        self.input2 = QLineEdit("64")
-
-        layout.addRow("Width: ", self.input1)
-        layout.addRow("Height: ", self.input2)
-
-        self.buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
-        self.buttons.accepted.connect(self.accept)
-        self.buttons.rejected.connect(self.reject)
-
-        layout.addWidget(self.buttons)
-
-        self.setLayout(layout)
-
-    def getInputs(self):
-        return self.input1.text(), self.input2.text()
-    
-    print()
\ No newline at end of file
+import sys
+from PySide6.QtWidgets import *
+from PySide6.QtGui import *
+from PySide6.QtCore import Qt, QTimer
+import numpy as np
+
+from importer import import_service
+from palette import MAX_COLORS
+
+PREVIEW_SIZE = 320
+
+class InputDialog(QDialog):
+    def __init__(self):
+        super().__init__()
+        self.setWindowTitle("Create New Canvas")
+
+        layout = QFormLayout()
+
+        self.input1 = QLineEdit("64")
+        self.input2 = QLineEdit("64")
+
+        layout.addRow("Width: ", self.input1)
+        layout.addRow("Height: ", self.input2)
+
+        # palette indices instead of full colors, a quarter of the memory
+        self.indexed = QCheckBox("Indexed colors (up to 255)")
+        layout.addRow(self.indexed)
+
+        self.buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        self.buttons.accepted.connect(self.accept)
+        self.buttons.rejected.connect(self.reject)
+
+        layout.addWidget(self.buttons)
+
+        self.setLayout(layout)
+
+    def getInputs(self):
+        return self.input1.text(), self.input2.text()
+
+    def isIndexed(self):
+        return self.indexed.isChecked()
+    
+    print()
+
+
+# photo to pixel art settings with a live preview. every change is sent to
+# the import service after a short pause; the quick median-cut preview shows
+# first and is replaced by the refined result, which OK then takes
+class ImportDialog(QDialog):
+    def __init__(self, file_path, palette):
+        super().__init__()
+        self.setWindowTitle("Import Photo")
+        self.file_path = file_path
+        self.palette = palette
+        self.job = None
+        self.result = None
+
+        layout = QFormLayout()
+
+        self.preview = QLabel("Converting...")
+        self.preview.setAlignment(Qt.AlignCenter)
+        self.preview.setFixedSize(PREVIEW_SIZE, PREVIEW_SIZE)
+        layout.addRow(self.preview)
+
+        self.grid_width = QSpinBox()
+        self.grid_width.setRange(8, 1024)
+        self.grid_width.setValue(64)
+        layout.addRow("Width in pixels: ", self.grid_width)
+
+        self.colors = QSpinBox()
+        self.colors.setRange(2, MAX_COLORS)
+        self.colors.setValue(16)
+        layout.addRow("Colors: ", self.colors)
+
+        self.use_palette = QCheckBox("Use the current palette")
+        layout.addRow(self.use_palette)
+
+        self.indexed = QCheckBox("Indexed colors (up to 255)")
+        self.indexed.setChecked(True)
+        layout.addRow(self.indexed)
+
+        self.buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        self.buttons.accepted.connect(self.accept)
+        self.buttons.rejected.connect(self.reject)
+        layout.addWidget(self.buttons)
+
+        self.setLayout(layout)
+
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(200)
+        self.timer.timeout.connect(self.convert)
+        self.grid_width.valueChanged.connect(self.settings_changed)
+        self.colors.valueChanged.connect(self.settings_changed)
+        self.use_palette.toggled.connect(self.settings_changed)
+        self.use_palette.toggled.connect(lambda checked: self.colors.setEnabled(not checked))
+
+        service = import_service()
+        service.preview.connect(self.show_preview)
+        service.converted.connect(self.show_result)
+        service.failed.connect(self.show_failure)
+        self.finished.connect(self.disconnect_service)
+        self.convert()
+
+    def settings_changed(self):
+        self.result = None
+        self.buttons.button(QDialogButtonBox.Ok).setEnabled(False)
+        self.timer.start()
+
+    def convert(self):
+        self.result = None
+        self.buttons.button(QDialogButtonBox.Ok).setEnabled(False)
+        palette = self.palette if self.use_palette.isChecked() else None
+        self.job = import_service().submit(self.file_path, self.grid_width.value(), self.colors.value(), palette)
+
+    def show_image(self, indices, colors):
+        lut = np.zeros(256, np.uint32)
+        lut[1:len(colors) + 1] = colors
+        pixels = lut[indices]
+        height, width = pixels.shape
+        image = QImage(pixels.data, width, height, width * 4, QImage.Format_ARGB32)
+        self.preview.setPixmap(QPixmap.fromImage(image).scaled(PREVIEW_SIZE, PREVIEW_SIZE, Qt.KeepAspectRatio))
+
+    def show_preview(self, job, indices, colors):
+        if job == self.job:
+            self.show_image(indices, colors)
+
+    def show_result(self, job, indices, colors):
+        if job == self.job:
+            self.show_image(indices, colors)
+            self.result = (indices, colors)
+            self.buttons.button(QDialogButtonBox.Ok).setEnabled(True)
+
+    def show_failure(self, job, message):
+        if job == self.job:
+            self.preview.setText(f"Cannot import this image:\n{message}")
+
+    # the service outlives the dialog
+    def disconnect_service(self):
+        service = import_service()
+        service.preview.disconnect(self.show_preview)
+        service.converted.disconnect(self.show_result)
+        service.failed.disconnect(self.show_failure)
+
+    # palette indices (0 transparent) and the ARGB colors they refer to
+    def getResult(self):
+        return self.result
+
+    def isIndexed(self):
+        return self.indexed.isChecked()
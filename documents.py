@@ -0,0 +1,90 @@
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+from PySide6.QtCore import QSettings
+
+from project import ProjectFile, load_project
+
+MEMORY_CAP = 512  # MB of pixels and undo history the open canvases may keep in memory
+
+
+def memory_cap():
+    return int(QSettings("pixel-art-editor", "pixel-art-editor").value("documents/memory_cap", MEMORY_CAP))
+
+
+def set_memory_cap(megabytes):
+    QSettings("pixel-art-editor", "pixel-art-editor").setValue("documents/memory_cap", megabytes)
+
+
+def document_nbytes(editor):
+    return editor.timeline.nbytes + editor.history.nbytes
+
+
+# keeps the open documents under a memory cap. once they use more, the least
+# recently shown ones are spilled to a project file in a temp directory and
+# their pixels and history dropped; showing one reads it back in. the spill
+# file is kept, so spilling the same document again only appends the tiles
+# that changed since
+class DocumentCache:
+    def __init__(self, cap=None):
+        self.cap = (memory_cap() if cap is None else cap) * 1024 * 1024
+        self.recent = OrderedDict()  # editor -> None, least recently shown first
+        self.spills = {}  # editor -> (project file, onion skin on)
+        self.directory = None
+        self.next_file = 1
+
+    def set_cap(self, megabytes):
+        self.cap = megabytes * 1024 * 1024
+
+    # the document was shown; bring its pixels back if they were spilled
+    def touch(self, editor):
+        self.recent[editor] = None
+        self.recent.move_to_end(editor)
+        if editor.is_offloaded():
+            spill, onion_skin = self.spills[editor]
+            project = load_project(spill.path)
+            project.timeline.onion_skin = onion_skin
+            editor.restore(project)
+            # read back, it knows which tiles the file already holds
+            self.spills[editor] = (project, onion_skin)
+
+    def forget(self, editor):
+        self.recent.pop(editor, None)
+        spill = self.spills.pop(editor, None)
+        if spill is not None and os.path.exists(spill[0].path):
+            os.remove(spill[0].path)
+
+    # spill documents, least recently shown first, until the rest fit under
+    # the cap. active is never spilled, nor is a document that's busy.
+    # before_offload(editor) runs first, e.g. to autosave it
+    def trim(self, active, before_offload=None):
+        loaded = [editor for editor in self.recent if not editor.is_offloaded()]
+        total = sum(document_nbytes(editor) for editor in loaded)
+        for editor in loaded:
+            if total <= self.cap:
+                break
+            if editor is active or editor.is_drawing or not editor.isEnabled():
+                continue
+            total -= document_nbytes(editor)
+            if before_offload is not None:
+                before_offload(editor)
+            self.offload(editor)
+
+    def offload(self, editor):
+        spill = self.spills.get(editor)
+        if spill is None:
+            if self.directory is None:
+                self.directory = tempfile.mkdtemp(prefix="pixel-art-editor-")
+            spill = (ProjectFile(os.path.join(self.directory, f"document-{self.next_file}.pxproj")), False)
+            self.next_file += 1
+        self.spills[editor] = (spill[0], editor.timeline.onion_skin)
+        editor.offload(spill[0])
+
+    # clean exit
+    def clear(self):
+        self.recent.clear()
+        self.spills.clear()
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
@@ -1,45 +1,154 @@
+import math
+import os
 import sys
 from PySide6.QtWidgets import *
 from PySide6.QtGui import *
-from PySide6.QtCore import Qt, QEvent, QBuffer, QFileInfo, QPoint, QRectF
-from PIL import Image, ImageFilter, ImageEnhance
-import usb1
-from escpos.printer import Dummy
-import io
+from PySide6.QtCore import Qt, QEvent, QFileInfo, QPoint, QPointF, QRect, QRectF, QSettings, QTimer
+import numpy as np
+
+from canvas import *
+from history import History
+from fill import fill_tiles
+from coverage import CoverageMask
+from export import export_rows
+from printing import print_service
+from raster import DITHER_MODES
+from instrument import instrument, PerfOverlay
+from project import ProjectError, ProjectFile, PROJECT_FILTER
+from layers import LayerStack
+from palette import Palette, used_colors, indexed_canvas, indexed_pixels, argb_canvas, MAX_COLORS
+from animation import Timeline, ONION_TINTS, animation_exporter, timeline_from_images
+from stroke import brush_stamp, line_points, polyline_points, stroke_masks, BrushStamp
+
+CHECKER_SIZE = 4
+ZOOM_STEP = 1.1
+MIN_ZOOM = 0.1
+MAX_ZOOM = 64
+GRID_ZOOM = 8  # the pixel grid shows from this zoom on, where zoom snaps to whole screen pixels
+GRID_COLOR = QColor(128, 128, 128, 110)
+PALETTE = ["black", "white", "gray", "red", "green", "blue", "yellow", "purple", "brown"]
+checkerboard_texture = None
+grid_patterns = {}
+# ARGB pixels last cut or copied, shared by every editor so they paste across tabs
+clipboard = None
+
+
+# brush tiling a 2x2 cell checkerboard texture, built once and shared by all editors
+def checkerboard_brush():
+    global checkerboard_texture
+    if checkerboard_texture is None:
+        checkerboard_texture = QPixmap(CHECKER_SIZE * 2, CHECKER_SIZE * 2)
+        checkerboard_texture.fill(QColor(240, 240, 240))
+        with QPainter(checkerboard_texture) as painter:
+            painter.fillRect(CHECKER_SIZE, 0, CHECKER_SIZE, CHECKER_SIZE, QColor(200, 200, 200))
+            painter.fillRect(0, CHECKER_SIZE, CHECKER_SIZE, CHECKER_SIZE, QColor(200, 200, 200))
+    return QBrush(checkerboard_texture)
+
+
+# one grid cell at an integer zoom, lines along its top and left edges.
+# made once per zoom level and tiled over the canvas in screen pixels
+def grid_pattern(zoom):
+    pattern = grid_patterns.get(zoom)
+    if pattern is None:
+        pattern = QPixmap(zoom, zoom)
+        pattern.fill(Qt.transparent)
+        with QPainter(pattern) as painter:
+            painter.fillRect(0, 0, zoom, 1, GRID_COLOR)
+            painter.fillRect(0, 1, 1, zoom - 1, GRID_COLOR)
+        grid_patterns[zoom] = pattern
+    return pattern
+
+
+def pixel_grid_visible():
+    return QSettings("pixel-art-editor", "pixel-art-editor").value("view/grid", True, type=bool)
+
+
+def set_pixel_grid_visible(visible):
+    QSettings("pixel-art-editor", "pixel-art-editor").setValue("view/grid", visible)
+
 
 class PixelArtEditor(QGraphicsView):
-    def __init__(self, width, height):
+    # an indexed canvas stores palette indices instead of ARGB colors
+    def __init__(self, width, height, indexed=False):
         super().__init__()
         self.width = width
         self.height = height
         self.scene = QGraphicsScene()
         self.setScene(self.scene)
         self.setSceneRect(-50, -50, width + 100, height + 100)
-        self.drawn_pixels = set()
-        self.image = QImage(width, height, QImage.Format_ARGB32)
+        self.coverage = CoverageMask(width, height)
         self.current_color = QColor(0, 0, 0)
+        self.palette = [QColor(name) for name in PALETTE]
+        self.layers = LayerStack(width, height, palette=Palette([color.rgba() for color in self.palette]) if indexed else None)
+        self.timeline = Timeline(self.layers)
         self.last_directory = ""
-        self.undo_stack = []
+        # project file this canvas was last saved to or opened from
+        self.project = None
+        self.history = History()
         self.brush_size = 1
+        self.brush_shape = "round"
+        self.custom_stamp = None
+        self.fill_tolerance = 0
+        self.fill_contiguous = True
 
         # keep track of which tool is being used
-        self.states = ["draw_mode_on", "eraser_mode_on", "fill_mode_on", "grab_mode_on"]
+        self.states = ["draw_mode_on", "eraser_mode_on", "fill_mode_on", "grab_mode_on", "select_mode_on"]
         self.state = self.states[0]
 
-        # create checkerboard pattern pixmap
-        self.backgroundPixmap = self.create_checkerboard_pattern(width, height)
-        self.background_item = QGraphicsPixmapItem(self.backgroundPixmap)
-        self.scene.addItem(self.background_item)
-
-        # pixmap for what i draw on the canvas
-        self.image.fill(Qt.transparent)
-        self.pixmap_item = QGraphicsPixmapItem(QPixmap.fromImage(self.image))
-        self.scene.addItem(self.pixmap_item)
+        # transparency checkerboard, painted on demand in drawBackground
+        self.checkerboard_brush = checkerboard_brush()
+
+        # one scene item per allocated tile of what i draw on the canvas
+        self.tile_items = TileItems(self.scene, self.layers.source(), self.color_table())
+
+        # onion skin under the tiles, and a single item playback swaps
+        # prepared pixmaps into
+        self.onion_items = {}
+        for side in ONION_TINTS:
+            item = QGraphicsPixmapItem()
+            item.setZValue(0.5)
+            item.setVisible(False)
+            self.scene.addItem(item)
+            self.onion_items[side] = item
+        self.playback_item = QGraphicsPixmapItem()
+        self.playback_item.setZValue(2)
+        self.playback_item.setVisible(False)
+        self.scene.addItem(self.playback_item)
+        # stand-in for an image that's still being opened
+        self.preview_item = QGraphicsPixmapItem()
+        self.preview_item.setZValue(2)
+        self.preview_item.setVisible(False)
+        self.scene.addItem(self.preview_item)
+        # marquee selection outline, and the lifted pixels that follow the
+        # mouse while a selection is moved
+        self.selection = None
+        self.selection_anchor = None
+        self.selection_item = QGraphicsRectItem()
+        pen = QPen(QColor(0, 0, 0), 0, Qt.DashLine)
+        pen.setCosmetic(True)
+        self.selection_item.setPen(pen)
+        self.selection_item.setZValue(3)
+        self.selection_item.setVisible(False)
+        self.scene.addItem(self.selection_item)
+        self.floating = None
+        self.floating_item = QGraphicsPixmapItem()
+        self.floating_item.setZValue(2.5)
+        self.floating_item.setVisible(False)
+        self.scene.addItem(self.floating_item)
+        self.move_start = None
+        self.playback_pixmaps = None
+        self.playback_index = 0
+        self.playback_timer = QTimer(self)
+        self.playback_timer.setSingleShot(True)
+        self.playback_timer.setTimerType(Qt.PreciseTimer)
+        self.playback_timer.timeout.connect(self.next_playback_frame)
 
         # add scale
         self.setTransformationAnchor(QGraphicsView.NoAnchor)
         self.setResizeAnchor(QGraphicsView.NoAnchor)
         self.scale(10, 10)
+        self.show_grid = pixel_grid_visible()
+        self.pinch_start_zoom = None
 
         self.grabGesture(Qt.PinchGesture)
         
@@ -47,16 +156,43 @@ class PixelArtEditor(QGraphicsView):
         self.is_dragging = False
         self.last_mouse_pos = QPoint()
 
+        # timing readout, created when first shown
+        self.overlay = None
+
+        # stroke points from mouse moves wait here and are rasterized together
+        # once per display frame, so fast mice and tablets don't queue more
+        # work than can be shown
+        self.pending_points = []
+        self.stroke_end = None
+        self.stroke_erasing = False
+        self.frame_timer = QTimer(self)
+        self.frame_timer.setSingleShot(True)
+        self.frame_timer.setTimerType(Qt.PreciseTimer)
+        self.frame_timer.timeout.connect(self.flush_stroke)
+
+    # the active layer, which every tool draws on
+    @property
+    def canvas(self):
+        return self.layers.canvas
+
+    def is_indexed(self):
+        return self.layers.palette is not None
+
+    def color_table(self):
+        return self.layers.palette.color_table() if self.is_indexed() else None
+
+    # what a color is stored as on the canvas: ARGB, or its palette index
+    def pixel_value(self, color):
+        return self.layers.palette.index(color.rgba()) if self.is_indexed() else color.rgba()
+
     def wheelEvent(self, event):
         if event.modifiers() == Qt.AltModifier:
-            zoom_in_factor = 1.1
-            zoom_out_factor = 1 / zoom_in_factor
             delta_x = event.angleDelta().x()
             delta_y = event.angleDelta().y()
             if delta_x > 0 or delta_y > 0:
-                self.scale(zoom_in_factor, zoom_in_factor)
+                self.zoom_by(ZOOM_STEP, event.position().toPoint())
             else:
-                self.scale(zoom_out_factor, zoom_out_factor)
+                self.zoom_by(1 / ZOOM_STEP, event.position().toPoint())
         else:
             super().wheelEvent(event)
 
@@ -68,20 +204,33 @@ class PixelArtEditor(QGraphicsView):
 
     # determines scale for zooming with pinch
     def pinchTriggered(self, gesture):
+        if gesture.state() == Qt.GestureStarted or self.pinch_start_zoom is None:
+            self.pinch_start_zoom = self.zoom_level()
         if gesture.changeFlags() & QPinchGesture.ScaleFactorChanged:
-            factor = gesture.scaleFactor()
-            self.scale(factor, factor)
+            # from the zoom at the start of the pinch, so snapping to whole
+            # pixels doesn't swallow the small steps in between
+            anchor = self.viewport().mapFromGlobal(gesture.centerPoint().toPoint())
+            self.set_zoom(self.pinch_start_zoom * gesture.totalScaleFactor(), anchor)
+        if gesture.state() in (Qt.GestureFinished, Qt.GestureCanceled):
+            self.pinch_start_zoom = None
 
     def mousePressEvent(self, event):
         if event.button() == Qt.LeftButton:
+            self.stop_playback()
             if self.state == "grab_mode_on":
                 self.is_dragging = True
                 self.last_mouse_pos = event.pos()
+            elif self.state == "select_mode_on":
+                self.press_selection(event.pos())
+            elif self.layers.active_layer.locked:
+                pass
             else:
-                # Save the current state to the undo stack
-                self.undo_stack.append(self.image.copy())
+                # start recording the tiles this stroke changes
+                instrument.input()
+                self.history.begin()
                 self.is_drawing = True
                 self.last_mouse_pos = event.pos()
+                self.start_stroke(event.pos())
                 self.setPixel(event)
         super().mousePressEvent(event)
 
@@ -92,8 +241,14 @@ class PixelArtEditor(QGraphicsView):
                 self.last_mouse_pos = event.pos()
                 self.horizontalScrollBar().setValue(self.horizontalScrollBar().value() - delta.x())
                 self.verticalScrollBar().setValue(self.verticalScrollBar().value() - delta.y())
+            elif self.state == "select_mode_on":
+                self.drag_selection(event.pos())
+            elif not self.is_drawing:
+                # the press didn't start an edit, e.g. the layer is locked
+                pass
             elif self.state in ["draw_mode_on", "eraser_mode_on"]:
-                self.draw_line(self.last_mouse_pos, event.pos(), self.state == "eraser_mode_on")
+                instrument.input()
+                self.queue_stroke_point(event.pos())
                 self.last_mouse_pos = event.pos()
             else:
                 self.setPixel(event)
@@ -103,142 +258,394 @@ class PixelArtEditor(QGraphicsView):
     def mouseReleaseEvent(self, event):
         if event.button() == Qt.LeftButton and self.state == "grab_mode_on":
             self.is_dragging = False
+        if event.button() == Qt.LeftButton and self.state == "select_mode_on":
+            self.drop_selection(event.pos())
+        if self.is_drawing:
+            self.flush_stroke()
+            self.stroke_end = None
+            self.end_edit()
         self.is_drawing = False
         super().mouseReleaseEvent(event)
 
-    def create_checkerboard_pattern(self, width, height):
-        size = 4
-        pixmap = QPixmap(width, height)
-        with QPainter(pixmap) as painter:
-            color1 = QColor(240, 240, 240)
-            color2 = QColor(200, 200, 200)
-
-            for y in range(0, height, size):
-                for x in range(0, width, size):
-                    if (x // size + y // size) % 2 == 0:
-                        painter.fillRect(x, y, size, size, color1)
-                    else:
-                        painter.fillRect(x, y, size, size, color2)
-        return pixmap
-    
+    # the canvas pixel under a viewport position, also left of or above it
+    def scene_pixel(self, pos):
+        point = self.mapToScene(pos)
+        return QPoint(math.floor(point.x()), math.floor(point.y()))
+
+    # pressing inside the selection picks it up to move it, anywhere else
+    # starts a new marquee
+    def press_selection(self, pos):
+        point = self.scene_pixel(pos)
+        if self.selection is not None and self.selection.contains(point) and not self.layers.active_layer.locked:
+            self.lift_selection(point)
+        else:
+            self.set_selection(None)
+            self.selection_anchor = point
+
+    def drag_selection(self, pos):
+        point = self.scene_pixel(pos)
+        if self.floating is not None:
+            offset = point - self.move_start
+            self.floating_item.setPos(QPointF(self.selection.topLeft() + offset))
+            self.selection_item.setPos(QPointF(offset))
+        elif self.selection_anchor is not None:
+            anchor = self.selection_anchor
+            self.set_selection(QRect(QPoint(min(anchor.x(), point.x()), min(anchor.y(), point.y())),
+                                     QPoint(max(anchor.x(), point.x()), max(anchor.y(), point.y()))))
+
+    # the selected pixels leave the canvas in one bulk write and follow the
+    # mouse as a single pixmap, so dragging them costs nothing per pixel
+    def lift_selection(self, point):
+        rect = self.selection
+        instrument.input()
+        self.history.begin()
+        self.is_drawing = True
+        self.floating = self.canvas.read(rect)
+        self.move_start = point
+        self.history.touch(self.canvas, rect)
+        self.canvas.write(rect.x(), rect.y(), np.zeros_like(self.floating))
+        self.canvas_changed(rect)
+        self.floating_item.setPixmap(QPixmap.fromImage(tile_image(self.floating, self.color_table())))
+        self.floating_item.setPos(QPointF(rect.topLeft()))
+        self.floating_item.setVisible(True)
+
+    # put the lifted pixels down where they were dragged to. the move is one
+    # undo step holding only the tiles under the old and new rects
+    def drop_selection(self, pos):
+        self.selection_anchor = None
+        if self.floating is None:
+            return
+        target = self.selection.translated(self.scene_pixel(pos) - self.move_start)
+        self.blit(target.topLeft(), self.floating)
+        self.floating = None
+        self.floating_item.setVisible(False)
+        self.floating_item.setPixmap(QPixmap())
+        self.end_edit()
+        self.is_drawing = False
+        self.set_selection(target)
+
+    # copy pixels onto the active layer with their top left at point, as one
+    # read and one write. transparent pixels leave what's underneath, so a
+    # sprite doesn't carry its background box along
+    def blit(self, point, pixels):
+        height, width = pixels.shape
+        rect = QRect(point.x(), point.y(), width, height) & self.canvas.rect()
+        if rect.isEmpty():
+            return
+        part = pixels[rect.y() - point.y():rect.bottom() + 1 - point.y(), rect.x() - point.x():rect.right() + 1 - point.x()]
+        self.history.touch(self.canvas, rect)
+        self.canvas.write(rect.x(), rect.y(), np.where(opaque_mask(part), part, self.canvas.read(rect)))
+        self.canvas_changed(rect)
+
+    # show an edit of the active layer inside rect
+    def canvas_changed(self, rect):
+        self.layers.recomposite(rect)
+        self.coverage.sync(self.layers.source(), self.canvas.keys_in(rect))
+        self.tile_items.refresh(rect)
+
+    # rect is clipped to the canvas; None, or nothing left, deselects
+    def set_selection(self, rect):
+        if rect is not None:
+            rect = rect & QRect(0, 0, self.width, self.height)
+        self.selection = None if rect is None or rect.isEmpty() else rect
+        self.selection_item.setPos(0, 0)
+        if self.selection is not None:
+            self.selection_item.setRect(QRectF(self.selection))
+        self.selection_item.setVisible(self.selection is not None)
+
+    # while a selection is being dragged, the selection shortcuts other than
+    # copy are ignored; the move's undo entry is still open
+    def is_moving(self):
+        return self.floating is not None
+
+    def select_all(self):
+        if not self.is_moving():
+            self.set_selection(QRect(0, 0, self.width, self.height))
+
+    def deselect(self):
+        if not self.is_moving():
+            self.set_selection(None)
+
+    # the selected pixels of the active layer go to the clipboard as ARGB,
+    # so they paste the same into an indexed canvas or another tab
+    def copy_selection(self):
+        global clipboard
+        if self.selection is None:
+            return
+        # lifted pixels are off the canvas until they're dropped
+        pixels = self.floating if self.is_moving() else self.canvas.read(self.selection)
+        clipboard = pixels if self.layers.lut is None else self.layers.lut[pixels]
+
+    def cut_selection(self):
+        if not self.is_moving():
+            self.copy_selection()
+            self.delete_selection()
+
+    def delete_selection(self):
+        if self.selection is None or self.layers.active_layer.locked or self.is_moving():
+            return
+        self.history.begin()
+        self.history.touch(self.canvas, self.selection)
+        self.canvas.write(self.selection.x(), self.selection.y(),
+                          np.zeros((self.selection.height(), self.selection.width()), self.canvas.dtype))
+        self.canvas_changed(self.selection)
+        self.end_edit()
+
+    # paste at the selection's corner, or the top left of what's in view, and
+    # select the pasted pixels so they can be dragged into place
+    def paste(self):
+        if clipboard is None or self.layers.active_layer.locked or self.is_moving():
+            return
+        pixels = clipboard if self.layers.palette is None else indexed_pixels(clipboard, self.layers.palette)
+        if self.selection is not None:
+            point = self.selection.topLeft()
+        else:
+            corner = self.scene_pixel(QPoint(0, 0))
+            point = QPoint(min(max(corner.x(), 0), self.width - 1), min(max(corner.y(), 0), self.height - 1))
+        self.history.begin()
+        self.blit(point, pixels)
+        self.end_edit()
+        self.set_selection(QRect(point.x(), point.y(), pixels.shape[1], pixels.shape[0]))
+
+    # frame time, and the end of event-to-paint latency for pending input
+    def paintEvent(self, event):
+        with instrument.span("paint"):
+            super().paintEvent(event)
+        instrument.painted()
+
+    def set_overlay_visible(self, visible):
+        if visible and self.overlay is None:
+            self.overlay = PerfOverlay(self)
+        if self.overlay is not None:
+            self.overlay.setVisible(visible)
+
+    # paint the checkerboard only where the canvas is exposed. the brush is a
+    # tiny texture tiled in scene coordinates, so it scales with the zoom
+    def drawBackground(self, painter, rect):
+        super().drawBackground(painter, rect)
+        area = rect & QRectF(0, 0, self.width, self.height)
+        if not area.isEmpty():
+            painter.fillRect(area, self.checkerboard_brush)
+
+    # the pixel grid, only over the exposed part of the canvas, so its cost
+    # follows the area repainted rather than the canvas size. drawn in screen
+    # pixels with the cached cell for this zoom
+    def drawForeground(self, painter, rect):
+        super().drawForeground(painter, rect)
+        zoom = self.zoom_level()
+        if not self.show_grid or zoom < GRID_ZOOM:
+            return
+        area = rect & QRectF(0, 0, self.width, self.height)
+        if area.isEmpty():
+            return
+        transform = painter.transform()
+        # one screen pixel more, for the lines along the right and bottom edges
+        screen = transform.mapRect(area).toAlignedRect().adjusted(0, 0, 1, 1)
+        origin = transform.map(QPointF(0, 0))
+        painter.save()
+        painter.resetTransform()
+        painter.setBrushOrigin(origin)
+        painter.fillRect(screen, QBrush(grid_pattern(int(zoom))))
+        painter.restore()
+
     def set_brush_size(self, size):
         self.brush_size = size
 
+    def set_brush_shape(self, shape):
+        self.brush_shape = shape
+
+    # use any bool mask as the brush, e.g. a shape cut out of a sprite. it
+    # needs at least one pixel set, or there'd be nothing to stamp
+    def set_custom_brush(self, mask):
+        if not np.any(mask):
+            raise ValueError("a custom brush needs at least one pixel")
+        self.custom_stamp = BrushStamp(mask)
+        self.brush_shape = "custom"
+
+    def set_fill_options(self, tolerance, contiguous):
+        self.fill_tolerance = tolerance
+        self.fill_contiguous = contiguous
+
 
     def setPixel(self, event):
+        if self.layers.active_layer.locked:
+            return
         pos = self.mapToScene(event.pos())
         x = int(pos.x())
         y = int(pos.y())
 
-        painter = QPainter(self.image)
-
         if self.state == "draw_mode_on":
-            painter.setPen(QPen(self.current_color, self.brush_size, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin))
-            painter.drawPoint(x, y)
-            self.update_drawn_pixels(x, y, self.brush_size, add=True)
+            self.paint_stroke([x], [y])
 
         elif self.state == "eraser_mode_on":
-            painter.setPen(QPen(Qt.transparent, self.brush_size, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin))
-            painter.setCompositionMode(QPainter.CompositionMode_Clear)
-            painter.drawPoint(x, y)
-            self.update_drawn_pixels(x, y, self.brush_size, add=False)
+            self.paint_stroke([x], [y], erasing=True)
 
         elif self.state == "fill_mode_on":
-            self.flood_fill(x, y, self.current_color)
-
-        painter.end()
-        self.pixmap_item.setPixmap(QPixmap.fromImage(self.image))
-
-    def update_drawn_pixels(self, x, y, size, add=True):
-        half_size = size // 2
-        for i in range(x - half_size, x + half_size + 1):
-            for j in range(y - half_size, y + half_size + 1):
-                if 0 <= i < self.width and 0 <= j < self.height:
-                    if add:
-                        self.drawn_pixels.add((i, j))
-                    else:
-                        self.drawn_pixels.discard((i, j))
+            if 0 <= x < self.width and 0 <= y < self.height:
+                self.flood_fill(x, y, self.current_color)
+
+    def brush_stamp(self):
+        if self.brush_shape == "custom" and self.custom_stamp is not None:
+            return self.custom_stamp
+        return brush_stamp(self.brush_shape, self.brush_size)
+
+    # stamp the brush at every point with one bulk write per tile it touches
+    def paint_stroke(self, xs, ys, erasing=False):
+        # nothing to erase on tiles that were never drawn on
+        value = 0 if erasing else self.pixel_value(self.current_color)
+        for rect, mask in stroke_masks(np.asarray(xs), np.asarray(ys), self.brush_stamp()):
+            with instrument.span("undo_snapshot"):
+                self.history.touch(self.canvas, rect)
+            with instrument.span("raster"):
+                self.canvas.write_mask(rect, mask, value, allocate=not erasing)
+            with instrument.span("composite"):
+                self.layers.recomposite(rect)
+            if self.layers.passthrough():
+                self.coverage.set_mask(rect, mask, add=not erasing)
+            else:
+                self.coverage.sync(self.layers.source(), self.canvas.keys_in(rect))
+            with instrument.span("tile_refresh"):
+                self.tile_items.refresh(rect)
+
+    def start_stroke(self, pos):
+        point = self.mapToScene(pos)
+        self.pending_points = []
+        self.stroke_end = (int(point.x()), int(point.y()))
+        self.stroke_erasing = self.state == "eraser_mode_on"
+
+    def queue_stroke_point(self, pos):
+        point = self.mapToScene(pos)
+        point = (int(point.x()), int(point.y()))
+        if self.stroke_end is None:
+            self.start_stroke(pos)
+        # moves within the same canvas pixel add nothing to the stroke
+        last = self.pending_points[-1] if self.pending_points else self.stroke_end
+        if point == last:
+            return
+        self.pending_points.append(point)
+        if not self.frame_timer.isActive():
+            refresh_rate = self.screen().refreshRate() or 60
+            self.frame_timer.start(max(1, int(1000 / refresh_rate)))
+
+    # rasterize every segment queued since the last frame in one batch; the
+    # tile updates it makes are painted together in the next repaint
+    def flush_stroke(self):
+        self.frame_timer.stop()
+        if self.layers.active_layer.locked:
+            self.pending_points = []
+        if not self.pending_points:
+            return
+        points = [self.stroke_end] + self.pending_points
+        self.pending_points = []
+        self.stroke_end = points[-1]
+        with instrument.span("stroke_flush"):
+            xs, ys = polyline_points(points)
+            self.paint_stroke(xs, ys, self.stroke_erasing)
 
     def draw_line(self, start_pos, end_pos, erasing=False):
         start_pos = self.mapToScene(start_pos)
         end_pos = self.mapToScene(end_pos)
-
-        x1, y1 = int(start_pos.x()), int(start_pos.y())
-        x2, y2 = int(end_pos.x()), int(end_pos.y())
-
-        dx = abs(x2 - x1)
-        dy = abs(y2 - y1)
-        sx = 1 if x1 < x2 else -1
-        sy = 1 if y1 < y2 else -1
-        err = dx - dy
-
-        painter = QPainter(self.image)
-        if erasing:
-            painter.setPen(QPen(Qt.transparent, self.brush_size, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin))
-            painter.setCompositionMode(QPainter.CompositionMode_Clear)
-        else:
-            painter.setPen(QPen(self.current_color, self.brush_size, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin))
-
-        while True:
-            if 0 <= x1 < self.width and 0 <= y1 < self.height:
-                painter.drawPoint(x1, y1)
-                self.update_drawn_pixels(x1, y1, self.brush_size, add=not erasing)
-            if x1 == x2 and y1 == y2:
-                break
-            e2 = err * 2
-            if e2 > -dy:
-                err -= dy
-                x1 += sx
-            if e2 < dx:
-                err += dx
-                y1 += sy
-
-        painter.end()
-        self.pixmap_item.setPixmap(QPixmap.fromImage(self.image))
+        xs, ys = line_points(int(start_pos.x()), int(start_pos.y()), int(end_pos.x()), int(end_pos.y()))
+        self.paint_stroke(xs, ys, erasing)
 
     def flood_fill(self, x, y, new_color):
-        target_color = self.image.pixelColor(x, y)
-        if target_color == new_color:
-            return
-
-        stack = [(x, y)]
-        while stack:
-            current_x, current_y = stack.pop()
-            if self.image.pixelColor(current_x, current_y) == target_color:
-                self.image.setPixelColor(current_x, current_y, new_color)
-                if current_x > 0:
-                    stack.append((current_x - 1, current_y))
-                if current_x < self.image.width() - 1:
-                    stack.append((current_x + 1, current_y))
-                if current_y > 0:
-                    stack.append((current_x, current_y - 1))
-                if current_y < self.image.height() - 1:
-                    stack.append((current_x, current_y + 1))
-
-    def export_canvas(self, file_path, scale_factor=20):
-        large_image = self.image.scaled(self.width * scale_factor, self.height * scale_factor, Qt.KeepAspectRatio, Qt.FastTransformation)
-        if file_path.endswith(".png"):
-            large_image.save(file_path, 'PNG')
-        if file_path.endswith(".jpg") or file_path.endswith(".jpeg"):
-            # Create a new image with a white background
-            white_background = QImage(large_image.size(), QImage.Format_RGB32)
-            white_background.fill(Qt.white)
-            
-            # paint image on the white background
-            painter = QPainter(white_background)
-            painter.drawImage(0, 0, large_image)
-            painter.end()
-            
-            # Save image as JPEG
-            white_background.save(file_path, 'JPEG')
-
+        instrument.input()
+        with instrument.span("flood_fill"):
+            changes = fill_tiles(self.canvas, x, y, self.pixel_value(new_color), self.fill_tolerance,
+                                 self.fill_contiguous, self.layers.lut)
+        with instrument.span("undo_snapshot"):
+            self.history.touch_tiles(self.canvas, changes)
+        for key, tile in changes.items():
+            self.canvas.set_tile(key, tile)
+        self.layers.refresh_keys(self.canvas, changes)
+        self.coverage.sync(self.layers.source(), changes)
+        with instrument.span("tile_refresh"):
+            self.tile_items.refresh_keys(changes)
+
+    # finish a stroke: give back tiles it left uniform and record it for undo
+    def end_edit(self):
+        if self.history.pending:
+            self.canvas.compact(list(self.history.pending))
+            self.tile_items.refresh_keys(self.history.pending)
+        with instrument.span("undo_commit"):
+            self.history.end(self.canvas)
+        self.count_memory()
+
+    # memory held by the undo history and the canvas tiles
+    def count_memory(self):
+        instrument.counter("history_bytes", self.history.nbytes)
+        instrument.counter("canvas_bytes", self.canvas.nbytes)
+
+    # the whole canvas as one QImage, for export and printing. with several
+    # layers this is the composite the view already shows
+    def flatten(self):
+        return self.layers.source().to_qimage(lut=self.layers.lut)
+
+    # crop exports to the bounding box of the drawn content when asked
+    def export_canvas(self, file_path, scale_factor=20, crop=False):
+        source = self.layers.source()
+        rect = source.rect()
+        if crop and not self.coverage.is_empty():
+            rect = self.coverage.bounds()
+        # rows are read from the tiles a band at a time, never as one big image
+        read_rows = lambda y, count: source.read(QRect(rect.x(), rect.y() + y, rect.width(), count))
+        export_rows(read_rows, rect.width(), rect.height(), file_path, scale_factor, self.layers.lut)
+
+    # clears the active layer
     def clear_canvas(self):
-        self.image = QImage(self.width, self.height, QImage.Format_ARGB32)
-        self.image.fill(Qt.transparent)
-        self.drawn_pixels.clear()  # Clear the drawn pixels set
-        self.pixmap_item.setPixmap(QPixmap.fromImage(self.image))
+        if self.layers.active_layer.locked:
+            return
+        keys = list(self.canvas.tiles)
+        self.history.begin()
+        self.history.touch_tiles(self.canvas, keys)
+        self.canvas.clear()
+        self.history.end(self.canvas)
+        self.layers.refresh_keys(self.canvas, keys)
+        self.coverage.sync(self.layers.source(), keys)
+        self.tile_items.refresh_keys(keys)
+
+    # replace the canvas contents, e.g. with an opened or scaled image
+    def set_image(self, image):
+        self.set_frames([image], [None])
+
+    # replace the canvas contents with one frame per image, e.g. from a gif.
+    # a duration of None keeps the default
+    def set_frames(self, images, durations):
+        self.set_timeline(timeline_from_images(images, durations))
+
+    # replace the canvas contents with a quantized photo: palette indices (0
+    # transparent) and the colors they refer to, which become the swatches
+    def set_quantized(self, indices, colors, indexed):
+        palette = Palette(colors)
+        if indexed:
+            canvas = TiledCanvas.from_pixels(indices)
+        else:
+            canvas = TiledCanvas.from_pixels(palette.lut[indices])
+            palette = None
+        self.palette = [QColor.fromRgba(color) for color in colors]
+        self.set_timeline(Timeline(LayerStack(self.width, self.height, canvas, palette)))
+
+    # a scaled-down image stretched over the canvas until set_timeline brings
+    # the real pixels; the canvas takes no input meanwhile
+    def show_preview(self, image):
+        self.preview_item.setPixmap(QPixmap.fromImage(image))
+        self.preview_item.setTransform(QTransform.fromScale(self.width / image.width(), self.height / image.height()))
+        self.preview_item.setVisible(True)
+        self.setEnabled(False)
+
+    def set_timeline(self, timeline):
+        self.preview_item.setVisible(False)
+        self.preview_item.setPixmap(QPixmap())
+        self.setEnabled(True)
+        self.stop_playback()
+        self.timeline = timeline
+        self.layers = timeline.frame.layers
+        self.history.clear()
+        self.deselect()
+        self.layers_changed()
+        self.update_onion_skin()
         
-    def open_save_dialog(self):
+    def open_save_dialog(self, crop=False):
         file_dialog = QFileDialog(self)
         if self.last_directory != "":
             file_dialog.setDirectory(self.last_directory)
@@ -250,10 +657,81 @@ class PixelArtEditor(QGraphicsView):
             # Prompt user for scale factor
             scale_factor, ok = QInputDialog.getInt(self, "Scale Factor", "Enter the scale factor (e.g., 1 for normal size, 20 for large):", 1, 1, 100)
             if ok:
-                self.export_canvas(file_path, scale_factor)
+                try:
+                    self.export_canvas(file_path, scale_factor, crop)
+                except (ValueError, OSError) as e:
+                    QMessageBox.information(self, "Export Failed", str(e))
             else:
                 QMessageBox.information(self, "Save Canceled", "The save operation was canceled.")
 
+    # save as a project file, keeping undo history, palette and view. saving
+    # to the same file again only writes what changed since
+    def save_project(self, file_path):
+        if self.project is None or self.project.path != file_path:
+            self.project = ProjectFile(file_path)
+        self.project.write(self.project.capture(self))
+
+    # returns whether the project was saved
+    def save_project_dialog(self, save_as=False):
+        file_path = None if save_as or self.project is None else self.project.path
+        if file_path is None:
+            file_path, _ = QFileDialog.getSaveFileName(self, "Save Project", os.path.join(self.last_directory, "untitled.pxproj"), PROJECT_FILTER)
+            if not file_path:
+                return False
+            if not file_path.endswith(".pxproj"):
+                file_path += ".pxproj"
+            self.last_directory = QFileInfo(file_path).path()
+        try:
+            self.save_project(file_path)
+        except (ProjectError, OSError) as e:
+            QMessageBox.information(self, "Save Failed", str(e))
+            return False
+        return True
+
+    # an inactive tab can hand its pixels and history to a project file to
+    # free memory; the view, palette and tool settings stay as they are
+    def is_offloaded(self):
+        return self.timeline is None
+
+    def offload(self, spill):
+        self.stop_playback()
+        spill.write(spill.capture(self))
+        self.timeline = None
+        self.layers = None
+        self.history = History()
+        self.coverage.clear()
+        self.tile_items.reset(TiledCanvas(self.width, self.height))
+        for item in self.onion_items.values():
+            item.setVisible(False)
+            item.setPixmap(QPixmap())
+
+    # take the pixels and history back from the offloaded project file
+    def restore(self, project):
+        self.timeline = project.timeline
+        self.layers = self.timeline.frame.layers
+        self.history = project.history
+        self.layers_changed()
+        self.update_onion_skin()
+
+    # take over everything read from a project file
+    def set_project(self, project):
+        self.stop_playback()
+        self.timeline = project.timeline
+        self.layers = self.timeline.frame.layers
+        self.history = project.history
+        self.layers_changed()
+        self.update_onion_skin()
+        self.palette = [QColor.fromRgba(rgba) for rgba in project.palette]
+        self.current_color = QColor.fromRgba(project.color)
+        self.project = project
+        m11, m12, m21, m22, dx, dy = project.view["transform"]
+        self.setTransform(QTransform(m11, m12, m21, m22, dx, dy))
+        # older projects may have been saved between whole zoom levels
+        self.set_zoom(self.zoom_level())
+        # scroll once the view is laid out, or the ranges would clamp it
+        x, y = project.view["scroll"]
+        QTimer.singleShot(0, lambda: (self.horizontalScrollBar().setValue(x), self.verticalScrollBar().setValue(y)))
+
     def draw_switch(self):
         self.state = self.states[0]
     
@@ -266,85 +744,243 @@ class PixelArtEditor(QGraphicsView):
     def grab_switch(self):
         self.state = self.states[3]
 
-    # for printing on the receipt printer
-    def print_pic(self,editor):
-        # Vendor ID and Product ID from lsusb output
-        VENDOR_ID = 0x0416
-        PRODUCT_ID = 0x5011
-
-        context = usb1.USBContext()
-        handle = None
-
-        for device in context.getDeviceList(skip_on_error=True):
-            if device.getVendorID() == VENDOR_ID and device.getProductID() == PRODUCT_ID:
-                handle = device.open()
-                print(f"Device found: {device}")
-                break
-
-        if handle:
-            # The interface number found in the lsusb output
-            interface_number = 0
-            try:
-                # Detach the kernel driver if necessary
-                if handle.kernelDriverActive(interface_number):
-                    handle.detachKernelDriver(interface_number)
-                    print("Kernel driver detached.")
-            except usb1.USBErrorNotFound:
-                pass
+    def select_switch(self):
+        self.state = self.states[4]
 
-            try:
-                handle.claimInterface(interface_number)
-            except usb1.USBErrorBusy as e:
-                print(f"Could not claim interface {interface_number}: {e}")
-                return
-
-            # Generate commands
-            dummy_printer = Dummy()
-
-            # Scale image to printer width
-            printer_width = 576
-            scaled_image = editor.image.scaled(printer_width, editor.image.height() * (printer_width / editor.image.width()), Qt.KeepAspectRatio, Qt.SmoothTransformation)
-
-            # Convert QImage to PIL image
-            buffer = QBuffer()
-            buffer.open(QBuffer.ReadWrite)
-            scaled_image.save(buffer, "PNG")
-            pil_image = Image.open(io.BytesIO(buffer.data()))
-
-            # Print the image
-            dummy_printer.text("###############################################\n")
-            dummy_printer.text("\n")
-            dummy_printer.image(pil_image)
-            dummy_printer.text("\n")
-            dummy_printer.text("###############################################\n")
-            dummy_printer.text("### Thanks for using Joseph's pixel editor. ###\n")
-            dummy_printer.cut()
-
-            # Get raw data
-            escpos_data = dummy_printer.output
-
-            # Perform transfer to endpoint
-            endpoint_address = 0x03  
-            handle.bulkWrite(endpoint_address, escpos_data)
-            print("Printed successfully.")
-            
-            # Release the interface
-            handle.releaseInterface(interface_number)
-        else:
-            print("No USB device found.")
+    # for printing on the receipt printer. the canvas is resampled to the
+    # printer width straight from its tiles, then dithered and sent by the
+    # background print service so the editor never waits on the printer
+    def print_pic(self, editor, mode=DITHER_MODES[0]):
+        return print_service().submit(editor.layers.source(), mode, editor.layers.lut)
 
     def zoom_in(self):
-        zoom = 1.1
-        self.scale(zoom, zoom)
+        self.zoom_by(ZOOM_STEP)
+
     def zoom_out(self):
-        zoom = 1 / 1.1
-        self.scale(zoom, zoom)
+        self.zoom_by(1 / ZOOM_STEP)
+
+    # screen pixels per canvas pixel
+    def zoom_level(self):
+        return self.transform().m11()
+
+    # every zoom goes through here. from GRID_ZOOM on, the zoom is a whole
+    # number, so canvas pixels land on whole screen pixels and the grid can be
+    # tiled from one cached cell; a step always moves at least one level
+    def zoom_by(self, factor, anchor=None):
+        zoom = self.zoom_level()
+        target = zoom * factor
+        if target >= GRID_ZOOM and round(target) == round(zoom):
+            target = round(zoom) + (1 if factor > 1 else -1)
+        self.set_zoom(target, anchor)
+
+    # zoom keeping the canvas point under anchor (viewport coordinates,
+    # the middle by default) in place
+    def set_zoom(self, zoom, anchor=None):
+        zoom = min(max(zoom, MIN_ZOOM), MAX_ZOOM)
+        if zoom >= GRID_ZOOM:
+            zoom = round(zoom)
+        if zoom == self.zoom_level():
+            return
+        if anchor is None:
+            anchor = self.viewport().rect().center()
+        point = self.mapToScene(anchor)
+        self.setTransform(QTransform.fromScale(zoom, zoom))
+        moved = self.mapFromScene(point) - anchor
+        self.horizontalScrollBar().setValue(self.horizontalScrollBar().value() + moved.x())
+        self.verticalScrollBar().setValue(self.verticalScrollBar().value() + moved.y())
+
+    def set_grid_visible(self, visible):
+        self.show_grid = visible
+        self.viewport().update()
 
     def undo(self):
-        if self.undo_stack:
+        if self.history.can_undo():
             print("you pressed undo")
-            self.image = self.undo_stack.pop()
-            self.pixmap_item.setPixmap(QPixmap.fromImage(self.image))
+            instrument.input()
+            with instrument.span("undo"):
+                canvas, keys = self.history.undo()
+            self.show_history_step(canvas, keys)
+
+    def redo(self):
+        if self.history.can_redo():
+            instrument.input()
+            with instrument.span("redo"):
+                canvas, keys = self.history.redo()
+            self.show_history_step(canvas, keys)
+
+    # show an undone or redone step, going to its frame if it was on another
+    def show_history_step(self, canvas, keys):
+        index = self.timeline.frame_of(canvas)
+        if index is not None and index != self.timeline.current:
+            self.show_frame(index)
+            return
+        self.layers.refresh_keys(canvas, keys)
+        self.coverage.sync(self.layers.source(), keys)
+        self.tile_items.refresh_keys(keys)
+
+    # rebuild the composite and the view after the layer stack changed
+    def layers_changed(self):
+        self.layers.restack()
+        source = self.layers.source()
+        self.coverage.clear()
+        self.coverage.sync(source, source.tiles)
+        self.tile_items.reset(source, self.color_table())
+
+    def add_layer(self):
+        self.layers.add_layer()
+        self.layers_changed()
+
+    def remove_layer(self):
+        if len(self.layers.layers) > 1:
+            layer = self.layers.remove_layer(self.layers.active)
+            self.history.forget(layer.canvas)
+            self.layers_changed()
+
+    def move_layer(self, delta):
+        self.layers.move_layer(self.layers.active, delta)
+        self.layers_changed()
+
+    def set_active_layer(self, index):
+        if index != self.layers.active:
+            self.layers.active = index
+            self.layers_changed()
+
+    # change any of a layer's name, visibility, opacity, blend mode or lock
+    def update_layer(self, index, **changes):
+        layer = self.layers.layers[index]
+        restack = any(getattr(layer, name) != value for name, value in changes.items()
+                      if name in ("visible", "opacity", "blend"))
+        for name, value in changes.items():
+            setattr(layer, name, value)
+        self.layers.structure_version += 1
+        if restack:
+            self.layers_changed()
+
+    # change one palette entry. on an indexed canvas this recolors every
+    # pixel using it by swapping the tiles' color tables
+    def set_palette_color(self, index, color):
+        self.palette[index] = color
+        if self.is_indexed():
+            self.layers.palette.set_color(index, color.rgba())
+            self.tile_items.set_color_table(self.color_table())
+            self.update_onion_skin()
+
+    # switch every frame and layer between ARGB and palette indices. undo
+    # history is dropped since it holds the old pixels. returns False when
+    # the image uses more colors than a palette can hold
+    def set_indexed(self, indexed):
+        if indexed == self.is_indexed():
+            return True
+        stacks = [frame.layers for frame in self.timeline.frames]
+        if indexed:
+            colors = [color.rgba() for color in self.palette]
+            used = used_colors(layer.canvas for stack in stacks for layer in stack.layers)
+            if used is None:
+                return False
+            colors += [color for color in used if color not in colors]
+            if len(colors) > MAX_COLORS:
+                colors = used
+            palette = Palette(colors)
+            convert = lambda canvas: indexed_canvas(canvas, palette)
+            self.palette = [QColor.fromRgba(color) for color in palette.colors]
+        else:
+            old = self.layers.palette
+            palette = None
+            convert = lambda canvas: argb_canvas(canvas, old)
+        for stack in stacks:
+            stack.set_palette(palette, convert)
+        self.history.clear()
+        self.layers_changed()
+        self.update_onion_skin()
+        return True
+
+    # make another frame the one being edited
+    def show_frame(self, index):
+        self.stop_playback()
+        self.timeline.current = index
+        self.layers = self.timeline.frame.layers
+        self.layers_changed()
+        self.update_onion_skin()
+
+    # add an empty frame after the current one, or a copy of the current one
+    def add_frame(self, duplicate=False):
+        self.timeline.add_frame(duplicate)
+        self.show_frame(self.timeline.current)
+
+    def remove_frame(self):
+        if len(self.timeline.frames) > 1:
+            frame = self.timeline.remove_frame(self.timeline.current)
+            for layer in frame.layers.layers:
+                self.history.forget(layer.canvas)
+            self.show_frame(self.timeline.current)
+
+    def move_frame(self, delta):
+        self.timeline.move_frame(self.timeline.current, delta)
+        self.update_onion_skin()
+
+    def set_frame_duration(self, duration):
+        if duration != self.timeline.frame.duration:
+            self.timeline.frame.duration = duration
+            self.timeline.structure_version += 1
+
+    def set_onion_skin(self, enabled):
+        self.timeline.onion_skin = enabled
+        self.update_onion_skin()
+
+    # the neighbouring frames' tinted pixmaps are cached by the timeline, so
+    # this is only a pixmap swap unless a neighbour changed
+    def update_onion_skin(self):
+        for side, item in self.onion_items.items():
+            pixmap = self.timeline.onion_pixmap(side) if self.timeline.onion_skin else None
+            if pixmap is None:
+                item.setVisible(False)
+            else:
+                item.setPixmap(pixmap)
+                item.setVisible(True)
+
+    def is_playing(self):
+        return self.playback_pixmaps is not None
+
+    # play the frames from the current one in a loop. every frame is turned
+    # into a pixmap once up front; playback then only swaps them
+    def play(self):
+        if self.is_playing() or len(self.timeline.frames) < 2:
+            return
+        self.playback_pixmaps = [self.timeline.frame_pixmap(frame) for frame in self.timeline.frames]
+        self.playback_index = self.timeline.current
+        self.tile_items.set_visible(False)
+        for item in self.onion_items.values():
+            item.setVisible(False)
+        self.playback_item.setVisible(True)
+        self.show_playback_frame()
+
+    def show_playback_frame(self):
+        self.playback_item.setPixmap(self.playback_pixmaps[self.playback_index])
+        self.playback_timer.start(self.timeline.frames[self.playback_index].duration)
+
+    def next_playback_frame(self):
+        if self.is_playing():
+            self.playback_index = (self.playback_index + 1) % len(self.playback_pixmaps)
+            self.show_playback_frame()
+
+    def stop_playback(self):
+        if not self.is_playing():
+            return
+        self.playback_timer.stop()
+        self.playback_pixmaps = None
+        self.playback_item.setVisible(False)
+        self.tile_items.set_visible(True)
+        self.update_onion_skin()
+
+    def toggle_playback(self):
+        if self.is_playing():
+            self.stop_playback()
+        else:
+            self.play()
+
+    # animated gif, apng or sprite sheet, encoded in the background
+    def export_animation(self, kind, file_path, scale_factor=1):
+        animation_exporter().submit(self.timeline, kind, file_path, scale_factor)
 
     def event(self, event):
         if event.type() == QEvent.Gesture:
@@ -0,0 +1,251 @@
+import io
+import struct
+import zlib
+import numpy as np
+from PySide6.QtGui import QImage
+
+from canvas import image_array
+
+BAND_ROWS = 64  # source rows read at a time
+STRIP_BYTES = 16 * 1024 * 1024  # upper bound for one upscaled jpeg strip
+IDAT_BYTES = 1024 * 1024
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+JPEG_QUALITY = 75  # same as Qt's default
+JPEG_MAX_SIZE = 65535
+
+
+# scale an image up by a whole factor with nearest-neighbor and save it as
+# png or jpeg (picked from the file extension). jpeg has no alpha, so the
+# image is composited onto white first
+def export_image(image, file_path, scale_factor=1):
+    # keep the converted image alive for as long as its pixels are read
+    image = image.convertToFormat(QImage.Format_ARGB32)
+    pixels = image_array(image)
+    return export_rows(lambda y, count: pixels[y:y + count], image.width(), image.height(), file_path, scale_factor)
+
+
+# same as export_image, but reads the source through read_rows(y, count) a
+# band at a time and streams the upscaled rows into the encoder, so memory
+# stays bounded no matter how large the scaled image gets. with a lut the
+# rows are palette indices, and png keeps them as a palette image
+def export_rows(read_rows, width, height, file_path, scale_factor=1, lut=None):
+    if file_path.endswith(".png"):
+        with open(file_path, "wb") as f:
+            write_png(f, read_rows, width, height, scale_factor, lut)
+        return True
+    if file_path.endswith(".jpg") or file_path.endswith(".jpeg"):
+        if width * scale_factor > JPEG_MAX_SIZE or height * scale_factor > JPEG_MAX_SIZE:
+            raise ValueError(f"JPEG images can be at most {JPEG_MAX_SIZE} pixels on a side")
+        if lut is not None:
+            read_indices = read_rows
+            read_rows = lambda y, count: lut[read_indices(y, count)]
+        with open(file_path, "wb") as f:
+            write_jpeg(f, read_rows, width, height, scale_factor)
+        return True
+    return False
+
+
+def bands(read_rows, height):
+    for y in range(0, height, BAND_ROWS):
+        yield read_rows(y, min(BAND_ROWS, height - y))
+
+
+# ARGB32 row (native little endian, so B G R A bytes) as upscaled RGBA bytes
+def rgba_row(row, scale_factor):
+    return np.repeat(row.view(np.uint8).reshape(-1, 4)[:, [2, 1, 0, 3]], scale_factor, axis=0).ravel()
+
+
+def png_chunk(f, kind, data):
+    f.write(struct.pack(">I", len(data)) + kind + data)
+    f.write(struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF))
+
+
+# each source row is written once with the Sub filter (zero wherever the
+# upscale repeated a pixel) and then scale_factor - 1 times with the Up
+# filter, which for a repeated row is all zeros and costs almost nothing
+def write_png(f, read_rows, width, height, scale_factor, lut=None):
+    out_width = width * scale_factor
+    f.write(PNG_SIGNATURE)
+    if lut is None:
+        png_chunk(f, b"IHDR", png_header(out_width, height * scale_factor))
+    else:
+        png_chunk(f, b"IHDR", png_header(out_width, height * scale_factor, color_type=3))
+        channels = lut.view(np.uint8).reshape(-1, 4)
+        png_chunk(f, b"PLTE", channels[:, [2, 1, 0]].tobytes())
+        png_chunk(f, b"tRNS", channels[:, 3].tobytes())
+    pending = []
+    pending_size = 0
+    for piece in compressed_rows(read_rows, width, height, scale_factor, indexed=lut is not None):
+        pending.append(piece)
+        pending_size += len(piece)
+        if pending_size >= IDAT_BYTES:
+            png_chunk(f, b"IDAT", b"".join(pending))
+            pending = []
+            pending_size = 0
+    png_chunk(f, b"IDAT", b"".join(pending))
+    png_chunk(f, b"IEND", b"")
+
+
+# color type 6 is RGBA, 3 is palette indices
+def png_header(width, height, color_type=6):
+    return struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0)
+
+
+# the zlib stream of a png's filtered, upscaled rows, in pieces
+def compressed_rows(read_rows, width, height, scale_factor, indexed=False):
+    compressor = zlib.compressobj(6)
+    pixel_bytes = 1 if indexed else 4
+    repeat_row = b"\x02" + bytes(width * scale_factor * pixel_bytes)
+    for band in bands(read_rows, height):
+        for row in band:
+            data = np.repeat(row, scale_factor) if indexed else rgba_row(row, scale_factor)
+            sub = data.copy()
+            sub[pixel_bytes:] -= data[:-pixel_bytes]
+            piece = compressor.compress(b"\x01" + sub.tobytes())
+            if piece:
+                yield piece
+            for _ in range(scale_factor - 1):
+                piece = compressor.compress(repeat_row)
+                if piece:
+                    yield piece
+    yield compressor.flush()
+
+
+# animation frames are encoded one per task on a worker pool (see
+# animation.py); these run in the workers and take plain ARGB32 arrays
+
+# compressed png image data of one frame
+def png_frame(pixels, scale_factor=1):
+    height, width = pixels.shape
+    return b"".join(compressed_rows(lambda y, count: pixels[y:y + count], width, height, scale_factor))
+
+
+# one frame as gif palette indices and an RGB palette. index 0 is transparent;
+# frames with at most 255 opaque colors (most pixel art) keep them exactly,
+# others are quantized
+def gif_frame(pixels, scale_factor=1):
+    pixels = np.repeat(np.repeat(pixels, scale_factor, axis=0), scale_factor, axis=1)
+    opaque = pixels >> 24 >= 128
+    colors, inverse = np.unique(pixels[opaque] & 0xFFFFFF, return_inverse=True)
+    indices = np.zeros(pixels.shape, np.uint8)
+    if len(colors) > 255:
+        from PIL import Image
+
+        rgb = pixels.view(np.uint8).reshape(pixels.shape + (4,))[..., [2, 1, 0]]
+        quantized = Image.fromarray(np.ascontiguousarray(rgb), "RGB").quantize(255)
+        indices[opaque] = np.asarray(quantized)[opaque] + 1
+        palette = bytes(3) + bytes(quantized.getpalette()[:255 * 3])
+    else:
+        indices[opaque] = inverse.ravel() + 1
+        palette = bytes(3) + colors.astype(">u4").view(np.uint8).reshape(-1, 4)[:, 1:].tobytes()
+    return indices, palette
+
+
+# animated png from png_frame() data, durations in ms. every frame replaces
+# the whole canvas
+def write_apng(f, frames, width, height, durations):
+    f.write(PNG_SIGNATURE)
+    png_chunk(f, b"IHDR", png_header(width, height))
+    png_chunk(f, b"acTL", struct.pack(">II", len(frames), 0))
+    sequence = 0
+    for i, (data, duration) in enumerate(zip(frames, durations)):
+        # offset 0, 0, delay duration/1000 s, dispose none, blend source
+        png_chunk(f, b"fcTL", struct.pack(">IIIIIHHBB", sequence, width, height, 0, 0, duration, 1000, 0, 0))
+        sequence += 1
+        for offset in range(0, max(len(data), 1), IDAT_BYTES):
+            if i == 0:
+                png_chunk(f, b"IDAT", data[offset:offset + IDAT_BYTES])
+            else:
+                png_chunk(f, b"fdAT", struct.pack(">I", sequence) + data[offset:offset + IDAT_BYTES])
+                sequence += 1
+    png_chunk(f, b"IEND", b"")
+
+
+# animated gif from gif_frame() results, durations in ms
+def write_gif(file_path, frames, width, height, durations):
+    from PIL import Image
+
+    images = []
+    for indices, palette in frames:
+        image = Image.frombuffer("P", (width, height), indices.tobytes(), "raw", "P", 0, 1)
+        image.putpalette(palette)
+        image.info["transparency"] = 0
+        images.append(image)
+    images[0].save(file_path, "GIF", save_all=True, append_images=images[1:], duration=list(durations),
+                   loop=0, disposal=2, transparency=0, optimize=False)
+
+
+# ARGB32 rows composited onto white, as RGB bytes per pixel
+def rgb_on_white(rows):
+    channels = rows.view(np.uint8).reshape(rows.shape + (4,)).astype(np.uint16)
+    alpha = channels[..., 3:4]
+    rgb = (channels[..., [2, 1, 0]] * alpha + 255 * (255 - alpha) + 127) // 255
+    return rgb.astype(np.uint8)
+
+
+# split an encoded jpeg into its segments before the scan (as a list of
+# (marker, bytes)), the SOS segment and the entropy coded scan data
+def split_jpeg(data):
+    segments = []
+    pos = 2
+    while True:
+        marker = data[pos + 1]
+        length = struct.unpack(">H", data[pos + 2:pos + 4])[0]
+        segment = data[pos:pos + 2 + length]
+        if marker == 0xDA:
+            return segments, segment, data[pos + 2 + length:-2]
+        segments.append((marker, segment))
+        pos += 2 + length
+
+
+# baseline jpeg written strip by strip. every strip is encoded on its own with
+# PIL, and the entropy coded data of the strips is stitched into one scan with
+# restart markers in between (a restart resets the DC predictor exactly like
+# starting a new image does), under a header patched with the full height
+def write_jpeg(f, read_rows, width, height, scale_factor):
+    from PIL import Image
+
+    out_width = width * scale_factor
+    out_height = height * scale_factor
+    # 4:4:4 sampling so an MCU is 8x8 and the restart interval is whole MCU rows
+    mcus_per_row = (out_width + 7) // 8
+    strip_rows = min(STRIP_BYTES // (out_width * 3), 0xFFFF // mcus_per_row * 8)
+    strip_rows = max(8, strip_rows // 8 * 8)
+
+    header = None
+    strip_index = 0
+    strip = np.empty((strip_rows, out_width, 3), np.uint8)
+    filled = 0
+
+    def flush(rows):
+        nonlocal header, strip_index
+        buffer = io.BytesIO()
+        Image.frombuffer("RGB", (out_width, rows), strip[:rows].tobytes(), "raw", "RGB", 0, 1).save(
+            buffer, "JPEG", quality=JPEG_QUALITY, subsampling=0, optimize=False, progressive=False)
+        segments, scan_header, scan = split_jpeg(buffer.getvalue())
+        if header is None:
+            header = b""
+            for marker, segment in segments:
+                if marker == 0xC0:
+                    # patch the frame height to the full image height
+                    segment = segment[:5] + struct.pack(">H", out_height) + segment[7:]
+                header += segment
+            restart_interval = mcus_per_row * (strip_rows // 8)
+            f.write(b"\xff\xd8" + header + b"\xff\xdd" + struct.pack(">HH", 4, restart_interval) + scan_header)
+        else:
+            f.write(bytes([0xFF, 0xD0 + (strip_index - 1) % 8]))
+        f.write(scan)
+        strip_index += 1
+
+    for band in bands(read_rows, height):
+        for row in rgb_on_white(band):
+            line = np.repeat(row, scale_factor, axis=0)
+            for _ in range(scale_factor):
+                strip[filled] = line
+                filled += 1
+                if filled == strip_rows:
+                    flush(filled)
+                    filled = 0
+    if filled:
+        flush(filled)
+    f.write(b"\xff\xd9")
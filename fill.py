@@ -0,0 +1,215 @@
+from bisect import bisect_right
+from collections import deque
+import numpy as np
+
+
+# pixels within tolerance of target, compared per ARGB channel. indexed
+# pixels are compared by their colors in lut
+def match_mask(pixels, target, tolerance=0, lut=None):
+    if tolerance <= 0:
+        return pixels == target
+    if lut is not None:
+        return match_mask(lut, lut[target], tolerance)[pixels]
+    channels = pixels.view(np.uint8).reshape(pixels.shape + (4,))
+    mask = None
+    for k, value in enumerate(np.array([target], np.uint32).view(np.uint8).tolist()):
+        lo = max(value - tolerance, 0)
+        span = min(value + tolerance, 255) - lo
+        # uint8 subtraction wraps, so one compare checks lo <= channel <= lo + span
+        inside = (channels[..., k] - np.uint8(lo)) <= span
+        mask = inside if mask is None else mask & inside
+    return mask
+
+
+# the pixels a fill will change, as horizontal spans (contiguous mode) or a
+# plain boolean mask (global mode)
+class FillRegion:
+    def __init__(self, rows=None, starts=None, ends=None, mask=None):
+        self.rows = rows
+        self.starts = starts
+        self.ends = ends
+        self.mask = mask
+
+    def is_empty(self):
+        if self.mask is not None:
+            return not self.mask.any()
+        return len(self.rows) == 0
+
+    # bounding box as (x, y, width, height)
+    def bounds(self):
+        if self.mask is not None:
+            ys = np.flatnonzero(self.mask.any(axis=1))
+            xs = np.flatnonzero(self.mask.any(axis=0))
+            if len(ys) == 0:
+                return (0, 0, 0, 0)
+            return (int(xs[0]), int(ys[0]), int(xs[-1] - xs[0] + 1), int(ys[-1] - ys[0] + 1))
+        if len(self.rows) == 0:
+            return (0, 0, 0, 0)
+        x0, x1 = int(self.starts.min()), int(self.ends.max())
+        y0, y1 = int(self.rows.min()), int(self.rows.max()) + 1
+        return (x0, y0, x1 - x0, y1 - y0)
+
+    def to_mask(self, height, width):
+        if self.mask is not None:
+            return self.mask
+        mask = np.zeros((height, width), bool)
+        self.paint(mask, True)
+        return mask
+
+    def paint(self, pixels, value):
+        if self.mask is not None:
+            pixels[self.mask] = value
+            return
+        for row, start, end in zip(self.rows.tolist(), self.starts.tolist(), self.ends.tolist()):
+            pixels[row, start:end] = value
+
+
+# split a boolean mask into horizontal runs of True, as (rows, starts, ends)
+# arrays in row-major order
+def find_runs(mask):
+    h, w = mask.shape
+    stride = w + 2
+    # pad every row with a False on both sides so flattening never joins runs
+    padded = np.zeros((h, stride), bool)
+    padded[:, 1:-1] = mask
+    flat = padded.ravel()
+    changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    del padded, flat
+    # changes alternate between run starts and run ends
+    rows, starts = np.divmod(changes[0::2], stride)
+    ends = changes[1::2] - rows * stride
+    return rows, starts - 1, ends - 1
+
+
+# runs 4-connected to any of the seed points, walking the run graph
+def connected_runs(mask, seeds):
+    h = mask.shape[0]
+    run_rows, starts, ends = find_runs(mask)
+    # each row's runs are a contiguous slice of the run arrays
+    row_ptr = np.searchsorted(run_rows, np.arange(h + 1)).tolist()
+    start_list = starts.tolist()
+    end_list = ends.tolist()
+    row_list = run_rows.tolist()
+
+    visited = bytearray(len(start_list))
+    stack = []
+    for x, y in seeds:
+        if mask[y, x]:
+            seed = bisect_right(start_list, x, row_ptr[y], row_ptr[y + 1]) - 1
+            if not visited[seed]:
+                visited[seed] = 1
+                stack.append(seed)
+    selected = []
+    while stack:
+        run = stack.pop()
+        selected.append(run)
+        start, end, row = start_list[run], end_list[run], row_list[run]
+        for next_row in (row - 1, row + 1):
+            if 0 <= next_row < h:
+                hi = row_ptr[next_row + 1]
+                # first run on the next row that ends after this one starts
+                other = bisect_right(end_list, start, row_ptr[next_row], hi)
+                while other < hi and start_list[other] < end:
+                    if not visited[other]:
+                        visited[other] = 1
+                        stack.append(other)
+                    other += 1
+
+    selected = np.array(selected, np.intp)
+    return FillRegion(run_rows[selected], starts[selected], ends[selected])
+
+
+# scanline flood fill over a single array: find runs of matching pixels on
+# every row in one vectorized pass, then walk the run graph from (x, y)
+def fill_region(pixels, x, y, tolerance=0, contiguous=True):
+    mask = match_mask(pixels, pixels[y, x], tolerance)
+    if not contiguous:
+        return FillRegion(mask=mask)
+    return connected_runs(mask, [(x, y)])
+
+
+# flood fill over a TiledCanvas. the scanline fill runs tile by tile, handing
+# seeds across tile edges, and shared (uniform) tiles are filled whole without
+# being allocated. nothing is modified; returns {key: new tile} for the caller
+# to record and apply. lut is the palette of an indexed canvas
+def fill_tiles(canvas, x, y, value, tolerance=0, contiguous=True, lut=None):
+    size = canvas.tile_size
+    start = (x // size, y // size)
+    target = canvas.tile(start)[y % size, x % size].item()
+    solid = canvas.solid_tile(value)
+    changes = {}
+
+    def matches(pixel):
+        return bool(match_mask(np.array([pixel], canvas.dtype), target, tolerance, lut)[0])
+
+    if not contiguous:
+        for key in canvas.all_keys():
+            tile = canvas.tile(key)
+            if not tile.flags.writeable:
+                if matches(tile[0, 0]):
+                    changes[key] = solid
+                continue
+            mask = match_mask(tile, target, tolerance, lut)
+            if mask.any():
+                changes[key] = tile.copy()
+                changes[key][mask] = value
+        return changes
+
+    masks = {}
+    visited = {}  # key -> filled mask so far, or True once the whole tile is done
+    # seeds travel as (key, fixed x or None, fixed y or None, positions along the
+    # free axis) and are only expanded into points for tiles that need them
+    queue = deque([(start, x % size, None, [y % size])])
+    while queue:
+        key, fixed_x, fixed_y, positions = queue.popleft()
+        done = visited.get(key)
+        if done is True:
+            continue
+        rect = canvas.tile_rect(key)
+        h, w = rect.height(), rect.width()
+        tile = canvas.tile(key)
+
+        if not tile.flags.writeable:
+            # uniform tile: it either fills completely or not at all
+            if not matches(tile[0, 0]):
+                continue
+            visited[key] = True
+            changes[key] = solid
+            edges = (range(h), range(h), range(w), range(w))
+        else:
+            mask = masks.get(key)
+            if mask is None:
+                mask = masks[key] = match_mask(tile[:h, :w], target, tolerance, lut)
+            if fixed_x is not None:
+                seeds = [(fixed_x, position) for position in positions]
+            else:
+                seeds = [(position, fixed_y) for position in positions]
+            if done is not None:
+                seeds = [(sx, sy) for sx, sy in seeds if not done[sy, sx]]
+            region = connected_runs(mask, seeds)
+            if region.is_empty():
+                continue
+            new = region.to_mask(h, w)
+            visited[key] = new if done is None else done | new
+            if key not in changes:
+                changes[key] = tile.copy()
+            region.paint(changes[key], value)
+            edges = (np.flatnonzero(new[:, 0]).tolist(), np.flatnonzero(new[:, -1]).tolist(),
+                     np.flatnonzero(new[0]).tolist(), np.flatnonzero(new[-1]).tolist())
+
+        # hand the filled edge pixels to the neighbouring tiles as seeds
+        tx, ty = key
+        left, right, top, bottom = edges
+        neighbours = []
+        if tx > 0 and left:
+            neighbours.append(((tx - 1, ty), size - 1, None, left))
+        if rect.right() + 1 < canvas.width and right:
+            neighbours.append(((tx + 1, ty), 0, None, right))
+        if ty > 0 and top:
+            neighbours.append(((tx, ty - 1), None, size - 1, top))
+        if rect.bottom() + 1 < canvas.height and bottom:
+            neighbours.append(((tx, ty + 1), None, 0, bottom))
+        for neighbour in neighbours:
+            if visited.get(neighbour[0]) is not True:
+                queue.append(neighbour)
+    return changes
@@ -0,0 +1,171 @@
+import zlib
+import numpy as np
+
+HISTORY_BUDGET = 64 * 1024 * 1024  # bytes kept for undo/redo
+RAW_ENTRIES = 4  # newest entries kept uncompressed so quick undos stay cheap
+
+
+# zlib-compressed copy of a tile
+class PackedTile:
+    def __init__(self, tile):
+        self.shape = tile.shape
+        self.dtype = tile.dtype
+        self.data = zlib.compress(tile.tobytes(), 1)
+
+    # wrap data that is already compressed, e.g. read back from a project file
+    @classmethod
+    def from_data(cls, data, shape, dtype):
+        packed = cls.__new__(cls)
+        packed.shape = shape
+        packed.dtype = np.dtype(dtype)
+        packed.data = data
+        return packed
+
+    def unpack(self):
+        return np.frombuffer(zlib.decompress(self.data), self.dtype).reshape(self.shape).copy()
+
+
+# state of one tile position: None for unallocated, a shared read-only tile,
+# an owned array, or a PackedTile
+def tile_nbytes(state):
+    if state is None:
+        return 0
+    if isinstance(state, PackedTile):
+        return len(state.data)
+    return state.nbytes if state.flags.writeable else 0
+
+
+# value to hand back to the canvas; owned arrays are copied so later in-place
+# edits can't reach into the history
+def tile_state(state):
+    if isinstance(state, PackedTile):
+        return state.unpack()
+    if state is not None and state.flags.writeable:
+        return state.copy()
+    return state
+
+
+# one stroke worth of changes: the before/after state of every tile it touched
+# on one canvas (layer)
+class HistoryEntry:
+    def __init__(self, tiles, canvas):
+        # list of (key, before, after)
+        self.tiles = tiles
+        self.canvas = canvas
+        self.compressed = False
+
+    @property
+    def nbytes(self):
+        return sum(tile_nbytes(before) + tile_nbytes(after) for _, before, after in self.tiles)
+
+    def compress(self):
+        if not self.compressed:
+            self.tiles = [(key, self.pack(before), self.pack(after)) for key, before, after in self.tiles]
+            self.compressed = True
+
+    def pack(self, state):
+        if state is None or not state.flags.writeable:
+            return state
+        return PackedTile(state)
+
+    # put the before (undo) or after (redo) tiles back, returning their keys
+    def apply(self, after):
+        for key, before_tile, after_tile in self.tiles:
+            self.canvas.set_tile(key, tile_state(after_tile if after else before_tile))
+        return [key for key, _, _ in self.tiles]
+
+
+# tile-delta undo/redo history over a TiledCanvas. a stroke is recorded by
+# calling begin(), then touch() with every rect before it's painted over, then
+# end(); only tiles that actually changed are kept
+class History:
+    def __init__(self, budget=HISTORY_BUDGET):
+        self.budget = budget
+        self.undo_entries = []
+        self.redo_entries = []
+        self.pending = None
+
+    @property
+    def nbytes(self):
+        return sum(entry.nbytes for entry in self.undo_entries + self.redo_entries)
+
+    def set_budget(self, budget):
+        self.budget = budget
+        self.evict()
+
+    def begin(self):
+        self.pending = {}
+
+    # save the untouched state of every tile overlapping rect
+    def touch(self, canvas, rect):
+        self.touch_tiles(canvas, canvas.keys_in(rect))
+
+    def touch_tiles(self, canvas, keys):
+        if self.pending is None:
+            return
+        for key in keys:
+            if key not in self.pending:
+                self.pending[key] = self.snapshot(canvas, key)
+
+    def snapshot(self, canvas, key):
+        tile = canvas.tiles.get(key)
+        if tile is None or not tile.flags.writeable:
+            return tile
+        return tile.copy()
+
+    def end(self, canvas):
+        if self.pending is None:
+            return
+        tiles = []
+        for key, before in self.pending.items():
+            after = self.snapshot(canvas, key)
+            if after is before:
+                continue
+            if before is not None and after is not None and np.array_equal(before, after):
+                continue
+            tiles.append((key, before, after))
+        self.pending = None
+        if not tiles:
+            return
+        self.undo_entries.append(HistoryEntry(tiles, canvas))
+        self.redo_entries.clear()
+        for entry in self.undo_entries[:-RAW_ENTRIES]:
+            entry.compress()
+        self.evict()
+
+    # drop the oldest undo steps until we fit in the budget
+    def evict(self):
+        total = self.nbytes
+        while total > self.budget and self.undo_entries:
+            total -= self.undo_entries.pop(0).nbytes
+
+    def clear(self):
+        self.undo_entries.clear()
+        self.redo_entries.clear()
+        self.pending = None
+
+    def can_undo(self):
+        return bool(self.undo_entries)
+
+    def can_redo(self):
+        return bool(self.redo_entries)
+
+    # undo/redo return the canvas the step was on and the keys it changed
+    def undo(self):
+        if not self.undo_entries:
+            return None, []
+        entry = self.undo_entries.pop()
+        self.redo_entries.append(entry)
+        return entry.canvas, entry.apply(after=False)
+
+    def redo(self):
+        if not self.redo_entries:
+            return None, []
+        entry = self.redo_entries.pop()
+        self.undo_entries.append(entry)
+        return entry.canvas, entry.apply(after=True)
+
+    # drop every step recorded on a canvas, e.g. a deleted layer
+    def forget(self, canvas):
+        self.undo_entries = [entry for entry in self.undo_entries if entry.canvas is not canvas]
+        self.redo_entries = [entry for entry in self.redo_entries if entry.canvas is not canvas]
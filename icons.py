@@ -0,0 +1,35 @@
+import hashlib
+import os
+from PySide6.QtGui import QImage, QPixmap
+from PySide6.QtCore import QStandardPaths
+
+from canvas import image_array
+
+
+def icon_cache_dir():
+    cache = QStandardPaths.writableLocation(QStandardPaths.GenericCacheLocation)
+    return os.path.join(cache, "pixel-art-editor", "icons")
+
+
+# icon with every visible pixel turned opaque white, for the dark toolbar.
+# recolored icons are cached on disk keyed by a hash of the source file, so
+# later launches just load a png
+def white_icon(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    cache_path = os.path.join(icon_cache_dir(), hashlib.sha1(data).hexdigest() + ".png")
+    if os.path.exists(cache_path):
+        pixmap = QPixmap(cache_path)
+        if not pixmap.isNull():
+            return pixmap
+
+    image = QImage.fromData(data).convertToFormat(QImage.Format_ARGB32)
+    pixels = image_array(image)
+    pixels[(pixels >> 24) > 0] = 0xFFFFFFFF  # keep transparency
+
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        image.save(cache_path, "PNG")
+    except OSError:
+        pass
+    return QPixmap.fromImage(image)
@@ -0,0 +1,202 @@
+import queue
+
+import numpy as np
+from PySide6.QtGui import QImage, QImageReader, QImageIOHandler
+from PySide6.QtCore import Qt, QSize, QThread, Signal
+
+from animation import timeline_from_images
+from quantize import downsample, quantize
+from workers import process_pool
+
+OVERSAMPLE = 4  # photo pixels decoded per grid pixel, averaged down
+POOL_PIXELS = 256 * 256  # grids smaller than this quantize on the thread itself
+PREVIEW_SIZE = 512  # longest side of the preview shown while opening
+
+
+# decode a photo at just above the size the grid needs. the reader scales
+# while decoding (a JPEG skips most of its DCT work), so a multi-megapixel
+# photo never exists at full resolution
+def read_scaled(file_path, grid_width):
+    reader = QImageReader(file_path)
+    reader.setAutoTransform(True)
+    size = reader.size()
+    if size.isValid() and size.width() > grid_width * OVERSAMPLE:
+        width = grid_width * OVERSAMPLE
+        reader.setScaledSize(QSize(width, max(1, round(size.height() * width / size.width()))))
+    image = reader.read()
+    if image.isNull():
+        raise OSError(reader.errorString())
+    image = image.convertToFormat(QImage.Format_ARGB32)
+    pixels = np.frombuffer(image.constBits(), np.uint32, image.bytesPerLine() // 4 * image.height())
+    return pixels.reshape(image.height(), -1)[:, :image.width()].copy()
+
+
+# photo to pixel art in the background. each job decodes the photo scaled
+# down, area-averages it to the grid and sends a quick median-cut preview,
+# then refines the colors with k-means on the process pool and sends the
+# result. submitting a new job (the dialog's settings changed) abandons the
+# one in progress
+class ImportService(QThread):
+    preview = Signal(int, object, object)  # job, indices, ARGB colors
+    converted = Signal(int, object, object)
+    failed = Signal(int, str)
+
+    def __init__(self):
+        super().__init__()
+        self.jobs = queue.Queue()
+        self.job = 0
+        # (file path, grid width) -> the decoded photo, for the last photo
+        self.decoded = None
+
+    # palette is a list of ARGB colors to map onto instead of picking colors
+    def submit(self, file_path, grid_width, colors, palette=None):
+        self.job += 1
+        self.jobs.put((self.job, file_path, grid_width, colors, palette))
+        if not self.isRunning():
+            self.start()
+        return self.job
+
+    def stop(self):
+        if self.isRunning():
+            self.job += 1
+            self.jobs.put(None)
+            self.wait()
+
+    def stale(self, job):
+        return job != self.job
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            if self.stale(job[0]):
+                continue
+            try:
+                self.convert(*job)
+            except Exception as e:
+                self.failed.emit(job[0], str(e))
+
+    def convert(self, job, file_path, grid_width, colors, palette):
+        if self.decoded is None or self.decoded[0] != (file_path, grid_width):
+            self.decoded = ((file_path, grid_width), read_scaled(file_path, grid_width))
+        photo = self.decoded[1]
+        width = min(grid_width, photo.shape[1])
+        height = max(1, round(photo.shape[0] * width / photo.shape[1]))
+        pixels = downsample(photo, width, height)
+        if palette is not None:
+            self.converted.emit(job, *quantize(pixels, colors, palette))
+            return
+        self.preview.emit(job, *quantize(pixels, colors, refine=False))
+        if self.stale(job):
+            return
+        map_chunks = process_pool().map if pixels.size >= POOL_PIXELS else map
+        result = quantize(pixels, colors, map_chunks=map_chunks, stop=lambda: self.stale(job))
+        if result is not None:
+            self.converted.emit(job, *result)
+
+
+# background image opening. a first, small read shows a preview right away
+# (formats that can scale while decoding, like JPEG, make it nearly free;
+# others get it scaled from the first full frame), then every frame is read
+# at full size and turned into tiles off the GUI thread. files are opened one
+# after the other, and a cancelled one is abandoned between frames
+class ImageLoader(QThread):
+    preview = Signal(int, object, object)  # job, preview image, full size
+    loaded = Signal(int, object)  # job, timeline
+    failed = Signal(int, str)
+
+    def __init__(self):
+        super().__init__()
+        self.jobs = queue.Queue()
+        self.job = 0
+        self.cancelled = set()
+
+    def submit(self, file_path):
+        self.job += 1
+        self.jobs.put((self.job, file_path))
+        if not self.isRunning():
+            self.start()
+        return self.job
+
+    def cancel(self, job):
+        self.cancelled.add(job)
+
+    def stop(self):
+        if self.isRunning():
+            self.cancelled.update(range(1, self.job + 1))
+            self.jobs.put(None)
+            self.wait()
+
+    def stale(self, job):
+        return job in self.cancelled
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            if self.stale(job[0]):
+                continue
+            try:
+                self.load(*job)
+            except Exception as e:
+                self.failed.emit(job[0], str(e))
+
+    def load(self, job, file_path):
+        reader = QImageReader(file_path)
+        size = reader.size()
+        previewed = False
+        if (size.isValid() and max(size.width(), size.height()) > PREVIEW_SIZE
+                and reader.supportsOption(QImageIOHandler.ScaledSize)):
+            small = QImageReader(file_path)
+            small.setScaledSize(size.scaled(PREVIEW_SIZE, PREVIEW_SIZE, Qt.KeepAspectRatio))
+            image = small.read()
+            if not image.isNull():
+                self.preview.emit(job, image, size)
+                previewed = True
+        images = []
+        durations = []
+        while reader.canRead():
+            if self.stale(job):
+                return
+            image = reader.read()
+            if image.isNull():
+                break
+            if not previewed:
+                small = image
+                if max(image.width(), image.height()) > PREVIEW_SIZE:
+                    small = image.scaled(PREVIEW_SIZE, PREVIEW_SIZE, Qt.KeepAspectRatio)
+                self.preview.emit(job, small, image.size())
+                previewed = True
+            images.append(image)
+            durations.append(reader.nextImageDelay() or None)
+        if not images:
+            raise OSError(f"Cannot load {file_path}.")
+        if self.stale(job):
+            return
+        timeline = timeline_from_images(images, durations)
+        if not self.stale(job):
+            self.loaded.emit(job, timeline)
+
+
+loader = None
+
+
+# the image loader shared by every editor window
+def image_loader():
+    global loader
+    if loader is None:
+        loader = ImageLoader()
+    return loader
+
+
+service = None
+
+
+# the photo import service shared by every editor window
+def import_service():
+    global service
+    if service is None:
+        service = ImportService()
+    return service
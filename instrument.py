@@ -0,0 +1,113 @@
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+
+import numpy as np
+from PySide6.QtWidgets import QLabel
+from PySide6.QtCore import Qt, QTimer
+
+RECENT_SAMPLES = 240  # durations kept per span for the overlay
+TRACE_EVENTS = 500000  # newest trace events kept for the trace file
+OVERLAY_INTERVAL = 250  # ms between overlay refreshes
+
+
+# opt-in timing of the editor's hot paths. spans cost one attribute check
+# while disabled; once enabled (--instrument, or from the View menu) every
+# span is kept for the overlay and as a Chrome trace event (load the file
+# in chrome://tracing or ui.perfetto.dev)
+class Instrument:
+    def __init__(self):
+        self.enabled = "--instrument" in sys.argv or "--trace" in sys.argv
+        self.trace_path = None
+        if "--trace" in sys.argv[:-1]:
+            self.trace_path = sys.argv[sys.argv.index("--trace") + 1]
+        self.start = time.perf_counter()
+        self.recent = {}
+        self.counters = {}
+        self.events = deque(maxlen=TRACE_EVENTS)
+        self.input_time = None
+        self.null = nullcontext()
+
+    def span(self, name):
+        if not self.enabled:
+            return self.null
+        return self.timed(name)
+
+    @contextmanager
+    def timed(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter())
+
+    def record(self, name, start, end):
+        self.recent.setdefault(name, deque(maxlen=RECENT_SAMPLES)).append(end - start)
+        self.events.append({"name": name, "ph": "X", "ts": (start - self.start) * 1e6, "dur": (end - start) * 1e6,
+                            "pid": os.getpid(), "tid": threading.get_ident()})
+
+    def counter(self, name, value):
+        if not self.enabled:
+            return
+        self.counters[name] = value
+        self.events.append({"name": name, "ph": "C", "ts": (time.perf_counter() - self.start) * 1e6,
+                            "pid": os.getpid(), "args": {name: value}})
+
+    # an input event arrived; the next paint closes its event-to-paint span
+    def input(self):
+        if self.enabled and self.input_time is None:
+            self.input_time = time.perf_counter()
+
+    def painted(self):
+        if self.input_time is not None:
+            self.record("event_to_paint", self.input_time, time.perf_counter())
+            self.input_time = None
+
+    # one line per span: mean and p95 of the recent samples, in ms
+    def summary(self):
+        lines = []
+        for name, samples in sorted(self.recent.items()):
+            samples = np.array(samples) * 1000
+            lines.append(f"{name:<16} {samples.mean():7.2f} ms  p95 {np.percentile(samples, 95):7.2f} ms")
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"{name:<16} {value / 1024 / 1024:7.2f} MB" if name.endswith("bytes") else f"{name:<16} {value}")
+        return lines
+
+    def save_trace(self, path):
+        with open(path, "w") as f:
+            json.dump({"traceEvents": list(self.events), "displayTimeUnit": "ms"}, f)
+
+    def reset(self):
+        self.recent.clear()
+        self.counters.clear()
+        self.events.clear()
+        self.input_time = None
+
+
+instrument = Instrument()
+
+
+# live readout of instrument.summary() in the corner of a view. it is a
+# child of the view rather than its viewport so scrolling doesn't move it
+class PerfOverlay(QLabel):
+    def __init__(self, view):
+        super().__init__(view)
+        self.view = view
+        self.setAttribute(Qt.WA_TransparentForMouseEvents)
+        self.setStyleSheet("QLabel { background-color: rgba(0, 0, 0, 160); color: #7CFC00; "
+                           "font-family: monospace; font-size: 11px; padding: 4px; }")
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(OVERLAY_INTERVAL)
+        self.refresh()
+
+    def refresh(self):
+        lines = instrument.summary() or ["waiting for input..."]
+        self.setText("\n".join(lines))
+        self.adjustSize()
+        self.move(self.view.viewport().geometry().topLeft())
+        self.raise_()
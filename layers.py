@@ -0,0 +1,261 @@
+import numpy as np
+
+from canvas import TiledCanvas
+
+BLEND_MODES = ["normal", "multiply", "screen", "add", "darken", "lighten"]
+
+# blend functions on straight 0-1 colors: backdrop, source
+BLENDS = {
+    "normal": lambda cb, cs: cs,
+    "multiply": lambda cb, cs: cb * cs,
+    "screen": lambda cb, cs: cb + cs - cb * cs,
+    "add": lambda cb, cs: np.minimum(cb + cs, 1),
+    "darken": np.minimum,
+    "lighten": np.maximum,
+}
+
+
+class Layer:
+    def __init__(self, canvas, name):
+        self.canvas = canvas
+        self.name = name
+        self.visible = True
+        self.opacity = 1.0
+        self.blend = "normal"
+        self.locked = False
+
+
+# ARGB32 pixels as straight 0-1 color and alpha
+def unpack(pixels):
+    channels = pixels.view(np.uint8).reshape(pixels.shape + (4,)).astype(np.float32) / 255
+    return channels[..., [2, 1, 0]], channels[..., 3]
+
+
+def pack(color, alpha):
+    channels = np.empty(alpha.shape + (4,), np.uint8)
+    channels[..., [2, 1, 0]] = np.rint(np.clip(color, 0, 1) * 255)
+    channels[..., 3] = np.rint(np.clip(alpha, 0, 1) * 255)
+    return channels.view(np.uint32).reshape(alpha.shape)
+
+
+# source pixels composited onto backdrop pixels (W3C compositing with a
+# separable blend mode), returning new pixels. backdrop may be None. indexed
+# pixels have no color to blend: a layer's non-zero indices simply cover
+# what's below, whatever its opacity and blend mode
+def blend_over(backdrop, source, opacity=1.0, mode="normal"):
+    if source.dtype == np.uint8:
+        return source.copy() if backdrop is None else np.where(source != 0, source, backdrop)
+    if mode == "normal" and opacity >= 1 and (backdrop is None or (source >> 24 == 255).all()):
+        return source.copy()
+    if backdrop is None:
+        backdrop = np.zeros_like(source)
+    cs, source_alpha = unpack(source)
+    cb, backdrop_alpha = unpack(backdrop)
+    source_alpha *= opacity
+    alpha = source_alpha + backdrop_alpha * (1 - source_alpha)
+    mixed = (((1 - backdrop_alpha) * source_alpha)[..., None] * cs +
+             (source_alpha * backdrop_alpha)[..., None] * BLENDS[mode](cb, cs) +
+             ((1 - source_alpha) * backdrop_alpha)[..., None] * cb)
+    color = mixed / np.maximum(alpha, 1e-6)[..., None]
+    return pack(color, alpha)
+
+
+# composite of the visible layers at one tile position, or None when none of
+# them has anything there. tiles are only read, never written
+def stack_tile(layers, key):
+    out = None
+    for layer in layers:
+        tile = layer.canvas.tiles.get(key) if layer.visible else None
+        if tile is None:
+            continue
+        if out is None and layer.opacity >= 1 and layer.blend == "normal":
+            out = tile
+        else:
+            out = blend_over(out, tile, layer.opacity, layer.blend)
+    return out
+
+
+# the layers of a canvas, bottom first. drawing goes to the active layer; the
+# view shows the display canvas, which is recomposited only where the active
+# layer changed, from two cached composites: everything below the active
+# layer and everything above it. when the active layer is the only visible
+# one and is plain (normal, opaque) the view shows it directly instead
+class LayerStack:
+    def __init__(self, width, height, canvas=None, palette=None):
+        self.width = width
+        self.height = height
+        # indexed documents share one palette across all their stacks
+        self.palette = palette
+        self.layers = [Layer(canvas or self.new_canvas(), "Layer 1")]
+        self.active = 0
+        self.display = self.new_canvas()
+        self.below = {}  # key -> composite tile or None
+        self.above = {}
+        self.structure_version = 0
+        self.next_name = 2
+
+    @property
+    def active_layer(self):
+        return self.layers[self.active]
+
+    @property
+    def canvas(self):
+        return self.active_layer.canvas
+
+    # maps the pixels of an indexed stack to ARGB; None for ARGB stacks
+    @property
+    def lut(self):
+        return None if self.palette is None else self.palette.lut
+
+    def new_canvas(self):
+        return TiledCanvas(self.width, self.height, dtype=np.uint32 if self.palette is None else np.uint8)
+
+    # changes whenever what the stack looks like does. structure_version is
+    # bumped on changes to the layers themselves (order, visibility, opacity,
+    # blend, names), not on switching the active layer
+    def version(self):
+        palette_version = None if self.palette is None else self.palette.version
+        return self.structure_version, palette_version, tuple(layer.canvas.version for layer in self.layers)
+
+    def passthrough(self):
+        layer = self.active_layer
+        return (layer.visible and layer.opacity >= 1 and layer.blend == "normal" and
+                not any(other.visible for other in self.layers if other is not layer))
+
+    # canvas the view, export and printing read from
+    def source(self):
+        return self.canvas if self.passthrough() else self.display
+
+    # the whole composite as one ARGB array, built from the layers themselves;
+    # the display canvas is only kept current for the stack being edited
+    def pixels(self):
+        out = np.zeros((self.height, self.width), self.display.dtype)
+        keys = set()
+        for layer in self.layers:
+            if layer.visible:
+                keys.update(layer.canvas.tiles)
+        for key in keys:
+            tile = stack_tile(self.layers, key)
+            if tile is not None:
+                rect = self.display.tile_rect(key)
+                out[rect.y():rect.y() + rect.height(), rect.x():rect.x() + rect.width()] = \
+                    tile[:rect.height(), :rect.width()]
+        return out if self.palette is None else self.palette.lut[out]
+
+    # memory held by the layers and the cached composites
+    @property
+    def nbytes(self):
+        cached = sum(tile.nbytes for cache in (self.below, self.above) for tile in cache.values()
+                     if tile is not None and tile.flags.writeable)
+        return sum(layer.canvas.nbytes for layer in self.layers) + self.display.nbytes + cached
+
+    # same layers with copies of their pixels, e.g. for a duplicated frame
+    def copy(self):
+        stack = LayerStack(self.width, self.height, palette=self.palette)
+        stack.layers = []
+        for layer in self.layers:
+            copy = Layer(layer.canvas.copy(), layer.name)
+            copy.visible, copy.opacity, copy.blend, copy.locked = layer.visible, layer.opacity, layer.blend, layer.locked
+            stack.layers.append(copy)
+        stack.active = self.active
+        stack.next_name = self.next_name
+        return stack
+
+    def add_layer(self, canvas=None, name=None):
+        layer = Layer(canvas or self.new_canvas(), name or f"Layer {self.next_name}")
+        self.next_name += 1
+        self.active += 1 if self.layers else 0
+        self.layers.insert(self.active, layer)
+        self.structure_version += 1
+        return layer
+
+    def remove_layer(self, index):
+        layer = self.layers.pop(index)
+        self.active = min(self.active, len(self.layers) - 1)
+        self.structure_version += 1
+        return layer
+
+    def move_layer(self, index, delta):
+        target = index + delta
+        if not 0 <= target < len(self.layers):
+            return
+        self.layers.insert(target, self.layers.pop(index))
+        self.structure_version += 1
+        if self.active == index:
+            self.active = target
+        elif self.active == target:
+            self.active = index
+
+    # switch between ARGB and indexed (palette None or not), with convert
+    # turning each layer's canvas into the new kind
+    def set_palette(self, palette, convert):
+        for layer in self.layers:
+            layer.canvas = convert(layer.canvas)
+        self.palette = palette
+        self.display = self.new_canvas()
+        self.structure_version += 1
+
+    # the stack itself changed (active layer, order, a layer's visibility,
+    # opacity or blend): drop the caches and rebuild the composite
+    def restack(self):
+        self.below.clear()
+        self.above.clear()
+        self.display.clear()
+        if not self.passthrough():
+            keys = set()
+            for layer in self.layers:
+                if layer.visible:
+                    keys.update(layer.canvas.tiles)
+            self.recomposite_keys(keys)
+
+    # pixels of some layer changed at these tile positions
+    def refresh_keys(self, canvas, keys):
+        if canvas is not self.canvas:
+            for key in keys:
+                self.below.pop(key, None)
+                self.above.pop(key, None)
+        if not self.passthrough():
+            self.recomposite_keys(keys)
+
+    def recomposite_keys(self, keys):
+        size = self.display.tile_size
+        for key in keys:
+            self.composite_part(key, slice(0, size), slice(0, size))
+
+    # the active layer changed inside rect
+    def recomposite(self, rect):
+        if self.passthrough():
+            return
+        size = self.display.tile_size
+        for key in self.display.keys_in(rect):
+            part = self.display.tile_rect(key) & rect
+            x, y = part.x() % size, part.y() % size
+            self.composite_part(key, slice(y, y + part.height()), slice(x, x + part.width()))
+
+    def cached(self, cache, layers, key):
+        if key not in cache:
+            cache[key] = stack_tile(layers, key)
+        return cache[key]
+
+    def composite_part(self, key, rows, cols):
+        below = self.cached(self.below, self.layers[:self.active], key)
+        layer = self.active_layer
+        tile = self.canvas.tiles.get(key) if layer.visible else None
+        above_layers = [above for above in self.layers[self.active + 1:] if above.visible and above.canvas.tiles.get(key) is not None]
+        if below is None and tile is None and not above_layers:
+            if key in self.display.tiles:
+                self.display.tile_for_write(key)[rows, cols] = 0
+            return
+        out = None if below is None else below[rows, cols]
+        if tile is not None:
+            out = blend_over(out, tile[rows, cols], layer.opacity, layer.blend)
+        # source-over is associative, so normal layers above can be applied
+        # as one cached composite; other blend modes need what is under them
+        if all(above.blend == "normal" for above in above_layers):
+            above = self.cached(self.above, self.layers[self.active + 1:], key)
+            if above is not None:
+                out = blend_over(out, above[rows, cols])
+        else:
+            for above in above_layers:
+                out = blend_over(out, above.canvas.tiles[key][rows, cols], above.opacity, above.blend)
+        self.display.tile_for_write(key)[rows, cols] = out
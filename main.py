@@ -1,27 +1,47 @@
+import os
 import sys
+from startup import profile
 from PySide6.QtWidgets import *
 from PySide6.QtGui import *
-from PySide6.QtCore import Qt, QEvent
+from PySide6.QtCore import Qt, QEvent, QTimer
 
 from editor import *
 from dialog import *
+from icons import white_icon
+from printing import print_service
+from instrument import instrument
+from project import load_project, ProjectError, PROJECT_FILTER
+from autosave import AutosaveService, recoverable_files, discard_files, recover, set_autosave_interval
+from layers import BLEND_MODES
+from animation import animation_exporter, ANIMATION_FILTERS
+from importer import import_service, image_loader
+from workers import shutdown_pool
+from documents import DocumentCache, memory_cap, set_memory_cap
+profile.mark("imports")
 
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Joseph's Pixel Art Editor")
         self.resize(1200,800)
-        self.dialog_counter = 0
         self.tool_buttons = []
+        # the switch of the tool in use, applied to every document shown
+        self.active_tool = "draw_switch"
+        # images being opened in the background: job -> [path, editor once
+        # its preview is in]
+        self.loading = {}
+        self.autosave = None
+        self.documents = DocumentCache()
 
         # custom mouse cursor
         # pixelCursor = QPixmap("pixel-cursor-arrow-png")
         # self.scaled_pixelCursor = pixelCursor.scaled(24, 24, Qt.KeepAspectRatio, Qt.SmoothTransformation)
         
-        # functionality for being able to scroll
-        self.scroll_area = QScrollArea()
-        self.scroll_area.setWidgetResizable(True)
-        self.setCentralWidget(self.scroll_area)
+        # one tab per open document; every editor scrolls itself
+        self.tabs = QTabWidget()
+        self.tabs.setDocumentMode(True)
+        self.tabs.setMovable(True)
+        self.setCentralWidget(self.tabs)
         
         # left tool bar for colors
         self.toolbarLeft = self.addToolBar("Colors")
@@ -36,30 +56,41 @@ class MainWindow(QMainWindow):
         self.toolbarRight.setMovable(False)
         
         # add editor and then add buttons to both tool bars
+        profile.mark("main window")
         self.show_dialog()
+        if self.editor is None:
+            self.add_document(PixelArtEditor(64, 64), "Untitled")
+        profile.mark("new canvas dialog")
         self.add_grab_tool()
         self.add_brush_tool()
         self.add_eraser_tool()
+        self.add_select_tool()
+        profile.mark("tool icons")
         self.add_color_buttons()
         self.add_brushsize_slider()
+        self.add_fill_options()
         self.add_clear_button()
         self.add_menu_buttons()
         self.add_print_button()
+        self.add_print_status()
         self.add_zoom_button()
         self.add_fill_tool()
+        self.add_layers_panel()
+        self.add_frames_toolbar()
+        self.add_animation_status()
+        self.add_image_loader()
+        profile.mark("toolbars")
         self.set_toolbarRight_styles()
         self.set_toolbarLeft_styles()
-        self.set_scrollarea_styles()
+        self.set_tabs_styles()
+        profile.mark("styles")
+        self.add_autosave()
+        self.tabs.currentChanged.connect(self.editor_changed)
+        self.tabs.tabCloseRequested.connect(self.close_document)
+        self.editor_changed()
         
 
 
-    def fill_white(self, image):
-        for x in range(image.width()):
-            for y in range(image.height()):
-                if image.pixelColor(x, y).alpha() > 0:  # Keep transparency
-                    image.setPixelColor(x, y, QColor(255,255,255))
-        return QPixmap.fromImage(image)
-
         # add menu bar with file > new button
     def add_menu_buttons(self):
         self.menu = self.menuBar()
@@ -68,44 +99,156 @@ class MainWindow(QMainWindow):
         self.open_action = self.file_menu.addAction("Open")
         self.open_action.triggered.connect(self.open_image)
 
+        self.import_action = self.file_menu.addAction("Import Photo...")
+        self.import_action.triggered.connect(self.import_photo)
+
         self.new_action = self.file_menu.addAction("New")
         self.new_action.triggered.connect(self.show_dialog)
 
+        self.open_project_action = self.file_menu.addAction("Open Project...")
+        self.open_project_action.triggered.connect(self.open_project)
+
+        self.save_project_action = self.file_menu.addAction("Save Project")
+        self.save_project_action.setShortcut(QKeySequence.Save)
+        self.save_project_action.triggered.connect(lambda: self.save_project())
+
+        self.save_project_as_action = self.file_menu.addAction("Save Project As...")
+        self.save_project_as_action.setShortcut(QKeySequence.SaveAs)
+        self.save_project_as_action.triggered.connect(lambda: self.save_project(save_as=True))
+
+        self.autosave_action = self.file_menu.addAction("Autosave Interval...")
+        self.autosave_action.triggered.connect(self.change_autosave_interval)
+
+        self.memory_cap_action = self.file_menu.addAction("Memory Limit...")
+        self.memory_cap_action.triggered.connect(self.change_memory_cap)
+
         self.export_action = self.file_menu.addAction("Export")
-        self.export_action.triggered.connect(self.editor.open_save_dialog)
+        self.export_action.triggered.connect(self.editor_action("open_save_dialog"))
+
+        self.export_cropped_action = self.file_menu.addAction("Export Cropped to Content")
+        self.export_cropped_action.triggered.connect(self.editor_action("open_save_dialog", crop=True))
+
+        self.export_animation_action = self.file_menu.addAction("Export Animation...")
+        self.export_animation_action.triggered.connect(self.export_animation)
+
+        self.close_action = self.file_menu.addAction("Close")
+        self.close_action.setShortcut(QKeySequence.Close)
+        self.close_action.triggered.connect(lambda: self.close_document(self.tabs.currentIndex()))
 
         self.edit_menu = self.menu.addMenu("&Edit")
         self.undo_btn = self.edit_menu.addAction("Undo")
-        self.undo_btn.triggered.connect(self.editor.undo)
+        self.undo_btn.triggered.connect(self.undo)
+        self.redo_btn = self.edit_menu.addAction("Redo")
+        self.redo_btn.triggered.connect(self.redo)
+        self.edit_menu.addSeparator()
+        for name, shortcut, method in [("Cut", QKeySequence.Cut, "cut_selection"),
+                                       ("Copy", QKeySequence.Copy, "copy_selection"),
+                                       ("Paste", QKeySequence.Paste, "paste"),
+                                       ("Delete", QKeySequence.Delete, "delete_selection"),
+                                       ("Select All", QKeySequence.SelectAll, "select_all"),
+                                       ("Deselect", QKeySequence.Deselect, "deselect")]:
+            action = self.edit_menu.addAction(name)
+            action.setShortcut(shortcut)
+            action.triggered.connect(self.editor_action(method))
+        self.edit_menu.addSeparator()
+        self.indexed_action = self.edit_menu.addAction("Indexed Colors")
+        self.indexed_action.setCheckable(True)
+        self.indexed_action.setChecked(self.editor.is_indexed())
+        self.indexed_action.toggled.connect(self.set_indexed)
+
+        self.view_menu = self.menu.addMenu("&View")
+        self.overlay_action = self.view_menu.addAction("Performance Overlay")
+        self.overlay_action.setCheckable(True)
+        self.overlay_action.setShortcut("F12")
+        self.overlay_action.toggled.connect(self.show_overlay)
+        self.save_trace_action = self.view_menu.addAction("Save Performance Trace...")
+        self.save_trace_action.triggered.connect(self.save_trace)
+        self.overlay_action.setChecked(instrument.enabled)
+        self.grid_action = self.view_menu.addAction("Pixel Grid")
+        self.grid_action.setCheckable(True)
+        self.grid_action.setChecked(pixel_grid_visible())
+        self.grid_action.toggled.connect(self.set_grid_visible)
+
+    # shown from a zoom of 8 on, remembered for every canvas
+    def set_grid_visible(self, visible):
+        set_pixel_grid_visible(visible)
+        self.editor.set_grid_visible(visible)
+
+    # turning the overlay on also turns timing on; timing stays on afterwards
+    # so the trace keeps everything since
+    def show_overlay(self, visible):
+        if visible:
+            instrument.enabled = True
+        self.editor.set_overlay_visible(visible)
+
+    def save_trace(self):
+        if not instrument.events:
+            QMessageBox.information(self, "Performance Trace", "Nothing recorded yet. Turn on View > Performance Overlay first.")
+            return
+        file_path, _ = QFileDialog.getSaveFileName(self, "Save Performance Trace", "trace.json", "Chrome Trace (*.json)")
+        if file_path:
+            try:
+                instrument.save_trace(file_path)
+            except OSError as e:
+                QMessageBox.information(self, "Performance Trace", str(e))
 
 
     def add_color_buttons(self):
-        colors = [QColor("black"),QColor("white"),QColor("gray"), QColor("red"), QColor("green"), QColor("blue"), QColor("yellow"), QColor("purple"), QColor("brown")]
+        containerWidget = QWidget()
+        self.color_grid = QGridLayout()
+        containerWidget.setLayout(self.color_grid)
+        self.update_color_buttons()
+        self.toolbarLeft.addWidget(containerWidget)
+
+    # one button per color of the editor's palette, three to a row. right
+    # click a button to change its color
+    def update_color_buttons(self):
+        while self.color_grid.count():
+            self.color_grid.takeAt(0).widget().deleteLater()
         i = 0
         j = 0
-        containerWidget = QWidget()
-        grid = QGridLayout()
-        for color in colors:
+        for color in self.editor.palette:
             btn = QPushButton()
             btn.setStyleSheet(f"background-color: {color.name()}; border: 2px solid black")
             btn.setFixedSize(20,20)
             btn.clicked.connect(lambda _, col=color: self.setColor(col))
-            grid.addWidget(btn, j, i)
-            containerWidget.setLayout(grid)
+            btn.setContextMenuPolicy(Qt.CustomContextMenu)
+            btn.customContextMenuRequested.connect(lambda _, index=i + j * 3: self.edit_palette_color(index))
+            self.color_grid.addWidget(btn, j, i)
             i+=1
             if i > 2:
                 i = 0
                 j += 1
-        self.toolbarLeft.addWidget(containerWidget)
     
+    def edit_palette_color(self, index):
+        old = self.editor.palette[index]
+        color = QColorDialog.getColor(old, self, "Palette Color", QColorDialog.ShowAlphaChannel)
+        if color.isValid() and color != old:
+            self.editor.set_palette_color(index, color)
+            if self.editor.current_color == old:
+                self.editor.current_color = color
+            self.update_color_buttons()
+
+    # convert the canvas between full colors and palette indices
+    def set_indexed(self, indexed):
+        if not self.editor.set_indexed(indexed):
+            QMessageBox.information(self, "Indexed Colors", "The image uses more colors than a palette can hold.")
+        self.update_buttons_for_mode()
+
+    def update_buttons_for_mode(self):
+        self.indexed_action.blockSignals(True)
+        self.indexed_action.setChecked(self.editor.is_indexed())
+        self.indexed_action.blockSignals(False)
+        self.update_color_buttons()
+
     def add_export_button(self):
         self.export_btn = QPushButton("Export")
-        self.export_btn.clicked.connect(self.editor.open_save_dialog)
+        self.export_btn.clicked.connect(self.editor_action("open_save_dialog"))
         self.toolbarLeft.addWidget(self.export_btn)
 
     def add_clear_button(self):
         self.clear_btn = QPushButton("Clear")
-        self.clear_btn.clicked.connect(self.editor.clear_canvas)
+        self.clear_btn.clicked.connect(self.editor_action("clear_canvas"))
         self.toolbarLeft.addWidget(self.clear_btn)
 
     def add_brushsize_slider(self):
@@ -142,37 +285,250 @@ class MainWindow(QMainWindow):
     }""")
         self.brush_size.textChanged.connect(self.update_brush)
         self.toolbarLeft.addWidget(self.brush_size)
+        self.brush_shape = QComboBox()
+        self.brush_shape.addItems(["round", "square"])
+        self.brush_shape.setStyleSheet("QComboBox { color: white; }")
+        self.brush_shape.currentTextChanged.connect(self.update_brush_shape)
+        self.toolbarLeft.addWidget(self.brush_shape)
 
     def update_brush(self, value):
         self.editor.set_brush_size(int(value))
 
+    def add_fill_options(self):
+        tolerance_label = QLabel("Fill tolerance")
+        tolerance_label.setAlignment(Qt.AlignCenter)
+        self.toolbarLeft.addWidget(tolerance_label)
+        self.fill_tolerance = QSpinBox()
+        self.fill_tolerance.setRange(0, 255)
+        self.fill_tolerance.setValue(0)
+        self.fill_tolerance.setStyleSheet("QSpinBox { color: white; }")
+        self.fill_tolerance.valueChanged.connect(self.update_fill_options)
+        self.toolbarLeft.addWidget(self.fill_tolerance)
+        self.fill_contiguous = QCheckBox("Contiguous")
+        self.fill_contiguous.setStyleSheet("QCheckBox { color: white; }")
+        self.fill_contiguous.setChecked(True)
+        self.fill_contiguous.toggled.connect(self.update_fill_options)
+        self.toolbarLeft.addWidget(self.fill_contiguous)
+
+    def update_fill_options(self):
+        self.editor.set_fill_options(self.fill_tolerance.value(), self.fill_contiguous.isChecked())
+
+    def update_brush_shape(self, shape):
+        self.editor.set_brush_shape(shape)
+
+    # dock listing the editor's layers, top layer first
+    def add_layers_panel(self):
+        self.layers_dock = QDockWidget("Layers", self)
+        self.layers_dock.setFeatures(QDockWidget.DockWidgetMovable | QDockWidget.DockWidgetFloatable)
+        panel = QWidget()
+        layout = QVBoxLayout(panel)
+        self.layer_list = QListWidget()
+        self.layer_list.currentRowChanged.connect(self.select_layer)
+        self.layer_list.itemChanged.connect(self.layer_item_changed)
+        layout.addWidget(self.layer_list)
+
+        buttons = QHBoxLayout()
+        for text, action in (("+", lambda: self.editor.add_layer()), ("-", lambda: self.editor.remove_layer()),
+                             ("Up", lambda: self.editor.move_layer(1)), ("Down", lambda: self.editor.move_layer(-1))):
+            btn = QPushButton(text)
+            btn.clicked.connect(lambda _, action=action: (action(), self.update_layers_panel()))
+            buttons.addWidget(btn)
+        layout.addLayout(buttons)
+
+        self.layer_opacity = QSpinBox()
+        self.layer_opacity.setRange(0, 100)
+        self.layer_opacity.setSuffix("%")
+        self.layer_opacity.valueChanged.connect(lambda value: self.update_active_layer(opacity=value / 100))
+        self.layer_blend = QComboBox()
+        self.layer_blend.addItems(BLEND_MODES)
+        self.layer_blend.currentTextChanged.connect(lambda mode: self.update_active_layer(blend=mode))
+        self.layer_lock = QCheckBox("Lock")
+        self.layer_lock.toggled.connect(lambda locked: self.update_active_layer(locked=locked))
+        options = QHBoxLayout()
+        options.addWidget(self.layer_opacity)
+        options.addWidget(self.layer_blend)
+        options.addWidget(self.layer_lock)
+        layout.addLayout(options)
+
+        self.layers_dock.setWidget(panel)
+        self.addDockWidget(Qt.RightDockWidgetArea, self.layers_dock)
+        self.update_layers_panel()
+
+    def update_layers_panel(self):
+        layers = self.editor.layers
+        widgets = (self.layer_list, self.layer_opacity, self.layer_blend, self.layer_lock)
+        for widget in widgets:
+            widget.blockSignals(True)
+        self.layer_list.clear()
+        for layer in reversed(layers.layers):
+            item = QListWidgetItem(layer.name)
+            item.setFlags(item.flags() | Qt.ItemIsUserCheckable | Qt.ItemIsEditable)
+            item.setCheckState(Qt.Checked if layer.visible else Qt.Unchecked)
+            self.layer_list.addItem(item)
+        self.layer_list.setCurrentRow(len(layers.layers) - 1 - layers.active)
+        active = layers.active_layer
+        self.layer_opacity.setValue(round(active.opacity * 100))
+        self.layer_blend.setCurrentText(active.blend)
+        self.layer_lock.setChecked(active.locked)
+        for widget in widgets:
+            widget.blockSignals(False)
+
+    # list rows run top to bottom, layer indices bottom to top
+    def layer_index(self, row):
+        return len(self.editor.layers.layers) - 1 - row
+
+    def select_layer(self, row):
+        if row >= 0:
+            self.editor.set_active_layer(self.layer_index(row))
+            self.update_layers_panel()
+
+    def layer_item_changed(self, item):
+        index = self.layer_index(self.layer_list.row(item))
+        self.editor.update_layer(index, name=item.text(), visible=item.checkState() == Qt.Checked)
+
+    def update_active_layer(self, **changes):
+        self.editor.update_layer(self.editor.layers.active, **changes)
+
+    # bottom tool bar for the frames of an animation
+    def add_frames_toolbar(self):
+        self.toolbarFrames = QToolBar("Frames")
+        self.addToolBar(Qt.BottomToolBarArea, self.toolbarFrames)
+        self.toolbarFrames.setMovable(False)
+        self.frame_label = QLabel()
+        self.toolbarFrames.addWidget(self.frame_label)
+        timeline = lambda: self.editor.timeline
+        for text, action in (("Prev", lambda: self.editor.show_frame(max(0, timeline().current - 1))),
+                             ("Next", lambda: self.editor.show_frame(min(len(timeline().frames) - 1, timeline().current + 1))),
+                             ("New Frame", lambda: self.editor.add_frame()),
+                             ("Duplicate", lambda: self.editor.add_frame(duplicate=True)),
+                             ("Delete Frame", lambda: self.editor.remove_frame()),
+                             ("Move Left", lambda: self.editor.move_frame(-1)),
+                             ("Move Right", lambda: self.editor.move_frame(1)),
+                             ("Play/Stop", lambda: self.editor.toggle_playback())):
+            btn = QPushButton(text)
+            btn.clicked.connect(lambda _, action=action: (action(), self.update_frame_panels()))
+            self.toolbarFrames.addWidget(btn)
+        self.frame_duration = QSpinBox()
+        self.frame_duration.setRange(10, 10000)
+        self.frame_duration.setSingleStep(10)
+        self.frame_duration.setSuffix(" ms")
+        self.frame_duration.valueChanged.connect(lambda duration: self.editor.set_frame_duration(duration))
+        self.toolbarFrames.addWidget(self.frame_duration)
+        self.onion_skin = QCheckBox("Onion skin")
+        self.onion_skin.toggled.connect(lambda enabled: self.editor.set_onion_skin(enabled))
+        self.toolbarFrames.addWidget(self.onion_skin)
+        self.update_frames_toolbar()
+
+    def update_frames_toolbar(self):
+        timeline = self.editor.timeline
+        self.frame_label.setText(f"Frame {timeline.current + 1}/{len(timeline.frames)}")
+        for widget in (self.frame_duration, self.onion_skin):
+            widget.blockSignals(True)
+        self.frame_duration.setValue(timeline.frame.duration)
+        self.onion_skin.setChecked(timeline.onion_skin)
+        for widget in (self.frame_duration, self.onion_skin):
+            widget.blockSignals(False)
+
+    # each frame has its own layers
+    def update_frame_panels(self):
+        self.update_frames_toolbar()
+        self.update_layers_panel()
+
+    # undo and redo can go to another frame
+    def undo(self):
+        self.editor.undo()
+        self.update_frame_panels()
+
+    def redo(self):
+        self.editor.redo()
+        self.update_frame_panels()
+
+    def add_animation_status(self):
+        exporter = animation_exporter()
+        exporter.progress.connect(lambda done, total: self.statusBar().showMessage(f"Exporting animation: frame {done}/{total}"))
+        exporter.exported.connect(lambda path: self.statusBar().showMessage(f"Exported {path}", 5000))
+        exporter.failed.connect(lambda message: self.statusBar().showMessage(message, 5000))
+
+    def export_animation(self):
+        file_path, selected = QFileDialog.getSaveFileName(self, "Export Animation", os.path.join(self.editor.last_directory, "animation.gif"),
+                                                          ";;".join(ANIMATION_FILTERS.values()))
+        if not file_path:
+            return
+        kinds = {name: kind for kind, name in ANIMATION_FILTERS.items()}
+        kind = kinds.get(selected, "gif" if file_path.endswith(".gif") else "apng")
+        if not os.path.splitext(file_path)[1]:
+            file_path += ".gif" if kind == "gif" else ".png"
+        scale_factor, ok = QInputDialog.getInt(self, "Scale Factor", "Enter the scale factor (e.g., 1 for normal size, 20 for large):", 1, 1, 100)
+        if ok:
+            self.editor.last_directory = QFileInfo(file_path).path()
+            self.editor.export_animation(kind, file_path, scale_factor)
+
     def add_print_button(self):
         self.print_btn = QPushButton("Print")
         self.print_btn.clicked.connect(self.print_function)
         self.toolbarLeft.addWidget(self.print_btn)
-
-    # function that checks how large image is so that it can be scaled up to print sharp on printer
+        self.dither_mode = QComboBox()
+        self.dither_mode.addItems(DITHER_MODES)
+        self.dither_mode.setToolTip("Dithering used for printing")
+        self.dither_mode.setStyleSheet("QComboBox { color: white; }")
+        self.toolbarLeft.addWidget(self.dither_mode)
+
+    # show what the background print service is doing in the status bar
+    def add_print_status(self):
+        service = print_service()
+        service.status.connect(lambda message: self.statusBar().showMessage(message, 5000))
+        service.job_queued.connect(lambda job_id: self.statusBar().showMessage(f"Print job {job_id} queued"))
+        service.job_progress.connect(lambda job_id, sent, total: self.statusBar().showMessage(f"Printing job {job_id}: {sent * 100 // total}%"))
+
+    # autosave the current canvas in the background, and offer to bring back
+    # what a crashed session left behind
+    def add_autosave(self):
+        self.autosave = AutosaveService()
+        self.autosave.failed.connect(lambda message: self.statusBar().showMessage(f"Autosave failed: {message}", 5000))
+        for index in range(self.tabs.count()):
+            self.autosave.watch(self.tabs.widget(index))
+        QTimer.singleShot(0, self.offer_recovery)
+
+    def change_autosave_interval(self):
+        seconds, ok = QInputDialog.getInt(self, "Autosave", "Autosave every how many seconds (0 turns it off):", self.autosave.interval, 0, 3600)
+        if ok:
+            set_autosave_interval(seconds)
+            self.autosave.set_interval(seconds)
+
+    # every canvas a crashed session had open comes back in its own tab
+    def offer_recovery(self):
+        files = recoverable_files()
+        if not files:
+            return
+        saved_at = QFileInfo(files[0]).lastModified().toString("yyyy-MM-dd hh:mm:ss")
+        question = f"The editor didn't close properly last time. Recover the canvas autosaved at {saved_at}?"
+        if len(files) > 1:
+            question = f"The editor didn't close properly last time. Recover the {len(files)} canvases autosaved, the last at {saved_at}?"
+        if QMessageBox.question(self, "Recover Unsaved Work", question) == QMessageBox.Yes:
+            for path in files:
+                try:
+                    self.show_project(recover(path), "Recovered")
+                except (ProjectError, OSError) as e:
+                    QMessageBox.information(self, "Recover Unsaved Work", str(e))
+                    return
+        discard_files(files)
+
+    def closeEvent(self, event):
+        self.autosave.stop()
+        print_service().stop()
+        animation_exporter().stop()
+        import_service().stop()
+        image_loader().stop()
+        shutdown_pool()
+        self.documents.clear()
+        if instrument.trace_path:
+            instrument.save_trace(instrument.trace_path)
+        super().closeEvent(event)
+
+    # small sprites no longer need scaling up first, the print pipeline
+    # resamples any canvas to the printer width itself
     def print_function(self):
-        if self.editor.image.width() < 200:
-            scale_factor = 20
-            scaled_image = self.editor.image.scaled(
-            self.editor.image.width() * scale_factor,
-            self.editor.image.height() * scale_factor,
-            Qt.KeepAspectRatio,
-            Qt.FastTransformation
-            )
-        
-            # Create a new editor object with the size of the scaled image
-            new_editor = PixelArtEditor(scaled_image.width(), scaled_image.height())
-            
-            # Set the scaled image on the new canvas
-            new_editor.image = scaled_image
-            new_editor.pixmap_item.setPixmap(QPixmap.fromImage(scaled_image))
-            self.editor.print_pic(new_editor)
-            del new_editor
-
-        else:
-            self.editor.print_pic(self.editor)
+        self.editor.print_pic(self.editor, self.dither_mode.currentText())
 
     def add_zoom_button(self):
         text = QLabel("Zoom:")
@@ -181,66 +537,64 @@ class MainWindow(QMainWindow):
         zoom_layout = QHBoxLayout(container)
         self.zoom_out_btn = QPushButton("-")
         self.zoom_in_btn = QPushButton("+")
-        self.zoom_in_btn.clicked.connect(self.editor.zoom_in)
-        self.zoom_out_btn.clicked.connect(self.editor.zoom_out)
+        self.zoom_in_btn.clicked.connect(self.editor_action("zoom_in"))
+        self.zoom_out_btn.clicked.connect(self.editor_action("zoom_out"))
         zoom_layout.addWidget(self.zoom_out_btn)
         zoom_layout.addWidget(self.zoom_in_btn)
         self.toolbarLeft.addWidget(text)
         self.toolbarLeft.addWidget(container)
 
     def add_brush_tool(self):
-        pixmap = QPixmap("icons/brush.png")
-        image = pixmap.toImage()
-        fill_image = self.fill_white(image)
-        icon = QIcon(fill_image)
+        icon = QIcon(white_icon("icons/brush.png"))
         self.brush_btn = QPushButton()
         self.brush_btn.setIcon(icon)
         self.brush_btn.setCheckable(True)
         self.brush_btn.setChecked(True)
-        self.brush_btn.clicked.connect(lambda: self.activate_tool(self.brush_btn, self.editor.draw_switch))
+        self.brush_btn.clicked.connect(lambda: self.activate_tool(self.brush_btn, "draw_switch"))
         self.brush_btn.setFixedSize(40,40)
         self.toolbarRight.addWidget(self.brush_btn)
         self.tool_buttons.append(self.brush_btn)
 
     def add_eraser_tool(self):
-        pixmap = QPixmap("icons/eraser.png")
-        image = pixmap.toImage()
-        fill_image = self.fill_white(image)
-        icon = QIcon(fill_image)
+        icon = QIcon(white_icon("icons/eraser.png"))
         self.eraser_btn = QPushButton()
         self.eraser_btn.setIcon(icon)
         self.eraser_btn.setCheckable(True)
-        self.eraser_btn.clicked.connect(lambda: self.activate_tool(self.eraser_btn, self.editor.eraser_switch))
+        self.eraser_btn.clicked.connect(lambda: self.activate_tool(self.eraser_btn, "eraser_switch"))
         self.eraser_btn.setFixedSize(40,40)
         self.toolbarRight.addWidget(self.eraser_btn)
         self.tool_buttons.append(self.eraser_btn)
 
     def add_fill_tool(self):
-        pixmap = QPixmap("icons/paint-bucket.png")
-        image = pixmap.toImage()
-        fill_image = self.fill_white(image)
-        icon = QIcon(fill_image)
+        icon = QIcon(white_icon("icons/paint-bucket.png"))
         self.fill_btn = QPushButton()
         self.fill_btn.setIcon(icon)
         self.fill_btn.setCheckable(True)
-        self.fill_btn.clicked.connect(lambda: self.activate_tool(self.fill_btn, self.editor.fill_switch))
+        self.fill_btn.clicked.connect(lambda: self.activate_tool(self.fill_btn, "fill_switch"))
         self.fill_btn.setFixedSize(40,40)
         self.toolbarRight.addWidget(self.fill_btn)
         self.tool_buttons.append(self.fill_btn)
 
     def add_grab_tool(self):
-        pixmap = QPixmap("icons/grab.png")
-        image = pixmap.toImage()
-        fill_image = self.fill_white(image)
-        icon = QIcon(fill_image)
+        icon = QIcon(white_icon("icons/grab.png"))
         self.grab_btn = QPushButton()
         self.grab_btn.setIcon(icon)
         self.grab_btn.setCheckable(True)
-        self.grab_btn.clicked.connect(lambda:self.activate_tool(self.grab_btn, self.editor.grab_switch))
+        self.grab_btn.clicked.connect(lambda: self.activate_tool(self.grab_btn, "grab_switch"))
         self.grab_btn.setFixedSize(40,40)
         self.toolbarRight.addWidget(self.grab_btn)
         self.tool_buttons.append(self.grab_btn)
 
+    def add_select_tool(self):
+        icon = QIcon(white_icon("icons/select.png"))
+        self.select_btn = QPushButton()
+        self.select_btn.setIcon(icon)
+        self.select_btn.setCheckable(True)
+        self.select_btn.clicked.connect(lambda: self.activate_tool(self.select_btn, "select_switch"))
+        self.select_btn.setFixedSize(40,40)
+        self.toolbarRight.addWidget(self.select_btn)
+        self.tool_buttons.append(self.select_btn)
+
     def set_toolbarRight_styles(self):
         self.toolbarRight.setStyleSheet("""
             
@@ -278,8 +632,8 @@ class MainWindow(QMainWindow):
             }
         """)
 
-    def set_scrollarea_styles(self):
-        self.scroll_area.setStyleSheet("""
+    def set_tabs_styles(self):
+        self.tabs.setStyleSheet("""
             * {
                 background-color: grey;
                 border: none;
@@ -291,45 +645,89 @@ class MainWindow(QMainWindow):
     def setColor(self, color):
         self.editor.current_color = color
 
-    def update_buttons(self):
-        self.export_action.triggered.disconnect()
-        self.export_action.triggered.connect(self.editor.open_save_dialog)
-
-        self.open_action.triggered.disconnect()
-        self.open_action.triggered.connect(self.open_image)
-
-        self.print_btn.clicked.disconnect()
-        self.print_btn.clicked.connect(self.print_function)
-
-        self.clear_btn.clicked.disconnect()
-        self.clear_btn.clicked.connect(self.editor.clear_canvas)
-        
-        self.brush_btn.clicked.disconnect()
-        self.brush_btn.clicked.connect(lambda: self.activate_tool(self.brush_btn, self.editor.draw_switch))
-
-        self.eraser_btn.clicked.disconnect()
-        self.eraser_btn.clicked.connect(lambda: self.activate_tool(self.eraser_btn, self.editor.eraser_switch))
-
-        self.fill_btn.clicked.disconnect()
-        self.fill_btn.clicked.connect(lambda: self.activate_tool(self.fill_btn, self.editor.fill_switch))
-
-        self.grab_btn.clicked.disconnect()
-        self.grab_btn.clicked.connect(lambda: self.activate_tool(self.grab_btn, self.editor.grab_switch))
-
-        self.zoom_in_btn.clicked.disconnect()
-        self.zoom_in_btn.clicked.connect(self.editor.zoom_in)
-
-        self.zoom_out_btn.clicked.disconnect()
-        self.zoom_out_btn.clicked.connect(self.editor.zoom_out)
-
-        self.undo_btn.triggered.disconnect()
-        self.undo_btn.triggered.connect(self.editor.undo)
-
-        self.brush_size.valueChanged.disconnect()
-        self.brush_size.valueChanged.connect(self.update_brush)
-
-
-    def activate_tool(self, button, action):
+    # the editor of the tab being shown, None before the first document
+    @property
+    def editor(self):
+        return self.tabs.currentWidget()
+
+    # the one place toolbar buttons and menu actions reach the editor
+    # through: a slot calling the named editor method on whichever document
+    # is shown when it fires
+    def editor_action(self, name, *args, **kwargs):
+        return lambda *_: getattr(self.editor, name)(*args, **kwargs)
+
+    # another tab was brought to the front. its pixels come back first if
+    # they were offloaded, then it takes over the tool settings and the
+    # panels show it
+    def editor_changed(self):
+        editor = self.editor
+        if editor is None:
+            return
+        try:
+            self.documents.touch(editor)
+        except (ProjectError, OSError) as e:
+            # there's nothing left to show or edit, so the tab goes
+            QMessageBox.information(self, "Memory Limit", f"Cannot bring the canvas back, closing it: {e}")
+            if self.tabs.count() < 2:
+                self.add_document(PixelArtEditor(editor.width, editor.height), "Untitled")
+            self.close_document(self.tabs.indexOf(editor))
+            return
+        getattr(editor, self.active_tool)()
+        editor.set_brush_size(self.brush_size.value())
+        editor.set_brush_shape(self.brush_shape.currentText())
+        editor.set_grid_visible(self.grid_action.isChecked())
+        self.update_fill_options()
+        self.update_buttons_for_mode()
+        self.update_frame_panels()
+        editor.set_overlay_visible(self.overlay_action.isChecked())
+        # the others may have to make room, once this one is on screen
+        QTimer.singleShot(0, self.trim_documents)
+
+    def trim_documents(self):
+        if self.editor is not None:
+            self.documents.trim(self.editor, self.autosave.save)
+
+    def add_document(self, editor, title):
+        index = self.tabs.addTab(editor, title)
+        self.tabs.setTabToolTip(index, title)
+        self.tabs.setTabsClosable(self.tabs.count() > 1)
+        if self.autosave is not None:
+            self.autosave.watch(editor)
+        self.tabs.setCurrentIndex(index)
+
+    # the last document can't be closed, there'd be nothing to draw on
+    def close_document(self, index):
+        editor = self.tabs.widget(index)
+        if editor is None or self.tabs.count() < 2:
+            return
+        for job, (path, loading_editor) in list(self.loading.items()):
+            if loading_editor is editor:
+                self.cancel_loading(job)
+        editor.stop_playback()
+        self.autosave.forget(editor)
+        self.documents.forget(editor)
+        self.tabs.removeTab(index)
+        self.tabs.setTabsClosable(self.tabs.count() > 1)
+        editor.deleteLater()
+
+    def save_project(self, save_as=False):
+        if self.editor.save_project_dialog(save_as):
+            self.set_tab_title(self.editor, os.path.basename(self.editor.project.path))
+
+    def set_tab_title(self, editor, title):
+        index = self.tabs.indexOf(editor)
+        self.tabs.setTabText(index, title)
+        self.tabs.setTabToolTip(index, title)
+
+    def change_memory_cap(self):
+        megabytes, ok = QInputDialog.getInt(self, "Memory Limit", "Memory the open canvases may use before inactive ones are moved to disk (MB):",
+                                            memory_cap(), 16, 65536)
+        if ok:
+            set_memory_cap(megabytes)
+            self.documents.set_cap(megabytes)
+            self.trim_documents()
+
+    def activate_tool(self, button, switch):
         # Uncheck all buttons
         for btn in self.tool_buttons:
             if btn is not button:
@@ -339,22 +737,15 @@ class MainWindow(QMainWindow):
         button.setChecked(True)
 
         # Perform the action associated with the button
-        action()
+        self.active_tool = switch
+        getattr(self.editor, switch)()
 
 # shows dialog for creating a new canvas
     def show_dialog(self):
         dialog = InputDialog()
         if dialog.exec():
             input1, input2 = dialog.getInputs()
-            if self.dialog_counter > 0:
-                prev_brush_size = self.editor.brush_size
-            self.editor = PixelArtEditor(int(input1), int(input2))
-            self.scroll_area.setWidget(self.editor)
-            self.setCentralWidget(self.scroll_area)
-            if self.dialog_counter > 0:
-                self.update_buttons()
-                self.update_brush(int(prev_brush_size))
-            self.dialog_counter += 1
+            self.add_document(PixelArtEditor(int(input1), int(input2), dialog.isIndexed()), "Untitled")
 
     def open_image(self):
         # Open file dialog to select an image
@@ -362,27 +753,86 @@ class MainWindow(QMainWindow):
         file_path, _ = file_dialog.getOpenFileName(self, "Open Image", "", "Image Files (*.png *.jpg *.jpeg *.bmp *.gif);;All Files (*)")
         
         if file_path:
-            # Load the image
-            image = QImage(file_path)
-            
-            if image.isNull():
-                QMessageBox.information(self, "Image Viewer", "Cannot load %s." % file_path)
-                return
-            
-            # Create a new editor object with the size of the loaded image
-            self.editor = PixelArtEditor(image.width(), image.height())
-            
-            # Set the loaded image on the canvas
-            self.editor.image = image
-            self.editor.pixmap_item.setPixmap(QPixmap.fromImage(image))
-            
-            # Set the new editor in the scroll area
-            self.scroll_area.setWidget(self.editor)
-            self.setCentralWidget(self.scroll_area)
-            self.dialog_counter += 1
-            if self.dialog_counter > 1:
-                self.update_buttons()
-
+            # decoded in the background, every frame of it if it's animated
+            self.loading[image_loader().submit(file_path)] = [file_path, None]
+            self.statusBar().showMessage(f"Opening {file_path}...")
+
+    def add_image_loader(self):
+        loader = image_loader()
+        loader.preview.connect(self.show_loading_image)
+        loader.loaded.connect(self.show_loaded_image)
+        loader.failed.connect(self.show_loading_failure)
+
+    # its tab was closed before the image was in
+    def cancel_loading(self, job):
+        del self.loading[job]
+        image_loader().cancel(job)
+
+    # the new tab appears as soon as there's a preview, sized like the full
+    # image, and gets its pixels once they're ready
+    def show_loading_image(self, job, image, size):
+        if job not in self.loading:
+            return
+        path = self.loading[job][0]
+        editor = PixelArtEditor(size.width(), size.height())
+        editor.show_preview(image)
+        self.loading[job][1] = editor
+        self.add_document(editor, os.path.basename(path))
+
+    def show_loaded_image(self, job, timeline):
+        if job not in self.loading:
+            return
+        path, editor = self.loading.pop(job)
+        editor.set_timeline(timeline)
+        if editor is self.editor:
+            self.update_frame_panels()
+        self.statusBar().showMessage(f"Opened {path}", 5000)
+
+    def show_loading_failure(self, job, message):
+        if job not in self.loading:
+            return
+        path, editor = self.loading.pop(job)
+        self.statusBar().clearMessage()
+        if editor is not None:
+            self.close_document(self.tabs.indexOf(editor))
+            if editor.preview_item.isVisible():
+                # it was the only tab left
+                editor.set_timeline(editor.timeline)
+        QMessageBox.information(self, "Image Viewer", message)
+
+    # a photo as pixel art: scaled down to a grid and reduced to a few colors
+    # in the background instead of opened at full resolution
+    def import_photo(self):
+        file_dialog = QFileDialog(self)
+        file_path, _ = file_dialog.getOpenFileName(self, "Import Photo", "", "Image Files (*.png *.jpg *.jpeg *.bmp *.gif);;All Files (*)")
+        if not file_path:
+            return
+        dialog = ImportDialog(file_path, [color.rgba() for color in self.editor.palette])
+        if not dialog.exec() or dialog.getResult() is None:
+            return
+        indices, colors = dialog.getResult()
+        height, width = indices.shape
+        editor = PixelArtEditor(width, height)
+        editor.set_quantized(indices, colors, dialog.isIndexed())
+        self.add_document(editor, os.path.basename(file_path))
+
+    def open_project(self):
+        file_dialog = QFileDialog(self)
+        file_path, _ = file_dialog.getOpenFileName(self, "Open Project", "", PROJECT_FILTER)
+        if not file_path:
+            return
+        try:
+            project = load_project(file_path)
+        except (ProjectError, OSError) as e:
+            QMessageBox.information(self, "Open Project", str(e))
+            return
+        self.show_project(project, os.path.basename(file_path))
+        self.editor.last_directory = QFileInfo(file_path).path()
+
+    def show_project(self, project, title="Untitled"):
+        editor = PixelArtEditor(project.layers.width, project.layers.height)
+        editor.set_project(project)
+        self.add_document(editor, title)
 
         # change cursor icon
     # def enterEvent(self, event):
@@ -399,8 +849,13 @@ class MainWindow(QMainWindow):
     
 ###################### Main #####################
 
-app = QApplication(sys.argv)
-window = MainWindow()
-window.show()
-sys.exit(app.exec())
+# guarded so worker processes started with spawn can import this module
+if __name__ == "__main__":
+    app = QApplication(sys.argv)
+    profile.mark("QApplication")
+    window = MainWindow()
+    window.show()
+    profile.mark("show")
+    QTimer.singleShot(0, lambda: (profile.mark("first event loop turn"), profile.report()))
+    sys.exit(app.exec())
 
@@ -0,0 +1,77 @@
+import numpy as np
+
+from canvas import TiledCanvas
+
+MAX_COLORS = 255  # index 0 is transparent
+
+
+# colors of an indexed document. its canvases hold one byte per pixel: 0 for
+# transparent, i for the (i - 1)th color. lut maps indices to ARGB, so
+# recoloring changes 256 entries and never touches a pixel
+class Palette:
+    def __init__(self, colors):
+        self.colors = [int(color) for color in colors[:MAX_COLORS]]
+        self.lut = np.zeros(256, np.uint32)
+        self.lut[1:len(self.colors) + 1] = self.colors
+        # bumped on every recolor, so cached renders know to redo themselves
+        self.version = 0
+
+    def color_table(self):
+        return self.lut.tolist()
+
+    def set_color(self, index, rgba):
+        self.colors[index] = rgba
+        self.lut[index + 1] = rgba
+        self.version += 1
+
+    # pixel value for an ARGB color: its index, or the nearest color's
+    def index(self, rgba):
+        if rgba >> 24 == 0 or not self.colors:
+            return 0
+        if rgba in self.colors:
+            return self.colors.index(rgba) + 1
+        channels = np.array(self.colors, np.uint32).view(np.uint8).reshape(-1, 4).astype(np.int32)
+        target = np.array([rgba], np.uint32).view(np.uint8).astype(np.int32)
+        return int(((channels - target) ** 2).sum(axis=1).argmin()) + 1
+
+
+# every non-transparent color used on the canvases, or None once there are
+# more than a palette can hold
+def used_colors(canvases, limit=MAX_COLORS):
+    colors = set()
+    for canvas in canvases:
+        for tile in canvas.tiles.values():
+            colors.update(np.unique(tile[(tile >> 24) != 0]).tolist())
+            if len(colors) > limit:
+                return None
+    return sorted(colors)
+
+
+# an ARGB canvas as indices into palette, which has to hold all its colors
+def indexed_canvas(canvas, palette):
+    colors = np.array(palette.colors, np.uint32)
+    order = np.argsort(colors)
+    keys = colors[order]
+    out = TiledCanvas(canvas.width, canvas.height, canvas.tile_size, np.uint8)
+    for key, tile in canvas.tiles.items():
+        positions = np.minimum(np.searchsorted(keys, tile), len(keys) - 1)
+        indices = (order[positions] + 1).astype(np.uint8)
+        indices[(tile >> 24) == 0] = 0
+        out.tiles[key] = indices
+    out.compact(list(out.tiles))
+    return out
+
+
+# ARGB pixels as indices into palette, each color mapped to its nearest one
+def indexed_pixels(pixels, palette):
+    colors, inverse = np.unique(pixels, return_inverse=True)
+    indices = np.array([palette.index(color) for color in colors.tolist()], np.uint8)
+    return indices[inverse].reshape(pixels.shape)
+
+
+def argb_canvas(canvas, palette):
+    out = TiledCanvas(canvas.width, canvas.height, canvas.tile_size)
+    for key, tile in canvas.tiles.items():
+        out.tiles[key] = palette.lut[tile]
+    out.compact(list(out.tiles))
+    return out
@@ -0,0 +1,254 @@
+import hashlib
+import os
+import queue
+import time
+from collections import OrderedDict
+import numpy as np
+from PySide6.QtGui import QImage
+from PySide6.QtCore import QThread, Signal
+
+from canvas import image_array
+from raster import DITHER_MODES, sample_grid, luminance, dither, raster_commands
+
+# Vendor ID and Product ID from lsusb output
+VENDOR_ID = 0x0416
+PRODUCT_ID = 0x5011
+INTERFACE_NUMBER = 0  # The interface number found in the lsusb output
+ENDPOINT_ADDRESS = 0x03
+PRINTER_WIDTH = 576
+
+CHUNK_SIZE = 4096
+RETRIES = 3
+WRITE_TIMEOUT = 5000  # ms
+
+# set to a file path to print into that file instead of the usb printer
+PRINTER_FILE_ENV = "PIXEL_EDITOR_PRINTER_FILE"
+
+
+class PrinterError(Exception):
+    pass
+
+
+# the receipt printer on usb. the handle is opened once and kept until close()
+class UsbPrinter:
+    def __init__(self, vendor_id=VENDOR_ID, product_id=PRODUCT_ID, interface=INTERFACE_NUMBER, endpoint=ENDPOINT_ADDRESS):
+        self.vendor_id = vendor_id
+        self.product_id = product_id
+        self.interface = interface
+        self.endpoint = endpoint
+        self.context = None
+        self.handle = None
+
+    def is_open(self):
+        return self.handle is not None
+
+    def open(self):
+        import usb1
+
+        self.context = usb1.USBContext()
+        for device in self.context.getDeviceList(skip_on_error=True):
+            if device.getVendorID() == self.vendor_id and device.getProductID() == self.product_id:
+                self.handle = device.open()
+                print(f"Device found: {device}")
+                break
+        if self.handle is None:
+            self.close()
+            raise PrinterError("No USB device found.")
+
+        try:
+            # Detach the kernel driver if necessary
+            if self.handle.kernelDriverActive(self.interface):
+                self.handle.detachKernelDriver(self.interface)
+                print("Kernel driver detached.")
+        except usb1.USBErrorNotFound:
+            pass
+
+        try:
+            self.handle.claimInterface(self.interface)
+        except usb1.USBErrorBusy as e:
+            self.close()
+            raise PrinterError(f"Could not claim interface {self.interface}: {e}")
+
+    def write(self, data):
+        import usb1
+
+        try:
+            self.handle.bulkWrite(self.endpoint, data, timeout=WRITE_TIMEOUT)
+        except usb1.USBError as e:
+            raise PrinterError(str(e))
+
+    def close(self):
+        if self.handle is not None:
+            try:
+                self.handle.releaseInterface(self.interface)
+            except Exception:
+                pass
+            self.handle.close()
+            self.handle = None
+        if self.context is not None:
+            self.context.close()
+            self.context = None
+
+
+# fake printer that appends everything it is sent to a file, for testing
+# without the hardware
+class FilePrinter:
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def is_open(self):
+        return self.file is not None
+
+    def open(self):
+        try:
+            self.file = open(self.path, "ab")
+        except OSError as e:
+            raise PrinterError(str(e))
+
+    def write(self, data):
+        self.file.write(data)
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+# ESC/POS byte streams of recent jobs keyed by content hash, so a reprint
+# skips the dithering
+CACHE_SIZE = 16
+escpos_cache = OrderedDict()
+
+
+# nearest-neighbor resample of an image or TiledCanvas to the printer width.
+# the pixels are gathered straight from the image bits / tiles, and the result
+# is a fresh array the print thread can own. lut maps an indexed canvas to ARGB
+def printer_pixels(source, width=PRINTER_WIDTH, lut=None):
+    if isinstance(source, QImage):
+        image = source.convertToFormat(QImage.Format_ARGB32)
+        xs, ys = sample_grid(image.width(), image.height(), width)
+        return image_array(image)[np.ix_(ys, xs)]
+    xs, ys = sample_grid(source.width, source.height, width)
+    pixels = source.sample(xs, ys)
+    return pixels if lut is None else lut[pixels]
+
+
+# ESC/POS commands for printing printer_pixels() with the usual banner around it
+def render_escpos(pixels, mode=DITHER_MODES[0]):
+    key = (hashlib.sha1(pixels.tobytes()).digest(), pixels.shape, mode)
+    data = escpos_cache.get(key)
+    if data is not None:
+        escpos_cache.move_to_end(key)
+        return data
+
+    from escpos.printer import Dummy
+
+    dummy_printer = Dummy()
+    dummy_printer.text("###############################################\n")
+    dummy_printer.text("\n")
+    dummy_printer._raw(raster_commands(dither(luminance(pixels), mode)))
+    dummy_printer.text("\n")
+    dummy_printer.text("###############################################\n")
+    dummy_printer.text("### Thanks for using Joseph's pixel editor. ###\n")
+    dummy_printer.cut()
+    data = dummy_printer.output
+
+    escpos_cache[key] = data
+    if len(escpos_cache) > CACHE_SIZE:
+        escpos_cache.popitem(last=False)
+    return data
+
+
+# background print queue. jobs are rendered and sent on a worker thread in
+# chunked bulk writes, a failed chunk reopens the device and is retried, and
+# progress and results come back through signals (delivered on the GUI thread)
+class PrintService(QThread):
+    job_queued = Signal(int)
+    job_progress = Signal(int, int, int)  # job id, bytes sent, total bytes
+    job_finished = Signal(int)
+    job_failed = Signal(int, str)
+    status = Signal(str)
+
+    def __init__(self, device=None, chunk_size=CHUNK_SIZE, retries=RETRIES):
+        super().__init__()
+        if device is None:
+            path = os.environ.get(PRINTER_FILE_ENV)
+            device = FilePrinter(path) if path else UsbPrinter()
+        self.device = device
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.jobs = queue.Queue()
+        self.next_job_id = 1
+
+    # queue a QImage, a TiledCanvas (indexed ones with their lut) or ready
+    # made ESC/POS bytes and return the job id. images are resampled to the
+    # printer width here, so the print thread never touches pixels the GUI
+    # thread owns
+    def submit(self, job, mode=DITHER_MODES[0], lut=None):
+        job_id = self.next_job_id
+        self.next_job_id += 1
+        if not isinstance(job, (bytes, bytearray)):
+            job = printer_pixels(job, lut=lut)
+        self.jobs.put((job_id, job, mode))
+        self.job_queued.emit(job_id)
+        if not self.isRunning():
+            self.start()
+        return job_id
+
+    def pending(self):
+        return self.jobs.qsize()
+
+    def stop(self):
+        if self.isRunning():
+            self.jobs.put(None)
+            self.wait()
+
+    def run(self):
+        while True:
+            item = self.jobs.get()
+            if item is None:
+                break
+            job_id, job, mode = item
+            try:
+                data = render_escpos(job, mode) if isinstance(job, np.ndarray) else bytes(job)
+                self.send(job_id, data)
+            except Exception as e:
+                self.status.emit(f"Print failed: {e}")
+                self.job_failed.emit(job_id, str(e))
+            else:
+                self.status.emit("Printed successfully.")
+                self.job_finished.emit(job_id)
+        self.device.close()
+
+    def send(self, job_id, data):
+        total = len(data)
+        for offset in range(0, total, self.chunk_size):
+            self.write_chunk(data[offset:offset + self.chunk_size])
+            self.job_progress.emit(job_id, min(offset + self.chunk_size, total), total)
+
+    def write_chunk(self, chunk):
+        for attempt in range(self.retries + 1):
+            try:
+                if not self.device.is_open():
+                    self.device.open()
+                self.device.write(chunk)
+                return
+            except PrinterError as e:
+                self.device.close()
+                if attempt == self.retries:
+                    raise
+                self.status.emit(f"Printer error, retrying ({attempt + 1}/{self.retries}): {e}")
+                time.sleep(0.2 * 2 ** attempt)
+
+
+service = None
+
+
+# the print service shared by every editor window
+def print_service():
+    global service
+    if service is None:
+        service = PrintService()
+    return service
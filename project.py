@@ -0,0 +1,374 @@
+import json
+import mmap
+import os
+import struct
+import zlib
+import numpy as np
+
+from canvas import TiledCanvas
+from history import History, HistoryEntry, PackedTile
+from layers import LayerStack
+from animation import Frame, Timeline, FRAME_DURATION
+from palette import Palette
+
+PROJECT_FILTER = "Pixel Art Projects (*.pxproj)"
+MAGIC = b"PXPROJ\x00\x01"
+HEADER = struct.Struct("<8sQQ")  # magic, index offset, index length
+COMPACT_RATIO = 0.5  # rewrite the whole file once more than this much of it is stale
+
+
+class ProjectError(Exception):
+    pass
+
+
+# everything one save writes, captured on the GUI thread. only tiles changed
+# since the last save are copied; history states are never modified after
+# they're recorded, so they're shared as they are
+class ProjectSnapshot:
+    def __init__(self, editor, frames, full):
+        timeline = editor.timeline
+        self.width = timeline.width
+        self.height = timeline.height
+        self.tile_size = editor.canvas.tile_size
+        self.indexed = editor.is_indexed()
+        self.current = timeline.current
+        self.frames = [FrameSnapshot(frame, layers) for frame, layers in frames]
+        position = {id(layer.canvas): (f, i) for f, frame in enumerate(timeline.frames)
+                    for i, layer in enumerate(frame.layers.layers)}
+        self.undo = [(position[id(entry.canvas)], history_states(entry))
+                     for entry in editor.history.undo_entries if id(entry.canvas) in position]
+        self.redo = [(position[id(entry.canvas)], history_states(entry))
+                     for entry in editor.history.redo_entries if id(entry.canvas) in position]
+        self.palette = [color.rgba() for color in editor.palette]
+        self.color = editor.current_color.rgba()
+        transform = editor.transform()
+        self.view = {"transform": [transform.m11(), transform.m12(), transform.m21(), transform.m22(),
+                                   transform.dx(), transform.dy()],
+                     "scroll": [editor.horizontalScrollBar().value(), editor.verticalScrollBar().value()]}
+        self.full = full
+
+
+class FrameSnapshot:
+    def __init__(self, frame, layers):
+        self.duration = frame.duration
+        self.active = frame.layers.active
+        self.layers = [LayerSnapshot(layer, keys, dirty) for layer, keys, dirty in layers]
+
+
+class LayerSnapshot:
+    def __init__(self, layer, keys, dirty):
+        self.canvas = layer.canvas
+        self.version = layer.canvas.version
+        self.properties = {"name": layer.name, "visible": layer.visible, "opacity": layer.opacity,
+                           "blend": layer.blend, "locked": layer.locked}
+        self.keys = keys
+        # key -> owned tile copy, or the value of a shared solid tile
+        self.dirty = {key: tile_value(layer.canvas.tiles[key], copy=True) for key in dirty}
+
+
+# shared read-only tiles are uniform and saved as just their value
+def tile_value(tile, copy=False):
+    if tile is None or isinstance(tile, PackedTile):
+        return tile
+    if not tile.flags.writeable:
+        return tile.flat[0].item()
+    return tile.copy() if copy else tile
+
+
+def history_states(entry):
+    return [(key, tile_value(before), tile_value(after)) for key, before, after in entry.tiles]
+
+
+# a project file: a header pointing at a zlib-compressed JSON index, and one
+# zlib-compressed chunk per tile and per recorded history tile. saving again
+# appends only the chunks that changed plus a new index, then repoints the
+# header, so an interrupted save leaves the previous save intact. once stale
+# chunks make up too much of the file it is rewritten in full
+class ProjectFile:
+    def __init__(self, path):
+        self.path = path
+        # id(layer canvas) -> (canvas, version, {key: chunk ref}) as of the last save
+        self.saved = {}
+        self.state_refs = {}  # id(history state) -> (state, chunk ref)
+        self.file_size = 0
+        self.live_bytes = 0
+
+    # snapshot of the editor for write(). cheap unless full, which copies
+    # every tile (used for the first save); layers not in the last save are
+    # copied whole
+    def capture(self, editor, full=False):
+        full = full or not self.saved or not self.intact()
+        frames = []
+        for frame in editor.timeline.frames:
+            layers = []
+            for layer in frame.layers.layers:
+                canvas = layer.canvas
+                keys = list(canvas.tiles)
+                saved = self.saved.get(id(canvas))
+                if full or saved is None or saved[0] is not canvas:
+                    dirty = keys
+                else:
+                    dirty = [key for key in canvas.changed_since(saved[1]) if key in canvas.tiles]
+                layers.append((layer, keys, dirty))
+            frames.append((frame, layers))
+        return ProjectSnapshot(editor, frames, full)
+
+    # the file is as the last save or load left it. once it's removed or
+    # changed by something else, its chunks can't be reused
+    def intact(self):
+        try:
+            return os.path.getsize(self.path) == self.file_size
+        except OSError:
+            return False
+
+    # encode and write a snapshot. safe to call off the GUI thread, but not
+    # concurrently with another write to the same file
+    def write(self, snapshot):
+        rewrite = snapshot.full or self.file_size == 0 or not self.intact() or \
+            self.file_size - self.live_bytes > self.file_size * COMPACT_RATIO
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if rewrite:
+            temp_path = self.path + ".tmp"
+            with self.open_old(snapshot) as old:
+                with open(temp_path, "wb") as f:
+                    f.write(HEADER.pack(MAGIC, 0, 0))
+                    written = self.write_chunks(f, snapshot, old)
+                    file_size = self.finish(f, written[0])
+            os.replace(temp_path, self.path)
+        else:
+            with open(self.path, "r+b") as f:
+                f.seek(self.file_size)
+                written = self.write_chunks(f, snapshot, None, appending=True)
+                file_size = self.finish(f, written[0])
+        # only now that the header points at them do the new chunks count
+        _, self.saved, self.state_refs, self.live_bytes = written
+        self.file_size = file_size
+
+    # the current file mapped for copying its unchanged chunks into a
+    # rewrite. a snapshot that isn't full needs them, so if the file went
+    # away since it was captured the save fails, and the next one is full
+    def open_old(self, snapshot):
+        if snapshot.full:
+            return NoFile()
+        try:
+            if not self.intact():
+                raise OSError("the file was changed or removed")
+            with open(self.path, "rb") as f:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            self.saved = {}
+            self.state_refs = {}
+            raise ProjectError(f"Cannot save {self.path}, try again: {e}")
+
+    # old is the mapped file to copy unchanged chunks from, or None when
+    # appending to it (they stay where they are) or writing in full
+    def write_chunks(self, f, snapshot, old, appending=False):
+        live = 0
+
+        def chunk(data):
+            nonlocal live
+            offset = f.tell()
+            f.write(data)
+            live += len(data)
+            return [offset, len(data)]
+
+        def kept(ref):
+            if isinstance(ref, list):
+                return use(ref) if appending else chunk(old[ref[0]:ref[0] + ref[1]])
+            return ref
+
+        def use(ref):
+            nonlocal live
+            live += ref[1]
+            return ref
+
+        def encode(value):
+            if isinstance(value, int):
+                return {"solid": value}
+            return chunk(zlib.compress(value.tobytes(), 1))
+
+        saved = {}
+        frames = []
+        for frame in snapshot.frames:
+            layers = []
+            for layer in frame.layers:
+                old_refs = self.saved[id(layer.canvas)][2] if len(layer.dirty) < len(layer.keys) else {}
+                tile_refs = {key: encode(layer.dirty[key]) if key in layer.dirty else kept(old_refs[key])
+                             for key in layer.keys}
+                saved[id(layer.canvas)] = (layer.canvas, layer.version, tile_refs)
+                layers.append(dict(layer.properties, tiles=[[key[0], key[1], ref] for key, ref in tile_refs.items()]))
+            frames.append({"duration": frame.duration, "active": frame.active, "layers": layers})
+
+        state_refs = {}
+        # a full write has nothing to copy from, so every state is encoded again
+        previous = self.state_refs if appending or old is not None else {}
+
+        def state_ref(state):
+            if state is None:
+                return None
+            if isinstance(state, int):
+                return {"solid": state}
+            if id(state) in state_refs:
+                return state_refs[id(state)][1]
+            saved = previous.get(id(state))
+            if saved is not None and saved[0] is state:
+                ref = kept(saved[1])
+            elif isinstance(state, PackedTile):
+                ref = chunk(state.data)
+            else:
+                ref = encode(state)
+            state_refs[id(state)] = (state, ref)
+            return ref
+
+        def entries(states):
+            return [{"frame": frame, "layer": layer, "tiles": [[key[0], key[1], state_ref(before), state_ref(after)]
+                                                               for key, before, after in entry]}
+                    for (frame, layer), entry in states]
+
+        index = {
+            "width": snapshot.width,
+            "height": snapshot.height,
+            "tile_size": snapshot.tile_size,
+            "indexed": snapshot.indexed,
+            "frames": frames,
+            "frame": snapshot.current,
+            "undo": entries(snapshot.undo),
+            "redo": entries(snapshot.redo),
+            "palette": snapshot.palette,
+            "color": snapshot.color,
+            "view": snapshot.view,
+        }
+        index_ref = chunk(zlib.compress(json.dumps(index).encode()))
+        return HEADER.pack(MAGIC, index_ref[0], index_ref[1]), saved, state_refs, live + HEADER.size
+
+    # point the header at the new index once everything else is on disk,
+    # returning the file size
+    def finish(self, f, header):
+        f.flush()
+        os.fsync(f.fileno())
+        file_size = f.tell()
+        f.seek(0)
+        f.write(header)
+        f.flush()
+        os.fsync(f.fileno())
+        return file_size
+
+
+class NoFile:
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc):
+        return False
+
+
+# read a project file. the file is memory-mapped and only the index and the
+# layer tiles are decompressed; history tiles stay compressed until an undo
+# or redo needs them. returns a ProjectFile ready for incremental saves, with
+# timeline, layers (of the current frame), history, palette, color and view
+# attributes holding what was read
+def load_project(path):
+    try:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            magic, index_offset, index_length = HEADER.unpack_from(data)
+            if magic != MAGIC:
+                raise ProjectError(f"{path} is not a pixel art project")
+            index = json.loads(zlib.decompress(data[index_offset:index_offset + index_length]))
+            project = ProjectFile(path)
+            width, height, tile_size = index["width"], index["height"], index["tile_size"]
+            shape = (tile_size, tile_size)
+            # indexed projects store palette indices, one byte per pixel
+            palette = Palette(index["palette"]) if index.get("indexed") else None
+            dtype = np.uint32 if palette is None else np.uint8
+            live = index_length
+
+            def read_canvas(saved_tiles):
+                nonlocal live
+                canvas = TiledCanvas(width, height, tile_size, dtype)
+                refs = {}
+                for tx, ty, ref in saved_tiles:
+                    if isinstance(ref, dict):
+                        canvas.tiles[(tx, ty)] = canvas.solid_tile(ref["solid"])
+                    else:
+                        offset, length = ref
+                        pixels = zlib.decompress(data[offset:offset + length])
+                        canvas.tiles[(tx, ty)] = np.frombuffer(pixels, canvas.dtype).reshape(shape).copy()
+                        live += length
+                    refs[(tx, ty)] = ref
+                project.saved[id(canvas)] = (canvas, canvas.version, refs)
+                return canvas
+
+            def read_layers(saved_layers, active):
+                layers = None
+                for saved in saved_layers:
+                    canvas = read_canvas(saved["tiles"])
+                    if layers is None:
+                        layers = LayerStack(width, height, canvas, palette)
+                        layers.layers[0].name = saved["name"]
+                        layer = layers.layers[0]
+                    else:
+                        layer = layers.add_layer(canvas, saved["name"])
+                    layer.visible = saved.get("visible", True)
+                    layer.opacity = saved.get("opacity", 1.0)
+                    layer.blend = saved.get("blend", "normal")
+                    layer.locked = saved.get("locked", False)
+                layers.active = active
+                layers.next_name = len(layers.layers) + 1
+                return layers
+
+            # files from before animation hold one frame, and files from
+            # before layers a single canvas
+            saved_frames = index.get("frames") or [{
+                "layers": index.get("layers") or [{"name": "Layer 1", "tiles": index["tiles"]}],
+                "active": index.get("active", 0)}]
+            timeline = None
+            for saved in saved_frames:
+                layers = read_layers(saved["layers"], saved["active"])
+                if timeline is None:
+                    timeline = Timeline(layers)
+                else:
+                    timeline.frames.append(Frame(layers))
+                timeline.frames[-1].duration = saved.get("duration", FRAME_DURATION)
+            timeline.current = index.get("frame", 0)
+
+            def state(canvas, ref):
+                nonlocal live
+                if ref is None:
+                    return None
+                if isinstance(ref, dict):
+                    return canvas.solid_tile(ref["solid"])
+                offset, length = ref
+                packed = PackedTile.from_data(data[offset:offset + length], shape, canvas.dtype)
+                project.state_refs[id(packed)] = (packed, ref)
+                live += length
+                return packed
+
+            def entries(saved):
+                loaded = []
+                for entry in saved:
+                    if isinstance(entry, list):
+                        entry = {"layer": 0, "tiles": entry}
+                    canvas = timeline.frames[entry.get("frame", 0)].layers.layers[entry["layer"]].canvas
+                    tiles = [((tx, ty), state(canvas, before), state(canvas, after)) for tx, ty, before, after in entry["tiles"]]
+                    loaded_entry = HistoryEntry(tiles, canvas)
+                    loaded_entry.compressed = True
+                    loaded.append(loaded_entry)
+                return loaded
+
+            history = History()
+            history.undo_entries = entries(index["undo"])
+            history.redo_entries = entries(index["redo"])
+            project.file_size = len(data)
+    except (KeyError, IndexError, ValueError, TypeError, struct.error, zlib.error) as e:
+        raise ProjectError(f"{path} is damaged: {e}")
+
+    project.live_bytes = live + HEADER.size
+    project.timeline = timeline
+    project.layers = timeline.frame.layers
+    project.history = history
+    project.palette = index["palette"]
+    project.color = index["color"]
+    project.view = index["view"]
+    return project
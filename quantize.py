@@ -0,0 +1,127 @@
+import numpy as np
+
+CHUNK_ROWS = 64  # rows per k-means assignment task
+KMEANS_ITERATIONS = 8
+CONVERGED = 0.5  # stop once no color moves further than this (0-255 units)
+
+
+# area-average ARGB32 pixels down to width x height. each output row is
+# summed from its band of source rows on its own, so a large photo is never
+# converted to floats all at once. colors are averaged premultiplied, so
+# transparent pixels don't bleed into their neighbours
+def downsample(pixels, width, height):
+    h, w = pixels.shape
+    rows = np.linspace(0, h, height + 1).astype(int)
+    columns = np.linspace(0, w, width + 1).astype(int)
+    widths = np.diff(columns)[:, None]
+    out = np.zeros((height, width, 4), np.float32)
+    for y in range(height):
+        band = pixels[rows[y]:max(rows[y + 1], rows[y] + 1)]
+        channels = band.view(np.uint8).reshape(band.shape + (4,)).astype(np.float32)
+        channels[..., :3] *= channels[..., 3:] / 255
+        out[y] = np.add.reduceat(channels.sum(axis=0), columns[:-1], axis=0) / (widths * len(band))
+    alpha = out[..., 3:]
+    out[..., :3] /= np.maximum(alpha / 255, 1e-6)
+    return pack_argb(out[..., :3], alpha[..., 0])
+
+
+def pack_argb(bgr, alpha):
+    channels = np.empty(alpha.shape + (4,), np.uint8)
+    channels[..., :3] = np.rint(np.clip(bgr, 0, 255))
+    channels[..., 3] = np.rint(np.clip(alpha, 0, 255))
+    return channels.view(np.uint32).reshape(alpha.shape)
+
+
+# opaque pixels as float BGR rows, plus the mask they were taken from.
+# anything under half alpha counts as transparent
+def opaque_colors(pixels):
+    mask = (pixels >> 24) >= 128
+    colors = pixels[mask].view(np.uint8).reshape(-1, 4)[:, :3].astype(np.float32)
+    return colors, mask
+
+
+# median cut: split the box of colors with the widest channel range at its
+# weighted median until there are n boxes, returning their mean colors
+def median_cut(colors, n):
+    unique, counts = np.unique(colors.astype(np.uint8), axis=0, return_counts=True)
+    unique = unique.astype(np.float32)
+
+    def box(indices):
+        values = unique[indices]
+        spans = values.max(axis=0) - values.min(axis=0) if len(indices) > 1 else np.zeros(3)
+        return indices, spans
+
+    boxes = [box(np.arange(len(unique)))]
+    while len(boxes) < n:
+        widest = max(range(len(boxes)), key=lambda i: boxes[i][1].max())
+        indices, spans = boxes[widest]
+        if spans.max() == 0:
+            break
+        boxes.pop(widest)
+        order = indices[np.argsort(unique[indices, spans.argmax()], kind="stable")]
+        weights = np.cumsum(counts[order])
+        split = int(np.clip(np.searchsorted(weights, weights[-1] / 2), 1, len(order) - 1))
+        boxes += [box(order[:split]), box(order[split:])]
+    return np.array([np.average(unique[indices], axis=0, weights=counts[indices]) for indices, _ in boxes],
+                    np.float32)
+
+
+# one k-means assignment task: the nearest center of every color in a chunk,
+# and the per-center sums and counts for the update step
+def assign(colors, centers):
+    distances = (centers ** 2).sum(axis=1) - 2 * colors @ centers.T
+    labels = distances.argmin(axis=1)
+    counts = np.bincount(labels, minlength=len(centers))
+    sums = np.stack([np.bincount(labels, colors[:, c], len(centers)) for c in range(3)], axis=1)
+    return labels, sums, counts
+
+
+# refine centers with k-means. the assignment runs one chunk of rows per
+# task through map_chunks (a process pool's map, or the builtin map), and
+# stop() is polled between iterations to give up on a stale job
+def kmeans(colors, centers, map_chunks=map, iterations=KMEANS_ITERATIONS, stop=lambda: False):
+    chunk = CHUNK_ROWS * 256
+    chunks = [colors[i:i + chunk] for i in range(0, len(colors), chunk)]
+    for _ in range(iterations):
+        if stop():
+            return None
+        results = list(map_chunks(assign, chunks, [centers] * len(chunks)))
+        sums = sum(result[1] for result in results)
+        counts = sum(result[2] for result in results)
+        # a center nobody picked keeps its place
+        moved = np.where(counts[:, None] > 0, sums / np.maximum(counts, 1)[:, None], centers).astype(np.float32)
+        shift = np.abs(moved - centers).max()
+        centers = moved
+        if shift < CONVERGED:
+            break
+    return centers
+
+
+# pixels as palette indices (0 transparent, i the (i - 1)th color) and the
+# ARGB palette. with palette given the pixels are only mapped onto it;
+# otherwise n colors are picked by median cut and, when refine, k-means
+def quantize(pixels, n, palette=None, refine=True, map_chunks=map, stop=lambda: False):
+    colors, mask = opaque_colors(pixels)
+    indices = np.zeros(pixels.shape, np.uint8)
+    if len(colors) == 0:
+        return indices, list(palette or [])
+    if palette is not None:
+        centers = np.array(palette, np.uint32).view(np.uint8).reshape(-1, 4)[:, :3].astype(np.float32)
+    else:
+        centers = median_cut(colors, n)
+        if refine:
+            centers = kmeans(colors, centers, map_chunks, stop=stop)
+            if centers is None:
+                return None
+    chunk = CHUNK_ROWS * 256
+    labels = np.concatenate([result[0] for result in map_chunks(
+        assign, [colors[i:i + chunk] for i in range(0, len(colors), chunk)],
+        [centers] * ((len(colors) + chunk - 1) // chunk))])
+    if palette is not None:
+        indices[mask] = labels + 1
+        return indices, list(palette)
+    # drop colors nothing ended up using
+    used, labels = np.unique(labels, return_inverse=True)
+    indices[mask] = labels.ravel() + 1
+    argb = pack_argb(centers[used], np.full(len(used), 255, np.float32))
+    return indices, argb.tolist()
@@ -0,0 +1,85 @@
+import numpy as np
+
+from export import rgb_on_white
+
+DITHER_MODES = ["floyd-steinberg", "ordered", "threshold"]
+RASTER_BAND = 960  # rows per GS v 0 command, same split as python-escpos
+
+# 8x8 Bayer matrix
+BAYER = np.array([[0, 32, 8, 40, 2, 34, 10, 42],
+                  [48, 16, 56, 24, 50, 18, 58, 26],
+                  [12, 44, 4, 36, 14, 46, 6, 38],
+                  [60, 28, 52, 20, 62, 30, 54, 22],
+                  [3, 35, 11, 43, 1, 33, 9, 41],
+                  [51, 19, 59, 27, 49, 17, 57, 25],
+                  [15, 47, 7, 39, 13, 45, 5, 37],
+                  [63, 31, 55, 23, 61, 29, 53, 21]])
+BAYER_THRESHOLDS = (BAYER + 0.5) * 4
+
+
+# source columns and rows picked for a nearest-neighbor scale of a
+# width x height image to out_width dots across
+def sample_grid(width, height, out_width):
+    out_height = max(1, round(height * out_width / width))
+    xs = np.arange(out_width) * width // out_width
+    ys = np.arange(out_height) * height // out_height
+    return xs, ys
+
+
+# ARGB32 pixels composited onto white as 0-255 luminance (ITU-R 601, like PIL's "L")
+def luminance(pixels):
+    return rgb_on_white(pixels) @ np.array([0.299, 0.587, 0.114], np.float32)
+
+
+# bool rasters, True where the printer puts a dot
+def threshold(gray):
+    return gray < 128
+
+
+def ordered(gray):
+    h, w = gray.shape
+    return gray < BAYER_THRESHOLDS[np.arange(h)[:, None] % 8, np.arange(w) % 8]
+
+
+# Floyd-Steinberg error diffusion. a pixel only depends on its left neighbour
+# and the three above it, so every pixel on a line x + 2y = t can be done at
+# once and the whole image takes width + 2 * height vectorized steps
+def floyd_steinberg(gray):
+    h, w = gray.shape
+    # one pixel of padding on the left, right and bottom swallows the error
+    # pushed off the edges
+    work = np.zeros((h + 1, w + 2), np.float32)
+    work[:h, 1:w + 1] = gray
+    black = np.zeros((h, w), bool)
+    all_rows = np.arange(h)
+    for t in range(w + 2 * (h - 1)):
+        rows = all_rows[max(0, (t - w + 2) // 2):min(h, t // 2 + 1)]
+        cols = t - 2 * rows + 1
+        old = work[rows, cols]
+        dots = old < 128
+        black[rows, cols - 1] = dots
+        error = np.where(dots, old, old - 255)
+        work[rows, cols + 1] += error * (7 / 16)
+        work[rows + 1, cols - 1] += error * (3 / 16)
+        work[rows + 1, cols] += error * (5 / 16)
+        work[rows + 1, cols + 1] += error * (1 / 16)
+    return black
+
+
+DITHERS = {"floyd-steinberg": floyd_steinberg, "ordered": ordered, "threshold": threshold}
+
+
+def dither(gray, mode):
+    return DITHERS[mode](gray)
+
+
+# GS v 0 raster bit image commands for a bool raster, in bands of RASTER_BAND rows
+def raster_commands(black):
+    bits = np.packbits(black, axis=1)
+    width_bytes = bits.shape[1]
+    commands = []
+    for y in range(0, len(bits), RASTER_BAND):
+        band = bits[y:y + RASTER_BAND]
+        commands.append(b"\x1dv0\x00" + width_bytes.to_bytes(2, "little") + len(band).to_bytes(2, "little"))
+        commands.append(band.tobytes())
+    return b"".join(commands)
@@ -0,0 +1,29 @@
+import sys
+import time
+
+
+# wall time spent in each phase of startup, printed with --profile-startup
+class StartupProfile:
+    def __init__(self):
+        self.enabled = "--profile-startup" in sys.argv
+        self.start = time.perf_counter()
+        self.last = self.start
+        self.phases = []
+
+    # close the current phase under the given name
+    def mark(self, name):
+        now = time.perf_counter()
+        self.phases.append((name, now - self.last))
+        self.last = now
+
+    def report(self):
+        if not self.enabled:
+            return
+        total = self.last - self.start
+        print("startup profile:")
+        for name, seconds in self.phases:
+            print(f"  {name:<24} {seconds * 1000:8.1f} ms  {seconds / total * 100 if total else 0:5.1f}%")
+        print(f"  {'total':<24} {total * 1000:8.1f} ms")
+
+
+profile = StartupProfile()
@@ -0,0 +1,79 @@
+from PySide6.QtCore import QRect
+import numpy as np
+
+BRUSH_SHAPES = ["round", "square"]
+BRUSH_SIZES = range(1, 21)  # range offered by the brush size spin box
+STROKE_CHUNK = 64
+
+
+# bool mask of a brush with its pixel offsets from the stroke point
+class BrushStamp:
+    def __init__(self, mask):
+        self.mask = np.asarray(mask, bool)
+        h, w = self.mask.shape
+        ys, xs = np.nonzero(self.mask)
+        self.dy = ys - (h - 1) // 2
+        self.dx = xs - (w - 1) // 2
+
+
+def make_stamp(shape, size):
+    if shape == "square":
+        return BrushStamp(np.ones((size, size), bool))
+    # disc with its edge pulled in a quarter pixel so small sizes look like
+    # round pen dots (size 3 is a plus, not a square)
+    center = (size - 1) / 2
+    radius = size / 2 - 0.25
+    ys, xs = np.mgrid[:size, :size]
+    return BrushStamp((xs - center) ** 2 + (ys - center) ** 2 <= radius * radius)
+
+
+STAMPS = {(shape, size): make_stamp(shape, size) for shape in BRUSH_SHAPES for size in BRUSH_SIZES}
+
+
+def brush_stamp(shape, size):
+    stamp = STAMPS.get((shape, size))
+    if stamp is None:
+        stamp = STAMPS[(shape, size)] = make_stamp(shape, size)
+    return stamp
+
+
+# every pixel of the line from (x1, y1) to (x2, y2), one per step along the major axis
+def line_points(x1, y1, x2, y2):
+    steps = max(abs(x2 - x1), abs(y2 - y1))
+    if steps == 0:
+        return np.array([x1]), np.array([y1])
+    t = np.arange(steps + 1) / steps
+    xs = np.floor(x1 + (x2 - x1) * t + 0.5).astype(np.intp)
+    ys = np.floor(y1 + (y2 - y1) * t + 0.5).astype(np.intp)
+    return xs, ys
+
+
+# line_points along each segment of a polyline of (x, y) points, without
+# repeating the joints
+def polyline_points(points):
+    if len(points) == 1:
+        return np.array([points[0][0]]), np.array([points[0][1]])
+    segments = [line_points(x1, y1, x2, y2) for (x1, y1), (x2, y2) in zip(points, points[1:])]
+    xs = np.concatenate([segments[0][0]] + [seg_xs[1:] for seg_xs, _ in segments[1:]])
+    ys = np.concatenate([segments[0][1]] + [seg_ys[1:] for _, seg_ys in segments[1:]])
+    return xs, ys
+
+
+# stamp the brush at every point in one fancy-indexed write, returning the
+# covered rect and a bool mask of the pixels inside it
+def stroke_mask(xs, ys, stamp):
+    xs = np.asarray(xs)
+    ys = np.asarray(ys)
+    x0 = int(xs.min() + stamp.dx.min())
+    y0 = int(ys.min() + stamp.dy.min())
+    x1 = int(xs.max() + stamp.dx.max())
+    y1 = int(ys.max() + stamp.dy.max())
+    mask = np.zeros((y1 - y0 + 1, x1 - x0 + 1), bool)
+    mask[(ys - y0)[:, None] + stamp.dy, (xs - x0)[:, None] + stamp.dx] = True
+    return QRect(x0, y0, x1 - x0 + 1, y1 - y0 + 1), mask
+
+
+# stroke_mask over runs of at most chunk points, so a long diagonal stroke
+# costs area along the line rather than its whole bounding box
+def stroke_masks(xs, ys, stamp, chunk=STROKE_CHUNK):
+    return [stroke_mask(xs[i:i + chunk], ys[i:i + chunk], stamp) for i in range(0, len(xs), chunk)]
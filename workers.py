@@ -0,0 +1,25 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+MAX_WORKERS = 8
+
+pool = None
+
+
+# worker processes shared by the background jobs (animation export, photo
+# import), started on first use and kept until the app exits. spawned rather
+# than forked so they never inherit Qt state
+def process_pool():
+    global pool
+    if pool is None:
+        pool = ProcessPoolExecutor(max_workers=max(1, min(os.cpu_count() or 1, MAX_WORKERS)),
+                                   mp_context=multiprocessing.get_context("spawn"))
+    return pool
+
+
+def shutdown_pool():
+    global pool
+    if pool is not None:
+        pool.shutdown(cancel_futures=True)
+        pool = None